@@ -0,0 +1,64 @@
+import numpy as np
+
+from rusty_mosaic import comparisons
+from rusty_mosaic.mosaic.adaptive_mosaic import AdaptiveImageMosaic
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+
+from . import common
+
+TILE_SIZES = (32, 16, common.TILE_SIZE)
+
+
+def photo_pixmap(size: int, image_type: str) -> np.ndarray:
+    """A flat gradient sky over a noisy foreground, like a typical landscape photo"""
+    pixmap = common.synthetic_pixmap(size, size, image_type)
+    y, x = np.mgrid[0:size, 0:size]
+    sky = np.clip(160 + 40 * y / size + 0.02 * x, 0, 255).astype(np.uint8)
+    horizon = size * 2 // 5
+    pixmap[:horizon] = sky[:horizon, :, None] if pixmap.ndim == 3 else sky[:horizon]
+    return pixmap
+
+
+class AdaptiveMatching:
+    """Matching a 1024 pixel photo with 32, 16 and 8 pixel tiles against a uniform 8 pixel grid"""
+
+    params = ([92, 1_000], ["L", "RGB"], [True, False])
+    param_names = ["n_tiles", "image_type", "adaptive"]
+    timeout = 300
+
+    def setup(self, n_tiles, image_type, adaptive):
+        pixmap = photo_pixmap(1_024, image_type)
+        self.tiles = {
+            tile_size: common.synthetic_tiles(n_tiles, tile_size, image_type)
+            for tile_size in TILE_SIZES
+        }
+        self.adaptive = AdaptiveImageMosaic(pixmap, TILE_SIZES)
+        self.uniform = ImageMosaic(
+            ImageMosaic._array_to_blocks(pixmap, common.TILE_SIZE),
+            common.TILE_SIZE,
+            pixmap.shape[0] // common.TILE_SIZE,
+        )
+
+    def _match(self, adaptive):
+        if adaptive:
+            return self.adaptive.replace_tiles(
+                self.tiles, cmp=comparisons.default_parallel_comparator
+            )
+        return self.uniform.replace_tiles(
+            self.tiles[common.TILE_SIZE],
+            cmp=comparisons.default_parallel_comparator,
+            lazy=True,
+        )
+
+    def time_replace_tiles(self, n_tiles, image_type, adaptive):
+        self._match(adaptive)
+
+    def time_render(self, n_tiles, image_type, adaptive):
+        self._match(adaptive).render()
+
+    def track_compared_blocks(self, n_tiles, image_type, adaptive):
+        if adaptive:
+            return self._match(adaptive).compared
+        return self.uniform.tile_data.shape[0]
+
+    track_compared_blocks.unit = "blocks"
@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+
+from . import common
+
+
+class Blocking:
+    """Splitting pixmaps into block matrices and reassembling them"""
+
+    params = ([512, 2_048, 4_096], ["L", "RGB"])
+    param_names = ["size", "image_type"]
+
+    def setup(self, size, image_type):
+        self.pixmap = common.synthetic_pixmap(size, size, image_type)
+        self.blocks = np.ascontiguousarray(
+            ImageMosaic._array_to_blocks(self.pixmap, common.TILE_SIZE)
+        )
+        self.rows = size // common.TILE_SIZE
+        self.blocks_out = np.empty_like(self.blocks)
+        self.pixmap_out = np.empty_like(self.pixmap)
+        tiles = common.synthetic_tiles(92, image_type=image_type)
+        self.lazy = ImageMosaic(
+            None,
+            common.TILE_SIZE,
+            self.rows,
+            tile_indices=np.arange(self.blocks.shape[0]) % 92,
+            tiles=tiles,
+        )
+
+    def time_array_to_blocks(self, size, image_type):
+        ImageMosaic._array_to_blocks(self.pixmap, common.TILE_SIZE, out=self.blocks_out)
+
+    def time_blocks_to_pixmap(self, size, image_type):
+        ImageMosaic._blocks_to_pixmap(
+            self.blocks, common.TILE_SIZE, self.rows, out=self.pixmap_out
+        )
+
+    def time_render_tile_indices(self, size, image_type):
+        self.lazy.render(out=self.pixmap_out)
+
+    def peakmem_array_to_blocks(self, size, image_type):
+        ImageMosaic._array_to_blocks(self.pixmap, common.TILE_SIZE)
+
+    def peakmem_render_tile_indices(self, size, image_type):
+        self.lazy.render()
+
+    def track_blocks_per_second(self, size, image_type):
+        start = time.perf_counter()
+        ImageMosaic._array_to_blocks(self.pixmap, common.TILE_SIZE, out=self.blocks_out)
+        ImageMosaic._blocks_to_pixmap(
+            self.blocks, common.TILE_SIZE, self.rows, out=self.pixmap_out
+        )
+        return self.blocks.shape[0] / (time.perf_counter() - start)
+
+    track_blocks_per_second.unit = "blocks/s"
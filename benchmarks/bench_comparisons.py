@@ -0,0 +1,73 @@
+import time
+
+from rusty_mosaic import ann
+from rusty_mosaic import autotune
+from rusty_mosaic import comparisons
+
+from . import common
+
+# a 512 x 512 image at tile size 8
+N_BLOCKS = 4_096
+
+
+class Comparators:
+    """Every registered TileComparator against libraries of 92 up to 50k tiles"""
+
+    params = (
+        list(comparisons.COMPARATORS) + ["ivf_distance", "auto"],
+        common.LIBRARY_SIZES,
+    )
+    param_names = ["comparator", "n_tiles"]
+    timeout = 600
+
+    def setup(self, comparator, n_tiles):
+        if comparator == "auto":
+            self.cmp = autotune.AutoComparator(profile_path=None)
+        elif comparator == "ivf_distance":
+            self.cmp = ann.IVFComparator()
+        else:
+            self.cmp = comparisons.COMPARATORS[comparator]
+        self.blocks = common.synthetic_blocks(N_BLOCKS)
+        self.tiles = common.synthetic_tiles(n_tiles).tile_data
+        try:
+            # also builds the index of comparators that keep one, and calibrates auto
+            # for this shape so its timings do not include the calibration
+            self.cmp(
+                self.blocks if comparator == "auto" else self.blocks[:1], self.tiles
+            )
+        except RuntimeError:
+            # the comparator needs the compiled extension
+            raise NotImplementedError
+
+    def time_match(self, comparator, n_tiles):
+        self.cmp(self.blocks, self.tiles)
+
+    def peakmem_match(self, comparator, n_tiles):
+        self.cmp(self.blocks, self.tiles)
+
+    def track_blocks_per_second(self, comparator, n_tiles):
+        start = time.perf_counter()
+        self.cmp(self.blocks, self.tiles)
+        return self.blocks.shape[0] / (time.perf_counter() - start)
+
+    track_blocks_per_second.unit = "blocks/s"
+
+
+class ThreadScaling:
+    """The exact Rust comparators on each thread count the auto comparator tries"""
+
+    params = (list(comparisons.THREADED_COMPARATORS), autotune.thread_counts())
+    param_names = ["comparator", "threads"]
+    timeout = 300
+
+    def setup(self, comparator, threads):
+        if not comparisons.RUST_AVAILABLE:
+            raise NotImplementedError
+        self.cmp = comparisons.threaded_comparator(comparator, threads)
+        self.blocks = common.synthetic_blocks(N_BLOCKS)
+        self.tiles = common.synthetic_tiles(1_000).tile_data
+        # starts the thread pool
+        self.cmp(self.blocks[:1], self.tiles)
+
+    def time_match(self, comparator, threads):
+        self.cmp(self.blocks, self.tiles)
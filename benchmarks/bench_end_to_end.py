@@ -0,0 +1,78 @@
+import shutil
+import pathlib
+import tempfile
+
+from rusty_mosaic import cli
+
+from . import common
+
+IMAGE_SIZES = [512, 2_048]
+GIF_SIZES = [128, 256]
+GIF_FRAMES = 24
+
+
+def mosaicfy(*args: str) -> None:
+    cli.app(list(args), standalone_mode=False)
+
+
+class StillImage:
+    """``mosaicfy IMAGE --outfile OUT`` with the bundled ASCII tiles"""
+
+    params = (IMAGE_SIZES, ["L", "RGB"], [False, True])
+    param_names = ["size", "image_type", "text"]
+    timeout = 300
+
+    def setup_cache(self):
+        root = pathlib.Path("images").absolute()
+        root.mkdir(exist_ok=True)
+        for size in IMAGE_SIZES:
+            for image_type in ["L", "RGB"]:
+                common.write_image(root / f"{image_type}-{size}.png", size, image_type)
+        return str(root)
+
+    def setup(self, root, size, image_type, text):
+        self.infile = str(pathlib.Path(root) / f"{image_type}-{size}.png")
+        self.workdir = tempfile.mkdtemp()
+        self.outfile = str(
+            pathlib.Path(self.workdir) / ("out.txt" if text else "out.png")
+        )
+        self.args = ["--mode", image_type, "--no-cache"] + (["--text"] if text else [])
+
+    def teardown(self, root, size, image_type, text):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def time_mosaicfy(self, root, size, image_type, text):
+        mosaicfy(self.infile, "--outfile", self.outfile, *self.args)
+
+    def peakmem_mosaicfy(self, root, size, image_type, text):
+        mosaicfy(self.infile, "--outfile", self.outfile, *self.args)
+
+
+class Gif:
+    """``mosaicfy GIF --outfile OUT`` in memory and streamed"""
+
+    params = (GIF_SIZES, [False, True])
+    param_names = ["size", "stream"]
+    timeout = 300
+
+    def setup_cache(self):
+        root = pathlib.Path("gifs").absolute()
+        root.mkdir(exist_ok=True)
+        for size in GIF_SIZES:
+            common.write_gif(root / f"{size}.gif", size, GIF_FRAMES)
+        return str(root)
+
+    def setup(self, root, size, stream):
+        self.infile = str(pathlib.Path(root) / f"{size}.gif")
+        self.workdir = tempfile.mkdtemp()
+        self.outfile = str(pathlib.Path(self.workdir) / "out.gif")
+        self.args = ["--no-cache"] + (["--stream"] if stream else [])
+
+    def teardown(self, root, size, stream):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def time_mosaicfy(self, root, size, stream):
+        mosaicfy(self.infile, "--outfile", self.outfile, *self.args)
+
+    def peakmem_mosaicfy(self, root, size, stream):
+        mosaicfy(self.infile, "--outfile", self.outfile, *self.args)
@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+
+from rusty_mosaic.mosaic.gif_mosaic import GifMosaic
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+
+from . import common
+
+
+class GifEncoding:
+    """Saving a matched 24 frame GIF mosaic
+
+    Index-backed frames go through the tile library's shared palette and frame
+    differences, rendered frames through per-frame quantization.
+    """
+
+    params = ([256, 512], ["L", "RGB"], [True, False])
+    param_names = ["size", "image_type", "indexed"]
+    timeout = 300
+
+    def setup(self, size, image_type, indexed):
+        tiles = common.synthetic_tiles(92, image_type=image_type)
+        frames = []
+        for frame in range(24):
+            pixmap = common.synthetic_pixmap(
+                size, size, image_type, seed=frame, shift=4 * frame
+            )
+            image_mosaic = ImageMosaic(
+                ImageMosaic._array_to_blocks(pixmap, common.TILE_SIZE),
+                common.TILE_SIZE,
+                size // common.TILE_SIZE,
+            )
+            # a cheap stand-in for matching that keeps neighbouring frames similar
+            best = image_mosaic.blocks.mean(axis=1).astype(np.intp) * 92 // 256
+            frames.append(image_mosaic.apply_tiles(tiles, best, lazy=indexed))
+        self.mosaic = GifMosaic(frames=frames, fps=12)
+        # the palette is built once per library and cached on it
+        tiles.gif_palette
+
+    def time_save(self, size, image_type, indexed):
+        self.mosaic.save(io.BytesIO())
+
+    def track_bytes(self, size, image_type, indexed):
+        output = io.BytesIO()
+        self.mosaic.save(output)
+        return len(output.getvalue())
+
+    track_bytes.unit = "bytes"
@@ -0,0 +1,20 @@
+from . import import_budget
+
+
+class Startup:
+    """How long each code path takes to import, in a fresh interpreter every time"""
+
+    params = list(import_budget.SCENARIOS)
+    param_names = ["scenario"]
+
+    def timeraw_startup(self, scenario):
+        return import_budget.SCENARIOS[scenario].code
+
+    def track_forbidden_imports(self, scenario):
+        # anything above 0 means a heavy dependency is imported eagerly again
+        _, modules = import_budget.measure(import_budget.SCENARIOS[scenario].code)
+        return sum(
+            module in modules for module in import_budget.SCENARIOS[scenario].forbidden
+        )
+
+    track_forbidden_imports.unit = "modules"
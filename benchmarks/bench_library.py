@@ -0,0 +1,45 @@
+import shutil
+import pathlib
+import tempfile
+
+from rusty_mosaic import tile_library
+
+from . import common
+
+# writing and decoding 50k files per repeat takes minutes, the comparators cover 50k
+DIRECTORY_SIZES = [92, 1_000, 10_000]
+
+
+class FromDirectory:
+    """Building a TileLibrary from a directory of images, cold and from the tile cache"""
+
+    params = (DIRECTORY_SIZES, [False, True])
+    param_names = ["n_tiles", "cached"]
+    timeout = 600
+
+    def setup_cache(self):
+        root = pathlib.Path("tile-directories").absolute()
+        for n_tiles in DIRECTORY_SIZES:
+            common.write_tile_directory(root / str(n_tiles), n_tiles)
+        return str(root)
+
+    def setup(self, root, n_tiles, cached):
+        self.path = pathlib.Path(root) / str(n_tiles)
+        self.cache_dir = tempfile.mkdtemp() if cached else None
+        if cached:
+            self.build()
+
+    def teardown(self, root, n_tiles, cached):
+        if self.cache_dir is not None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def build(self):
+        return tile_library.TileLibrary.from_directory(
+            self.path, tile_size=common.TILE_SIZE, cache_dir=self.cache_dir
+        )
+
+    def time_from_directory(self, root, n_tiles, cached):
+        self.build()
+
+    def peakmem_from_directory(self, root, n_tiles, cached):
+        self.build()
@@ -0,0 +1,54 @@
+import numpy as np
+
+from rusty_mosaic import terminal
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+from rusty_mosaic.mosaic.text_mosaic import TextMosaic, ASCII_TILE_TEXT_MAP
+
+from . import common
+
+N_TILES = 92
+
+
+def text_frame(rows: int, cols: int, shift: int = 0) -> TextMosaic:
+    """A text mosaic whose characters follow a synthetic image"""
+    pixmap = common.synthetic_pixmap(
+        rows * common.TILE_SIZE, cols * common.TILE_SIZE, shift=shift
+    )
+    image_mosaic = ImageMosaic(
+        ImageMosaic._array_to_blocks(pixmap, common.TILE_SIZE), common.TILE_SIZE, rows
+    )
+    best = image_mosaic.blocks.mean(axis=1).astype(np.intp) * N_TILES // 256
+    text_mosaic = TextMosaic(
+        tile_data=np.full(best.size, " "),
+        text_map=ASCII_TILE_TEXT_MAP,
+        image_mosaic=image_mosaic,
+    )
+    return text_mosaic.apply_tiles(common.synthetic_tiles(N_TILES), best)
+
+
+class TextRendering:
+    """Joining a text mosaic's characters into lines"""
+
+    params = [50, 200]
+    param_names = ["rows"]
+
+    def setup(self, rows):
+        self.mosaic = text_frame(rows, rows * 8 // 5)
+
+    def time_text(self, rows):
+        self.mosaic.text
+
+
+class TerminalPlayback:
+    """Precomputing the screen updates of a 24 frame text animation"""
+
+    params = [50, 200]
+    param_names = ["rows"]
+
+    def setup(self, rows):
+        self.frames = [
+            text_frame(rows, rows * 8 // 5, shift=4 * frame).grid for frame in range(24)
+        ]
+
+    def time_precompute_updates(self, rows):
+        terminal.TerminalPlayer(self.frames, fps=24)
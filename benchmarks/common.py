@@ -0,0 +1,84 @@
+"""Deterministic synthetic inputs shared by the benchmarks"""
+
+import pathlib
+
+import numpy as np
+from PIL import Image
+import imageio.v3 as iio
+
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+
+SEED = 0
+TILE_SIZE = 8
+LIBRARY_SIZES = [92, 1_000, 10_000, 50_000]
+
+
+def synthetic_pixmap(
+    height: int, width: int, image_type: str = "L", seed: int = SEED, shift: int = 0
+) -> np.ndarray:
+    """A smooth gradient with noise, so blocks are neither all alike nor pure noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = 96 * np.sin((x + shift) / 37.0) + 64 * np.cos(y / 23.0) + 0.1 * (x + y) + 128
+    channels = 3 if image_type == "RGB" else 1
+    noise = rng.normal(0, 24, (height, width, channels))
+    data = np.clip(base[..., None] + noise, 0, 255).astype(np.uint8)
+    return data if channels > 1 else data[..., 0]
+
+
+def synthetic_tiles(
+    n_tiles: int,
+    tile_size: int = TILE_SIZE,
+    image_type: str = "L",
+    seed: int = SEED,
+) -> tile_library.TileLibrary:
+    """A library of random tiles with a spread of mean brightness"""
+    rng = np.random.default_rng(seed + 1)
+    channels = 3 if image_type == "RGB" else 1
+    values = tile_size * tile_size * channels
+    means = rng.uniform(0, 255, (n_tiles, 1))
+    data = np.clip(means + rng.normal(0, 48, (n_tiles, values)), 0, 255)
+    return tile_library.TileLibrary(
+        tile_size=tile_size, tile_data=data.astype(np.uint8)
+    )
+
+
+def synthetic_blocks(
+    n_blocks: int, tile_size: int = TILE_SIZE, image_type: str = "L"
+) -> np.ndarray:
+    """The blocks of a synthetic image with about n_blocks blocks"""
+    side = max(1, int(np.sqrt(n_blocks))) * tile_size
+    pixmap = synthetic_pixmap(side, side, image_type)
+    return ImageMosaic._array_to_blocks(pixmap, tile_size)
+
+
+def write_image(path: pathlib.Path, size: int, image_type: str = "L") -> pathlib.Path:
+    Image.fromarray(synthetic_pixmap(size, size, image_type)).save(path)
+    return path
+
+
+def write_gif(
+    path: pathlib.Path, size: int, n_frames: int, image_type: str = "L"
+) -> pathlib.Path:
+    frames = np.stack(
+        [
+            synthetic_pixmap(size, size, image_type, seed=frame, shift=4 * frame)
+            for frame in range(n_frames)
+        ]
+    )
+    iio.imwrite(path, frames, fps=12, loop=0)
+    return path
+
+
+def write_tile_directory(
+    directory: pathlib.Path, n_tiles: int, tile_size: int = 32
+) -> pathlib.Path:
+    """Save a synthetic library as PNG files, larger than TILE_SIZE so they get resized"""
+    directory.mkdir(parents=True, exist_ok=True)
+    tiles = synthetic_tiles(n_tiles, tile_size, image_type="RGB")
+    for index, data in enumerate(tiles.tile_data):
+        Image.fromarray(data.reshape(tile_size, tile_size, 3)).save(
+            directory / f"tile-{index:05}.png"
+        )
+    return directory
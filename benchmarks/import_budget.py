@@ -0,0 +1,97 @@
+"""Fail when starting rusty_mosaic gets slower or loads modules it does not need
+
+Each scenario runs in a fresh interpreter, so short lived ``mosaicfy`` and batch
+invocations see the same cost.
+
+python benchmarks/import_budget.py
+
+tests/test_import_budget.py runs the same checks with looser budgets under pytest.
+"""
+
+import sys
+import json
+import typing
+import subprocess
+import dataclasses
+
+import typer
+
+
+@dataclasses.dataclass
+class Scenario:
+    code: str
+    budget_ms: float
+    # imports that would mean the lazy loading broke
+    forbidden: typing.Tuple[str, ...] = ()
+
+
+HEAVY = ("numpy", "PIL", "imageio", "rusty_mosaic._lib")
+
+SCENARIOS = {
+    "import rusty_mosaic": Scenario("import rusty_mosaic", 50, HEAVY + ("typer",)),
+    "mosaicfy --help": Scenario(
+        "import io, contextlib\n"
+        "from rusty_mosaic import cli\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    cli.app(['--help'], standalone_mode=False)",
+        350,
+        HEAVY,
+    ),
+    "still image": Scenario(
+        "from rusty_mosaic import cli, comparisons, tile_library\n"
+        "from rusty_mosaic.mosaic import ImageMosaic, TextMosaic, MosaicRecord",
+        400,
+        ("imageio",),
+    ),
+}
+
+_MEASURE = """
+import sys, json, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], "<scenario>", "exec"))
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, sorted(sys.modules)]))
+"""
+
+
+def measure(code: str) -> typing.Tuple[float, typing.List[str]]:
+    """Run code in a new interpreter and return its seconds and the modules it loaded"""
+    output = subprocess.run(
+        [sys.executable, "-c", _MEASURE, code],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    seconds, modules = json.loads(output.splitlines()[-1])
+    return seconds, modules
+
+
+def main(
+    repeat: int = typer.Option(5, help="Keep the fastest of this many runs"),
+    slack: float = typer.Option(
+        1.0, help="Multiply every budget by this, for slow machines"
+    ),
+):
+    """Check every scenario against its time budget and forbidden imports"""
+    failures = 0
+    for name, scenario in SCENARIOS.items():
+        runs = [measure(scenario.code) for _ in range(repeat)]
+        best = min(seconds for seconds, _ in runs) * 1000
+        loaded = [
+            module
+            for module in scenario.forbidden
+            if any(module in modules for _, modules in runs)
+        ]
+        budget = scenario.budget_ms * slack
+        ok = best <= budget and not loaded
+        failures += not ok
+        typer.echo(
+            f"{'ok  ' if ok else 'FAIL'} {name}: {best:.1f} ms of {budget:.0f} ms"
+            + (f", imported {', '.join(loaded)}" if loaded else "")
+        )
+    if failures:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,42 @@
+"""Measure the recall and speed of an IVF index on the blocks of an image
+
+python benchmarks/ivf_recall.py examples/poe.png --n-probe 1 --n-probe 8
+"""
+
+import typing
+import pathlib
+
+import typer
+
+from rusty_mosaic import ann
+from rusty_mosaic import mosaic
+from rusty_mosaic import tile_library
+
+
+def main(
+    infile: pathlib.Path,
+    tile_directory: pathlib.Path = tile_library.ASCII_TILES,
+    tile_size: int = 8,
+    image_type: str = "L",
+    n_lists: typing.Optional[int] = None,
+    n_probe: typing.List[int] = typer.Option([1, 2, 4, 8, 16]),
+):
+    """Print the recall and distance error of an IVF index on the blocks of an image"""
+    tiles = tile_library.TileLibrary.from_directory(
+        tile_directory, tile_size=tile_size, image_type=image_type
+    )
+    blocks = mosaic.ImageMosaic.load(infile, tile_size, image_type).tile_data
+    index = tiles.ivf_index(n_lists=n_lists)
+    typer.echo(
+        f"{tiles.tile_data.shape[0]} tiles, {index.n_lists} lists, {blocks.shape[0]} blocks"
+    )
+    typer.echo("n_probe  recall  mean distance error  blocks/s")
+    for report in ann.measure_recall(index, blocks, tiles.tile_data, n_probe):
+        typer.echo(
+            f"{report.n_probe:>7}  {report.recall:>6.3f}  {report.mean_distance_error:>19.3f}"
+            f"  {blocks.shape[0] / max(report.seconds, 1e-9):>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,90 @@
+"""Load test a running ``mosaicfy serve`` instance
+
+mosaicfy serve &
+python benchmarks/load_test.py examples/poe.png --requests 500 --concurrency 16
+"""
+
+import time
+import socket
+import typing
+import pathlib
+import statistics
+import http.client
+from concurrent import futures
+
+import typer
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def percentile(values: typing.Sequence[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def main(
+    image: pathlib.Path,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: typing.Optional[pathlib.Path] = typer.Option(
+        None, "--socket", help="Connect to a unix socket instead of host and port"
+    ),
+    requests: int = 200,
+    concurrency: int = 8,
+    query: str = typer.Option(
+        "", help="The query string of every request, e.g. tile_size=16&text=1"
+    ),
+    timeout: float = 60.0,
+):
+    """Send the same image many times at once and report latency percentiles"""
+    body = image.read_bytes()
+    path = f"/mosaic?{query}" if query else "/mosaic"
+
+    def connect() -> http.client.HTTPConnection:
+        if socket_path is not None:
+            return UnixHTTPConnection(str(socket_path), timeout)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def send(_: int) -> typing.Tuple[float, int]:
+        connection = connect()
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body)
+            response = connection.getresponse()
+            response.read()
+            return time.perf_counter() - start, response.status
+        finally:
+            connection.close()
+
+    # one request to build anything the server builds lazily
+    send(0)
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [seconds * 1000 for seconds, status in results if status == 200]
+    failures = len(results) - len(latencies)
+    typer.echo(
+        f"{requests} requests, {concurrency} at a time, {failures} failed, {requests / elapsed:.1f} requests/s"
+    )
+    if latencies:
+        typer.echo(
+            f"latency ms: p50 {statistics.median(latencies):.1f}  p90 {percentile(latencies, 0.9):.1f}"
+            f"  p99 {percentile(latencies, 0.99):.1f}  max {max(latencies):.1f}"
+        )
+    if failures:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
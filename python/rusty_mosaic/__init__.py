@@ -1,8 +1,49 @@
-from rusty_mosaic import utils
-from rusty_mosaic import mosaic
-from rusty_mosaic import tile_library
-from rusty_mosaic import comparisons
-from rusty_mosaic import cli
+import typing
+import importlib
 
+if typing.TYPE_CHECKING:
+    from rusty_mosaic import utils
+    from rusty_mosaic import assets
+    from rusty_mosaic import mosaic
+    from rusty_mosaic import tile_library
+    from rusty_mosaic import comparisons
+    from rusty_mosaic import ann
+    from rusty_mosaic import autotune
+    from rusty_mosaic import temporal
+    from rusty_mosaic import writers
+    from rusty_mosaic import profiling
+    from rusty_mosaic import batch
+    from rusty_mosaic import server
+    from rusty_mosaic import terminal
+    from rusty_mosaic import aio
+    from rusty_mosaic import cli
 
-__all__ = ["utils", "mosaic", "tile_library", "comparisons", "cli"]
+__all__ = [
+    "utils",
+    "assets",
+    "mosaic",
+    "tile_library",
+    "comparisons",
+    "ann",
+    "autotune",
+    "temporal",
+    "writers",
+    "profiling",
+    "batch",
+    "server",
+    "terminal",
+    "aio",
+    "cli",
+]
+
+
+def __getattr__(name: str) -> typing.Any:
+    # submodules are imported on first use, so `import rusty_mosaic` and the CLI only
+    # pay for NumPy, Pillow, imageio and the extension when they need them
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> typing.List[str]:
+    return sorted({*globals(), *__all__})
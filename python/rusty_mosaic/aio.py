@@ -0,0 +1,275 @@
+import os
+import typing
+import asyncio
+import pathlib
+import functools
+import threading
+import contextvars
+import dataclasses
+from concurrent import futures
+
+import numpy as np
+
+from rusty_mosaic import mosaic
+from rusty_mosaic import temporal
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+
+PathLike = typing.Union[str, pathlib.Path]
+AnimatedMosaic = typing.Union[mosaic.GifMosaic, mosaic.TextGifMosaic]
+FrameMosaic = typing.Union[mosaic.ImageMosaic, mosaic.TextMosaic]
+M = typing.TypeVar("M")
+T = typing.TypeVar("T")
+
+_executor: typing.Optional[futures.Executor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> futures.Executor:
+    """The executor every coroutine in this module runs its work on
+
+    Unless one was set with set_executor, this is a thread pool with a thread per core
+    that is created on first use and shared by every caller. Threads suit the work
+    because decoding, the Rust kernels and BLAS release the GIL.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 1, thread_name_prefix="rusty_mosaic"
+            )
+        return _executor
+
+
+def set_executor(
+    executor: typing.Optional[futures.Executor],
+) -> typing.Optional[futures.Executor]:
+    """Run work on executor from now on, None goes back to the default pool
+
+    The previous executor is returned and not shut down, since other code may still
+    be using it.
+    """
+    global _executor
+    with _executor_lock:
+        previous, _executor = _executor, executor
+    return previous
+
+
+async def run(
+    func: typing.Callable[..., T],
+    *args: typing.Any,
+    executor: typing.Optional[futures.Executor] = None,
+    **kwargs: typing.Any,
+) -> T:
+    """Call func on the executor and wait for it without blocking the event loop
+
+    Context variables, such as the frame profiling attributes stages to, are copied to
+    the worker. Cancelling the awaiting task stops the call if it has not started yet.
+    A call that is already running finishes in the background and its result is
+    dropped.
+    """
+    executor = executor if executor is not None else get_executor()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await asyncio.wrap_future(executor.submit(call))
+
+
+async def load_async(
+    cls: typing.Type[M],
+    filename: PathLike,
+    tile_size: int = 8,
+    image_type: str = "L",
+    scale: typing.Union[int, float] = 1,
+    invert: bool = False,
+    executor: typing.Optional[futures.Executor] = None,
+) -> M:
+    """Load a mosaic of type cls from a file on the executor
+
+    Args:
+        cls (typing.Type[M]): The kind of mosaic to load, e.g. mosaic.GifMosaic
+        filename (PathLike): A path to an image to mosaicfy
+        tile_size (int, optional): The size of each image block. Defaults to 8.
+        image_type (str, optional): An image mode. Defaults to "L".
+        scale (typing.Union[int, float], optional): How much larger to make the resulting image. Defaults to 1.
+        invert (bool, optional): Invert the image before matching. Defaults to False.
+        executor (typing.Optional[futures.Executor], optional): Where to run. Defaults to get_executor().
+    """
+    return await run(
+        cls.load,  # type: ignore[attr-defined]
+        filename,
+        tile_size,
+        image_type=image_type,
+        scale=scale,
+        invert=invert,
+        executor=executor,
+    )
+
+
+async def save_async(
+    result: mosaic.Mosaic,
+    outfile: PathLike,
+    executor: typing.Optional[futures.Executor] = None,
+    **kwargs: typing.Any,
+) -> None:
+    """Render and encode a mosaic to a file on the executor
+
+    Args:
+        result (mosaic.Mosaic): The mosaic to save
+        outfile (PathLike): Where to save it
+        executor (typing.Optional[futures.Executor], optional): Where to run. Defaults to get_executor().
+        **kwargs: Passed on to the mosaic's save, e.g. thumbnail
+    """
+    await run(result.save, outfile, executor=executor, **kwargs)
+
+
+@dataclasses.dataclass
+class FrameProgress:
+    """One frame of an animation that has been matched
+
+    Args:
+        index (int): The position of the frame in the animation
+        total (int): How many frames the animation has
+        frame (FrameMosaic): The frame with its tiles replaced
+        stats (typing.Optional[temporal.FrameMatchStats], optional): How many of the frame's blocks were matched again, when matching with a threshold. Defaults to None.
+    """
+
+    index: int
+    total: int
+    frame: FrameMosaic
+    stats: typing.Optional[temporal.FrameMatchStats] = None
+
+    @property
+    def done(self) -> float:
+        """The share of frames matched so far"""
+        return (self.index + 1) / self.total
+
+
+def _frame_blocks(frame: FrameMosaic) -> np.ndarray:
+    if isinstance(frame, mosaic.TextMosaic):
+        return frame.image_mosaic.tile_data
+    return frame.blocks
+
+
+def _match_frames(
+    frames: typing.Sequence[FrameMosaic],
+    tiles: tile_library.TileLibrary,
+    cmp: comparisons.TileComparator,
+    matcher: typing.Optional[temporal.TemporalMatcher],
+    lazy: bool,
+) -> typing.List[FrameMosaic]:
+    blocks = [_frame_blocks(frame) for frame in frames]
+    if matcher is None:
+        best = comparisons.find_best_tiles_batched(blocks, tiles.tile_data, cmp)
+    else:
+        best = matcher.match(blocks, tiles.tile_data)
+    return [
+        (
+            frame.apply_tiles(tiles, frame_best)
+            if isinstance(frame, mosaic.TextMosaic)
+            else frame.apply_tiles(tiles, frame_best, lazy=lazy)
+        )
+        for frame, frame_best in zip(frames, best)
+    ]
+
+
+async def iter_replace_tiles(
+    animation: AnimatedMosaic,
+    tiles: tile_library.TileLibrary,
+    cmp: comparisons.TileComparator = comparisons.default_parallel_comparator,
+    threshold: typing.Optional[float] = None,
+    lazy: bool = False,
+    batch_size: int = 8,
+    executor: typing.Optional[futures.Executor] = None,
+) -> typing.AsyncIterator[FrameProgress]:
+    """Match the frames of an animation on the executor and yield each one as it is done
+
+    Frames are matched batch_size at a time with one comparator call per batch, and the
+    next batch is only submitted once the previous one is done. Cancelling the consumer,
+    or leaving the loop early, stops matching after the batch in progress. The
+    animation itself is not modified.
+
+    Args:
+        animation (AnimatedMosaic): A GifMosaic or TextGifMosaic to match
+        tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+        cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_parallel_comparator.
+        threshold (typing.Optional[float], optional): Reuse a block's tile from the previous frame while its mean squared difference stays within this threshold. Defaults to None.
+        lazy (bool, optional): Keep each image frame's tile indices and render pixels on demand. Defaults to False.
+        batch_size (int, optional): How many frames to match with one comparator call. Defaults to 8.
+        executor (typing.Optional[futures.Executor], optional): Where to run. Defaults to get_executor().
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+    if isinstance(animation, mosaic.TextGifMosaic) and animation.frames:
+        animation.frames[0]._check_text_map(tiles)
+
+    matcher = (
+        temporal.TemporalMatcher(threshold=threshold, cmp=cmp)
+        if threshold is not None
+        else None
+    )
+    frames = list(animation.frames)
+    for start in range(0, len(frames), batch_size):
+        matched = await run(
+            _match_frames,
+            frames[start : start + batch_size],
+            tiles,
+            cmp,
+            matcher,
+            lazy,
+            executor=executor,
+        )
+        for index, frame in enumerate(matched, start=start):
+            yield FrameProgress(
+                index=index,
+                total=len(frames),
+                frame=frame,
+                stats=matcher.stats[index] if matcher is not None else None,
+            )
+
+
+async def replace_tiles_async(
+    result: M,
+    tiles: tile_library.TileLibrary,
+    cmp: typing.Optional[comparisons.TileComparator] = None,
+    inplace: bool = False,
+    executor: typing.Optional[futures.Executor] = None,
+    progress: typing.Optional[typing.Callable[[FrameProgress], None]] = None,
+    **kwargs: typing.Any,
+) -> M:
+    """Replace a mosaic's tiles on the executor
+
+    Animations are matched a batch of frames at a time through iter_replace_tiles, so
+    cancelling the task stops them between batches, and progress is called with every
+    frame. Other mosaics are matched with a single call.
+
+    Args:
+        result (M): The mosaic to match
+        tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+        cmp (typing.Optional[comparisons.TileComparator], optional): A strategy to find the best tiles. Defaults to the mosaic's own default.
+        inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
+        executor (typing.Optional[futures.Executor], optional): Where to run. Defaults to get_executor().
+        progress (typing.Optional[typing.Callable[[FrameProgress], None]], optional): Called with each frame of an animation as it is matched. Defaults to None.
+        **kwargs: Passed on to replace_tiles, or to iter_replace_tiles for animations, e.g. lazy or threshold
+    """
+    options = dict(kwargs, cmp=cmp) if cmp is not None else kwargs
+    if not isinstance(result, (mosaic.GifMosaic, mosaic.TextGifMosaic)):
+        return await run(
+            result.replace_tiles,  # type: ignore[attr-defined]
+            tiles,
+            inplace=inplace,
+            executor=executor,
+            **options,
+        )
+
+    frames = []
+    match_stats = []
+    async for update in iter_replace_tiles(result, tiles, executor=executor, **options):
+        frames.append(update.frame)
+        if update.stats is not None:
+            match_stats.append(update.stats)
+        if progress is not None:
+            progress(update)
+    if inplace:
+        result.frames = frames
+        result.match_stats = match_stats
+        return result
+    return type(result)(frames=frames, fps=result.fps, match_stats=match_stats)
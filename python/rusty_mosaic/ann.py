@@ -0,0 +1,290 @@
+import time
+import typing
+import pathlib
+import threading
+import collections
+import dataclasses
+
+import numpy as np
+
+from rusty_mosaic import utils
+from rusty_mosaic import comparisons
+
+
+@dataclasses.dataclass
+class IVFIndex:
+    """An inverted file index over a tile library for approximate nearest tile search
+
+    Tiles are clustered with k-means. A block is only compared with the tiles in the
+    ``n_probe`` clusters whose centroids are closest to it, which trades a little
+    accuracy for skipping most of the library.
+
+    Args:
+        centroids (np.ndarray): A (n_lists, tile values) array of cluster centers
+        assignments (np.ndarray): The cluster of each tile
+        fingerprint (str): The fingerprint of the tile data the index was built from
+    """
+
+    centroids: np.ndarray
+    assignments: np.ndarray
+    fingerprint: str
+    _lists: typing.List[np.ndarray] = dataclasses.field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(
+            self.assignments[order], np.arange(self.centroids.shape[0] + 1)
+        )
+        # tile indexes of each list in ascending order, so argmin keeps the lowest on ties
+        self._lists = [order[start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        tiles: np.ndarray,
+        fingerprint: str,
+        n_lists: typing.Optional[int] = None,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Cluster tiles with k-means
+
+        Args:
+            tiles (np.ndarray): A list of flattened tiles
+            fingerprint (str): The fingerprint of the tile data
+            n_lists (typing.Optional[int], optional): How many clusters to make. Defaults to the square root of the number of tiles.
+            iterations (int, optional): How many rounds of k-means to run. Defaults to 10.
+            seed (int, optional): Seeds the choice of initial centroids. Defaults to 0.
+        """
+        tiles = np.asarray(tiles, dtype=np.float64).reshape(len(tiles), -1)
+        if n_lists is None:
+            n_lists = int(np.sqrt(tiles.shape[0]))
+        n_lists = max(1, min(n_lists, tiles.shape[0]))
+        rng = np.random.default_rng(seed)
+        centroids = tiles[rng.choice(tiles.shape[0], n_lists, replace=False)]
+        assignments = np.zeros(tiles.shape[0], dtype=np.intp)
+        for _ in range(iterations):
+            assignments = comparisons.blas_distance(tiles, centroids).astype(np.intp)
+            counts = np.bincount(assignments, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, tiles)
+            filled = counts > 0
+            # an empty cluster keeps its previous centroid
+            centroids[filled] = sums[filled] / counts[filled, None]
+        assignments = comparisons.blas_distance(tiles, centroids).astype(np.intp)
+        return cls(
+            centroids=centroids, assignments=assignments, fingerprint=fingerprint
+        )
+
+    def save(self, file: typing.Union[str, pathlib.Path, typing.IO[bytes]]) -> None:
+        np.savez(
+            file,
+            centroids=self.centroids,
+            assignments=self.assignments,
+            fingerprint=np.asarray(self.fingerprint),
+        )
+
+    @classmethod
+    def load(cls, path: typing.Union[str, pathlib.Path]) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(
+                centroids=data["centroids"],
+                assignments=data["assignments"],
+                fingerprint=str(data["fingerprint"]),
+            )
+
+    def search(
+        self,
+        image_blocks: np.ndarray,
+        tiles: np.ndarray,
+        n_probe: int = 8,
+        chunk_size: int = 4096,
+    ) -> comparisons.IndexArray:
+        """Find the approximately best tile for each block
+
+        Args:
+            image_blocks (np.ndarray): A list of flattened blocks
+            tiles (np.ndarray): The tiles the index was built from
+            n_probe (int, optional): How many clusters to search per block, n_lists makes the search exact. Defaults to 8.
+            chunk_size (int, optional): How many blocks to search at once. Defaults to 4096.
+        """
+        if tiles.shape[0] != self.assignments.shape[0]:
+            raise ValueError(
+                f"The index was built for {self.assignments.shape[0]} tiles but got {tiles.shape[0]}"
+            )
+        image_blocks = comparisons.flatten_rows(np.asarray(image_blocks))
+        tiles = comparisons.flatten_rows(np.asarray(tiles, dtype=np.float64))
+        if tiles.shape[1] != self.centroids.shape[1]:
+            raise ValueError(
+                f"The index was built for tiles of {self.centroids.shape[1]} values but got {tiles.shape[1]}"
+            )
+        tile_norms = np.einsum("ij,ij->i", tiles, tiles)
+        n_probe = max(1, min(n_probe, self.n_lists))
+        best = np.zeros(image_blocks.shape[0], dtype=np.uintp)
+
+        for start in range(0, image_blocks.shape[0], chunk_size):
+            chunk = image_blocks[start : start + chunk_size].astype(np.float64)
+            centroid_distances = np.einsum(
+                "ij,ij->i", self.centroids, self.centroids
+            ) - 2 * (chunk @ self.centroids.T)
+            probes = np.argpartition(centroid_distances, n_probe - 1, axis=1)[
+                :, :n_probe
+            ]
+            best_distance = np.full(chunk.shape[0], np.inf)
+            best_index = np.zeros(chunk.shape[0], dtype=np.intp)
+            for list_id in np.unique(probes):
+                members = self._lists[list_id]
+                rows = np.flatnonzero((probes == list_id).any(axis=1))
+                if members.size == 0 or rows.size == 0:
+                    continue
+                distances = tile_norms[members] - 2 * (chunk[rows] @ tiles[members].T)
+                closest = distances.argmin(axis=1)
+                distance = distances[np.arange(rows.size), closest]
+                index = members[closest]
+                better = (distance < best_distance[rows]) | (
+                    (distance == best_distance[rows]) & (index < best_index[rows])
+                )
+                best_distance[rows[better]] = distance[better]
+                best_index[rows[better]] = index[better]
+            best[start : start + chunk.shape[0]] = best_index
+        return best
+
+
+# how many tile arrays an IVFComparator remembers the fingerprint of
+RECENT_TILES = 8
+
+
+@dataclasses.dataclass
+class IVFComparator:
+    """A TileComparator backed by an IVFIndex
+
+    An index is only used with the tiles it was built from, matched by fingerprint. For
+    any other tiles an index is built on first use and kept, one per fingerprint, so a
+    comparator can be shared by callers with different libraries. The fingerprints of
+    the last few tile arrays are remembered by identity, so calling again with the same
+    array does not hash the library again. Tiles must not be changed in place.
+
+    Args:
+        index (typing.Optional[IVFIndex], optional): A prebuilt index. Defaults to None.
+        n_probe (int, optional): How many clusters to search per block. Defaults to 8.
+        n_lists (typing.Optional[int], optional): How many clusters to build an index with. Defaults to None.
+    """
+
+    index: typing.Optional[IVFIndex] = None
+    n_probe: int = 8
+    n_lists: typing.Optional[int] = None
+    _indexes: typing.Dict[str, IVFIndex] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _fingerprints: "collections.OrderedDict[tuple, typing.Tuple[np.ndarray, str]]" = (
+        dataclasses.field(
+            default_factory=collections.OrderedDict, init=False, repr=False
+        )
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.index is not None:
+            self._indexes[self.index.fingerprint] = self.index
+
+    def _fingerprint(self, tiles: np.ndarray) -> str:
+        key = (id(tiles), tiles.shape, tiles.dtype.str)
+        with self._lock:
+            known = self._fingerprints.get(key)
+            # the array is kept with its fingerprint, so its id cannot be reused
+            if known is not None and known[0] is tiles:
+                self._fingerprints.move_to_end(key)
+                return known[1]
+        fingerprint = utils.fingerprint_array(tiles)
+        with self._lock:
+            self._fingerprints[key] = (tiles, fingerprint)
+            while len(self._fingerprints) > RECENT_TILES:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def index_for(self, tiles: np.ndarray) -> IVFIndex:
+        """The index of exactly these tiles, built if this is the first call with them"""
+        fingerprint = self._fingerprint(tiles)
+        with self._lock:
+            if fingerprint not in self._indexes:
+                self._indexes[fingerprint] = IVFIndex.build(
+                    tiles, fingerprint=fingerprint, n_lists=self.n_lists
+                )
+            return self._indexes[fingerprint]
+
+    def __call__(
+        self,
+        image_blocks: typing.Union[comparisons.IntArray, comparisons.Float64Array],
+        tiles: typing.Union[comparisons.IntArray, comparisons.Float64Array],
+    ) -> comparisons.IndexArray:
+        tiles = np.asarray(tiles)
+        return self.index_for(tiles).search(
+            np.asarray(image_blocks), tiles, self.n_probe
+        )
+
+
+@dataclasses.dataclass
+class RecallReport:
+    n_probe: int
+    recall: float
+    mean_distance_error: float
+    seconds: float
+
+
+def measure_recall(
+    index: IVFIndex,
+    image_blocks: np.ndarray,
+    tiles: np.ndarray,
+    n_probes: typing.Sequence[int] = (1, 2, 4, 8, 16),
+    reference: typing.Optional[comparisons.TileComparator] = None,
+) -> typing.List[RecallReport]:
+    """Compare approximate matches with exact ones
+
+    Recall is the share of blocks given exactly the tile the exact search picks. The mean
+    distance error is how much larger the squared distance per value is on average.
+
+    Args:
+        index (IVFIndex): The index to measure
+        image_blocks (np.ndarray): Blocks to match, ideally from representative images
+        tiles (np.ndarray): The tiles the index was built from
+        n_probes (typing.Sequence[int], optional): The settings to measure. Defaults to (1, 2, 4, 8, 16).
+        reference (typing.Optional[comparisons.TileComparator], optional): The exact search. Defaults to euclid_distance_rust_i32, or the BLAS comparator without the extension.
+    """
+    if reference is None:
+        reference = (
+            comparisons.euclid_distance_rust_i32
+            if comparisons.RUST_AVAILABLE
+            else comparisons.blas_distance
+        )
+    blocks = comparisons.flatten_rows(np.asarray(image_blocks))
+    values = comparisons.flatten_rows(np.asarray(tiles)).astype(np.float64)
+    exact = np.asarray(reference(blocks, tiles)).astype(np.intp)
+
+    def mean_squared_error(best: np.ndarray) -> np.ndarray:
+        return ((blocks - values[best]) ** 2).mean(axis=1)
+
+    exact_error = mean_squared_error(exact)
+    reports = []
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        approximate = index.search(blocks, tiles, n_probe).astype(np.intp)
+        seconds = time.perf_counter() - start
+        reports.append(
+            RecallReport(
+                n_probe=n_probe,
+                recall=float((approximate == exact).mean()),
+                mean_distance_error=float(
+                    (mean_squared_error(approximate) - exact_error).mean()
+                ),
+                seconds=seconds,
+            )
+        )
+    return reports
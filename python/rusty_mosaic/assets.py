@@ -0,0 +1,4 @@
+import pathlib
+
+# kept free of third party imports so the CLI can use it for option defaults
+ASCII_TILES = pathlib.Path(__file__).parent / "__assets__" / "ascii_tiles"
@@ -0,0 +1,368 @@
+import os
+import json
+import math
+import time
+import typing
+import hashlib
+import pathlib
+import platform
+import threading
+import dataclasses
+
+import numpy as np
+
+from rusty_mosaic import utils
+from rusty_mosaic import profiling
+from rusty_mosaic import comparisons
+
+PathLike = typing.Union[str, pathlib.Path]
+
+# 2 checks candidates against blas_distance, decisions made before that are redone
+PROFILE_VERSION = 2
+# every candidate warms up on this many blocks before it is timed, so thread pools,
+# BLAS and caches are ready
+WARMUP_BLOCKS = 8
+MIN_SAMPLE_BLOCKS = 64
+
+
+def machine_id() -> str:
+    """A digest of what makes timings from one machine meaningless on another"""
+    parts = [
+        platform.node(),
+        platform.system(),
+        platform.machine(),
+        os.cpu_count(),
+        comparisons.RUST_AVAILABLE,
+        np.__version__,
+    ]
+    return hashlib.blake2b(json.dumps(parts).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def default_profile_path() -> pathlib.Path:
+    """Where this machine's calibration is kept"""
+    return utils.cache_directory() / "calibration" / f"{machine_id()}.json"
+
+
+def thread_counts(cores: typing.Optional[int] = None) -> typing.List[int]:
+    """1, 2, 4, ... up to and including the number of cores"""
+    cores = cores or os.cpu_count() or 1
+    counts = []
+    threads = 1
+    while threads < cores:
+        counts.append(threads)
+        threads *= 2
+    return counts + [cores]
+
+
+def _bucket(count: int) -> int:
+    # the nearest power of four, so problems of about the same size share a calibration
+    return 4 ** round(math.log(max(count, 1), 4))
+
+
+@dataclasses.dataclass(frozen=True)
+class Candidate:
+    """A comparator and how many threads it runs on
+
+    Args:
+        name (str): The name of the comparator in comparisons.COMPARATORS
+        threads (typing.Optional[int], optional): The threads it runs on, None for comparators that manage their own. Defaults to None.
+    """
+
+    name: str
+    threads: typing.Optional[int] = None
+
+    @property
+    def label(self) -> str:
+        return self.name if self.threads is None else f"{self.name}@{self.threads}"
+
+    @classmethod
+    def from_label(cls, label: str) -> "Candidate":
+        name, _, threads = label.partition("@")
+        return cls(name, int(threads) if threads else None)
+
+    def comparator(self) -> comparisons.TileComparator:
+        if self.threads is None:
+            return comparisons.COMPARATORS[self.name]
+        return comparisons.threaded_comparator(self.name, self.threads)
+
+
+def candidates(u8: bool, cores: typing.Optional[int] = None) -> typing.List[Candidate]:
+    """The exact comparators worth timing, at every thread count worth trying
+
+    Args:
+        u8 (bool): Whether blocks and tiles are both uint8, which the fastest kernels need
+        cores (typing.Optional[int], optional): The most threads to try. Defaults to os.cpu_count().
+    """
+    found = [Candidate("blas_distance")]
+    if not comparisons.RUST_AVAILABLE:
+        return found
+    names = (
+        (
+            "euclid_distance_rust_u8",
+            "blocked_euclid_distance_rust_u8",
+            "pruned_euclid_distance_rust_u8",
+        )
+        if u8
+        else ("euclid_distance_rust_i32",)
+    )
+    return found + [
+        Candidate(name, threads) for name in names for threads in thread_counts(cores)
+    ]
+
+
+@dataclasses.dataclass(frozen=True)
+class ProblemShape:
+    """The size of a matching problem, rounded so similar problems share a calibration"""
+
+    blocks: int
+    tiles: int
+    values: int
+    u8: bool
+
+    @classmethod
+    def of(cls, image_blocks: np.ndarray, tiles: np.ndarray) -> "ProblemShape":
+        return cls(
+            blocks=_bucket(image_blocks.shape[0]),
+            tiles=_bucket(tiles.shape[0]),
+            values=int(np.prod(tiles.shape[1:])),
+            u8=image_blocks.dtype == tiles.dtype == np.uint8,
+        )
+
+    @property
+    def key(self) -> str:
+        dtype = "u8" if self.u8 else "any"
+        return f"{dtype}/{self.values}v/{self.tiles}t/{self.blocks}b"
+
+
+@dataclasses.dataclass
+class Decision:
+    """Which comparator was picked for a problem shape and why
+
+    Args:
+        key (str): The ProblemShape.key it applies to
+        comparator (str): The name of the comparator
+        threads (typing.Optional[int]): The threads it runs on, None when it manages its own
+        timings (typing.Dict[str, float]): The seconds every candidate took on the sample, by Candidate.label
+        sample_blocks (int): How many blocks the candidates were timed on
+        rejected (typing.List[str], optional): The candidates, by Candidate.label, that found other tiles than blas_distance on the sample. Defaults to [].
+        measured (bool, optional): Whether the calibration ran in this process rather than being loaded. Defaults to False.
+    """
+
+    key: str
+    comparator: str
+    threads: typing.Optional[int]
+    timings: typing.Dict[str, float]
+    sample_blocks: int
+    rejected: typing.List[str] = dataclasses.field(default_factory=list)
+    measured: bool = dataclasses.field(default=False, compare=False)
+
+    @property
+    def candidate(self) -> Candidate:
+        return Candidate(self.comparator, self.threads)
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        data = dataclasses.asdict(self)
+        del data["key"], data["measured"]
+        return data
+
+    def __str__(self) -> str:
+        threads = (
+            "its own threads"
+            if self.threads is None
+            else f"{self.threads} thread{'s' if self.threads != 1 else ''}"
+        )
+        text = f"{self.comparator} on {threads} for {self.key}"
+        if len(self.timings) > 1:
+            best = self.timings[self.candidate.label]
+            slowest = max(self.timings.values())
+            text += f", {slowest / max(best, 1e-9):.1f}x faster than the slowest of {len(self.timings)}"
+        if self.rejected:
+            text += f", rejected {', '.join(self.rejected)} for finding other tiles than blas_distance"
+        return text + (" (calibrated now)" if self.measured else " (from calibration)")
+
+
+@dataclasses.dataclass
+class AutoComparator:
+    """Pick the fastest exact comparator and thread count for each problem shape
+
+    The first call for a shape, rounded to powers of four blocks and tiles, times every
+    candidate on a sample of about ``sample_pairs`` block to tile comparisons taken from
+    that call's blocks. The winner is used for every later call with the same shape and
+    kept in a JSON profile per machine, so later runs skip the calibration. A candidate
+    that finds other tiles than blas_distance on the sample, ties included, is rejected
+    rather than timed, so only speed decides between comparators that agree.
+
+    Args:
+        profile_path (typing.Optional[PathLike], optional): Where to keep calibrations, None to only keep them in memory. Defaults to default_profile_path().
+        sample_pairs (int, optional): Roughly how many block to tile comparisons each candidate is timed on. Defaults to 2_000_000.
+        cores (typing.Optional[int], optional): The most threads a candidate may use. Defaults to os.cpu_count().
+        on_decision (typing.Optional[typing.Callable[[Decision], None]], optional): Called the first time each decision is used, e.g. to log it. Defaults to None.
+    """
+
+    profile_path: typing.Optional[PathLike] = dataclasses.field(
+        default_factory=default_profile_path
+    )
+    sample_pairs: int = 2_000_000
+    cores: typing.Optional[int] = None
+    on_decision: typing.Optional[typing.Callable[[Decision], None]] = dataclasses.field(
+        default=None, repr=False
+    )
+    decisions: typing.Dict[str, Decision] = dataclasses.field(
+        default_factory=dict, init=False
+    )
+    last_decision: typing.Optional[Decision] = dataclasses.field(
+        default=None, init=False
+    )
+    _loaded: bool = dataclasses.field(default=False, init=False, repr=False)
+    _reported: typing.Set[str] = dataclasses.field(
+        default_factory=set, init=False, repr=False
+    )
+    _comparators: typing.Dict[Candidate, comparisons.TileComparator] = (
+        dataclasses.field(default_factory=dict, init=False, repr=False)
+    )
+    _lock: threading.RLock = dataclasses.field(
+        default_factory=threading.RLock, init=False, repr=False
+    )
+
+    def _read_profile(self) -> typing.Dict[str, typing.Any]:
+        if self.profile_path is None:
+            return {}
+        try:
+            profile = json.loads(pathlib.Path(self.profile_path).read_text())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(profile, dict) or profile.get("version") != PROFILE_VERSION:
+            return {}
+        return profile.get("decisions", {})
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        for key, data in self._read_profile().items():
+            try:
+                decision = Decision(key=key, **data)
+            except TypeError:
+                continue
+            u8 = key.startswith("u8/")
+            # a profile may name comparators this build does not have
+            if decision.candidate in candidates(u8, self.cores):
+                self.decisions.setdefault(key, decision)
+
+    def _save(self) -> None:
+        if self.profile_path is None:
+            return
+        path = pathlib.Path(self.profile_path)
+        # other processes may have calibrated other shapes since the profile was read
+        decisions = self._read_profile()
+        decisions.update(
+            {key: decision.to_json() for key, decision in self.decisions.items()}
+        )
+        profile = {
+            "version": PROFILE_VERSION,
+            "machine": {
+                "node": platform.node(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "rust": comparisons.RUST_AVAILABLE,
+            },
+            "decisions": decisions,
+        }
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            utils.write_atomic(
+                path,
+                lambda fp: fp.write(json.dumps(profile, indent=2).encode("utf-8")),
+            )
+        except OSError:
+            # a read-only cache only means calibrating again next time
+            pass
+
+    def _comparator(self, candidate: Candidate) -> comparisons.TileComparator:
+        if candidate not in self._comparators:
+            self._comparators[candidate] = candidate.comparator()
+        return self._comparators[candidate]
+
+    def calibrate(
+        self, image_blocks: np.ndarray, tiles: np.ndarray, shape: ProblemShape
+    ) -> Decision:
+        """Time every candidate that agrees with blas_distance on a sample of image_blocks and pick the fastest"""
+        found = candidates(shape.u8, self.cores)
+        n_blocks = image_blocks.shape[0]
+        n_sample = min(
+            n_blocks,
+            max(MIN_SAMPLE_BLOCKS, self.sample_pairs // max(tiles.shape[0], 1)),
+        )
+        if len(found) == 1:
+            return Decision(
+                shape.key, found[0].name, found[0].threads, {}, 0, measured=True
+            )
+
+        # spread the sample over the image, its first rows are often all sky or border
+        rows = np.linspace(0, n_blocks - 1, n_sample).astype(np.intp)
+        sample = np.ascontiguousarray(image_blocks[rows])
+        expected = np.asarray(comparisons.blas_distance(sample, tiles))
+        timings = {}
+        rejected = []
+        for candidate in found:
+            cmp = self._comparator(candidate)
+            cmp(sample[:WARMUP_BLOCKS], tiles)
+            start = time.perf_counter()
+            best = cmp(sample, tiles)
+            elapsed = time.perf_counter() - start
+            if np.array_equal(np.asarray(best), expected):
+                timings[candidate.label] = elapsed
+            else:
+                rejected.append(candidate.label)
+        best = Candidate.from_label(min(timings, key=timings.__getitem__))
+        return Decision(
+            shape.key,
+            best.name,
+            best.threads,
+            timings,
+            n_sample,
+            rejected=rejected,
+            measured=True,
+        )
+
+    def decide(self, image_blocks: np.ndarray, tiles: np.ndarray) -> Decision:
+        """The decision for blocks and tiles of this shape, calibrating it if this is the first"""
+        shape = ProblemShape.of(image_blocks, tiles)
+        with self._lock:
+            self._load()
+            decision = self.decisions.get(shape.key)
+            if decision is None:
+                with profiling.stage("calibrate"):
+                    decision = self.calibrate(image_blocks, tiles, shape)
+                self.decisions[shape.key] = decision
+                self._save()
+            self.last_decision = decision
+            report = shape.key not in self._reported
+            self._reported.add(shape.key)
+        if report and self.on_decision is not None:
+            self.on_decision(decision)
+        return decision
+
+    def forget(self) -> None:
+        """Drop every calibration, including the profile on disk"""
+        with self._lock:
+            self.decisions.clear()
+            self._reported.clear()
+            self.last_decision = None
+            self._loaded = True
+            if self.profile_path is not None:
+                pathlib.Path(self.profile_path).unlink(missing_ok=True)
+
+    def __call__(
+        self,
+        image_blocks: typing.Union[comparisons.IntArray, comparisons.Float64Array],
+        tiles: typing.Union[comparisons.IntArray, comparisons.Float64Array],
+    ) -> comparisons.IndexArray:
+        image_blocks = comparisons.flatten_rows(np.asarray(image_blocks))
+        tiles = comparisons.flatten_rows(np.asarray(tiles))
+        if image_blocks.shape[0] == 0 or tiles.shape[0] == 0:
+            return comparisons.blas_distance(image_blocks, tiles)
+        decision = self.decide(image_blocks, tiles)
+        with self._lock:
+            cmp = self._comparator(decision.candidate)
+        return cmp(image_blocks, tiles)
@@ -0,0 +1,303 @@
+import os
+import glob
+import json
+import time
+import typing
+import pathlib
+import threading
+import dataclasses
+from concurrent import futures
+
+from rusty_mosaic import utils
+from rusty_mosaic import mosaic
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+
+PathLike = typing.Union[str, pathlib.Path]
+ComparatorFactory = typing.Callable[
+    [tile_library.TileLibrary], comparisons.TileComparator
+]
+
+# {parent} is the input's directory, {stem} its name without the suffix and {suffix}
+# the output suffix, .txt for text mosaics. {index} is the input's position in the batch.
+DEFAULT_TEMPLATE = "{parent}/{stem}-mosaic{suffix}"
+MANIFEST_SUFFIXES = (".jsonl", ".txt")
+
+
+@dataclasses.dataclass
+class BatchJob:
+    """One input of a batch and the settings to mosaicfy it with"""
+
+    infile: pathlib.Path
+    outfile: pathlib.Path
+    tile_directory: pathlib.Path = tile_library.ASCII_TILES
+    tile_size: int = 8
+    image_type: str = "L"
+    scale: float = 1.0
+    text: bool = False
+    invert: bool = False
+    temporal_threshold: typing.Optional[float] = None
+    full_resolution: bool = False
+
+    @property
+    def gif(self) -> bool:
+        return self.infile.suffix.lower() == ".gif"
+
+    @property
+    def library_key(self) -> tile_library.LibraryKey:
+        return tile_library.TileLibraryPool.key(
+            self.tile_directory, self.tile_size, self.image_type
+        )
+
+
+# the settings a .jsonl manifest entry may have, mode is an alias of image_type
+MANIFEST_FIELDS = frozenset(
+    [field.name for field in dataclasses.fields(BatchJob)] + ["mode"]
+)
+
+
+@dataclasses.dataclass
+class BatchResult:
+    job: BatchJob
+    seconds: float
+    error: typing.Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def output_path(
+    infile: pathlib.Path, template: str, index: int, text: bool
+) -> pathlib.Path:
+    """Fill in an output template for an input"""
+    if text:
+        # text GIF mosaics are saved as a directory of frames
+        suffix = "" if infile.suffix.lower() == ".gif" else ".txt"
+    else:
+        suffix = infile.suffix
+    return pathlib.Path(
+        template.format(
+            parent=infile.parent, stem=infile.stem, suffix=suffix, index=index
+        )
+    )
+
+
+def _manifest_entry(
+    path: pathlib.Path, number: int, line: str
+) -> typing.Dict[str, typing.Any]:
+    where = f"{path}, line {number}"
+    if path.suffix != ".jsonl":
+        return {"infile": line}
+    try:
+        entry = json.loads(line)
+    except ValueError as error:
+        raise ValueError(f"{where}: invalid JSON: {error}") from error
+    if not isinstance(entry, dict):
+        raise ValueError(f"{where}: expected an object, got {line}")
+    if "infile" not in entry:
+        raise ValueError(f"{where}: missing infile")
+    unknown = sorted(set(entry) - MANIFEST_FIELDS)
+    if unknown:
+        raise ValueError(
+            f"{where}: unknown settings {', '.join(unknown)}, expected any of {', '.join(sorted(MANIFEST_FIELDS))}"
+        )
+    return entry
+
+
+def _read_manifest(path: pathlib.Path) -> typing.List[typing.Dict[str, typing.Any]]:
+    entries = []
+    for number, line in enumerate(path.read_text().splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        entry = _manifest_entry(path, number, line)
+        # paths in a manifest are relative to the manifest
+        for field in ("infile", "outfile", "tile_directory"):
+            if field in entry:
+                entry[field] = path.parent / entry[field]
+        entries.append(entry)
+    return entries
+
+
+def find_inputs(source: PathLike) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Expand a directory, glob pattern or manifest into batch entries
+
+    A directory contributes every image in it and a glob every image it matches. A
+    ``.txt`` manifest lists one input per line. A ``.jsonl`` manifest has one object per
+    line with an ``infile`` and optionally any other BatchJob field, e.g.
+    ``{"infile": "cat.gif", "tile_size": 16, "text": true}``.
+    """
+    path = pathlib.Path(source)
+    if path.is_dir():
+        paths = sorted(child for child in path.iterdir() if utils.is_image_file(child))
+    elif path.is_file() and path.suffix.lower() in MANIFEST_SUFFIXES:
+        return _read_manifest(path)
+    elif path.is_file():
+        paths = [path]
+    else:
+        paths = sorted(
+            pathlib.Path(match)
+            for match in glob.glob(str(source), recursive=True)
+            if utils.is_image_file(pathlib.Path(match))
+        )
+    return [{"infile": path} for path in paths]
+
+
+def _build_jobs(
+    entries: typing.Sequence[typing.Dict[str, typing.Any]],
+    template: str,
+    defaults: typing.Dict[str, typing.Any],
+) -> typing.List[BatchJob]:
+    jobs = []
+    for entry in entries:
+        options = {**defaults, **entry}
+        options["infile"] = pathlib.Path(options["infile"])
+        if "mode" in options:
+            options["image_type"] = options.pop("mode")
+        if "outfile" not in options:
+            options["outfile"] = output_path(
+                options["infile"],
+                template,
+                len(jobs),
+                bool(options.get("text", False)),
+            )
+        jobs.append(BatchJob(**options))
+    return jobs
+
+
+def make_jobs(
+    sources: typing.Sequence[PathLike],
+    template: str = DEFAULT_TEMPLATE,
+    **defaults: typing.Any,
+) -> typing.List[BatchJob]:
+    """Build the jobs for every input found in sources
+
+    Outputs usually land next to their inputs, so inputs that are the output of another
+    input, e.g. ``cat-mosaic.gif`` from an earlier run over ``cat.gif``, are left out.
+
+    Args:
+        sources (typing.Sequence[PathLike]): Directories, glob patterns, manifests or files
+        template (str, optional): Where to write each mosaic. Defaults to DEFAULT_TEMPLATE.
+        **defaults: Settings for every job that a .jsonl manifest entry does not override
+
+    Raises:
+        ValueError: When a manifest entry is invalid, or two jobs would write the same file
+    """
+    entries = [entry for source in sources for entry in find_inputs(source)]
+    outputs = {
+        job.outfile.resolve() for job in _build_jobs(entries, template, defaults)
+    }
+    entries = [
+        entry
+        for entry in entries
+        if pathlib.Path(entry["infile"]).resolve() not in outputs
+    ]
+    jobs = _build_jobs(entries, template, defaults)
+
+    writers: typing.Dict[pathlib.Path, BatchJob] = {}
+    for job in jobs:
+        outfile = job.outfile.resolve()
+        if outfile in writers:
+            raise ValueError(
+                f"{writers[outfile].infile} and {job.infile} would both be written to {job.outfile}"
+            )
+        writers[outfile] = job
+    for job in jobs:
+        if job.infile.resolve() in writers:
+            raise ValueError(
+                f"{job.infile} is read and written by the same batch, pick another output"
+            )
+    return jobs
+
+
+def make_mosaic(
+    job: BatchJob,
+    tiles: tile_library.TileLibrary,
+    cmp: comparisons.TileComparator = comparisons.default_comparator,
+) -> None:
+    """Load, match and save the mosaic for one job"""
+    cls = {
+        (False, False): mosaic.ImageMosaic,
+        (False, True): mosaic.GifMosaic,
+        (True, False): mosaic.TextMosaic,
+        (True, True): mosaic.TextGifMosaic,
+    }[(job.text, job.gif)]
+    result = cls.load(
+        job.infile,
+        job.tile_size,
+        image_type=job.image_type,
+        scale=job.scale,
+        invert=job.invert,
+    )
+    options: typing.Dict[str, typing.Any] = {} if job.text else {"lazy": True}
+    if job.gif:
+        options["threshold"] = job.temporal_threshold
+    result.replace_tiles(tiles, cmp=cmp, inplace=True, **options)
+
+    job.outfile.parent.mkdir(parents=True, exist_ok=True)
+    if job.full_resolution and not (job.text or job.gif):
+        result.save(job.outfile, thumbnail=False)
+    else:
+        result.save(job.outfile)
+
+
+def run_batch(
+    jobs: typing.Sequence[BatchJob],
+    pool: typing.Optional[tile_library.TileLibraryPool] = None,
+    comparator_for: typing.Optional[ComparatorFactory] = None,
+    workers: typing.Optional[int] = None,
+    progress: typing.Optional[typing.Callable[[int, BatchResult], None]] = None,
+) -> typing.List[BatchResult]:
+    """Mosaicfy many inputs with warm tile libraries and a bounded pool of threads
+
+    Each distinct (tile directory, tile size, image type) is built once and shared by
+    every job that uses it. A failing job is recorded in its result and does not stop
+    the others.
+
+    Args:
+        jobs (typing.Sequence[BatchJob]): What to mosaicfy
+        pool (typing.Optional[tile_library.TileLibraryPool], optional): Where to get tile libraries. Defaults to a new pool without a disk cache.
+        comparator_for (typing.Optional[ComparatorFactory], optional): Picks the comparator for a library. Defaults to comparisons.default_comparator, since jobs already run in parallel.
+        workers (typing.Optional[int], optional): How many jobs to run at once. Defaults to one per core.
+        progress (typing.Optional[typing.Callable[[int, BatchResult], None]], optional): Called with the number of finished jobs and each result as it finishes. Defaults to None.
+
+    Returns:
+        typing.List[BatchResult]: The result of each job, in the order of jobs
+    """
+    pool = pool if pool is not None else tile_library.TileLibraryPool()
+    comparators: typing.Dict[tile_library.LibraryKey, comparisons.TileComparator] = {}
+    lock = threading.Lock()
+
+    def comparator(job: BatchJob, tiles: tile_library.TileLibrary):
+        if comparator_for is None:
+            return comparisons.default_comparator
+        with lock:
+            if job.library_key not in comparators:
+                comparators[job.library_key] = comparator_for(tiles)
+            return comparators[job.library_key]
+
+    def run(job: BatchJob) -> BatchResult:
+        start = time.perf_counter()
+        try:
+            tiles = pool.get(job.tile_directory, job.tile_size, job.image_type)
+            make_mosaic(job, tiles, comparator(job, tiles))
+        except Exception as error:
+            return BatchResult(job, time.perf_counter() - start, error)
+        return BatchResult(job, time.perf_counter() - start)
+
+    results: typing.List[typing.Optional[BatchResult]] = [None] * len(jobs)
+    with futures.ThreadPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1
+    ) as executor:
+        pending = {executor.submit(run, job): index for index, job in enumerate(jobs)}
+        try:
+            for finished, future in enumerate(futures.as_completed(pending), start=1):
+                result = results[pending[future]] = future.result()
+                if progress is not None:
+                    progress(finished, result)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return typing.cast(typing.List[BatchResult], results)
@@ -1,18 +1,51 @@
+import os
 import time
 import typing
 import pathlib
 import tempfile
-import itertools
 import enum
 
+import click
 import typer
+import typer.core
 import rusty_mosaic
 import subprocess
 
-app = typer.Typer()
+# Only light modules are imported here. rusty_mosaic imports its submodules on first
+# use, so each command loads NumPy, Pillow, imageio and the extension only as needed.
 
 
-ShowCallback = typing.Callable[[rusty_mosaic.mosaic.Mosaic], None]
+class DefaultCommandGroup(typer.core.TyperGroup):
+    """Run ``main`` when the first argument is not a command, so ``mosaicfy INFILE`` still works
+
+    An existing file named like a command, e.g. ``render``, is an input to ``main``.
+    Naming the command, ``mosaicfy main render``, or writing ``./render`` does the same
+    for a path that does not exist yet.
+    """
+
+    default_command = "main"
+
+    def parse_args(
+        self, ctx: click.Context, args: typing.List[str]
+    ) -> typing.List[str]:
+        passthrough = {
+            *ctx.help_option_names,
+            "--install-completion",
+            "--show-completion",
+        }
+        if (
+            args
+            and args[0] not in passthrough
+            and (args[0] not in self.commands or os.path.exists(args[0]))
+        ):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+app = typer.Typer(cls=DefaultCommandGroup)
+
+
+ShowCallback = typing.Callable[["rusty_mosaic.mosaic.Mosaic"], None]
 
 
 def show_gif(filename: str) -> None:
@@ -20,7 +53,7 @@ def show_gif(filename: str) -> None:
 
 
 def make_show_gif_mosaic(outfile: typing.Optional[pathlib.Path] = None):
-    def show_gif_mosaic(mosaic: rusty_mosaic.mosaic.Mosaic) -> None:
+    def show_gif_mosaic(mosaic: "rusty_mosaic.mosaic.Mosaic") -> None:
         if outfile is not None:
             return show_gif(str(outfile))
 
@@ -34,34 +67,28 @@ def make_show_gif_mosaic(outfile: typing.Optional[pathlib.Path] = None):
     return show_gif_mosaic
 
 
-def show_text_gif(mosaic: rusty_mosaic.mosaic.TextGifMosaic) -> None:
-    counter = {"value": 0}
-
-    def should_continue():
-        return counter["value"] <= 0
+def show_text_gif(mosaic: "rusty_mosaic.mosaic.TextGifMosaic") -> None:
+    stopped = {"value": False}
 
-    def should_continue_callback(_: str) -> bool:
-        counter["value"] += 1
-        return should_continue()
+    def stop(_: str) -> bool:
+        stopped["value"] = True
+        return False
 
-    rusty_mosaic.utils.KeypressThread(callback=should_continue_callback)
-    for frame_idx in itertools.cycle(range(len(mosaic.frames))):
-        show_text_mosaic(mosaic.frames[frame_idx])
-        typer.echo("Press enter to exit...")
-        time.sleep(1.5 / mosaic.fps)
-        if not should_continue():
-            break
-        typer.clear()
+    rusty_mosaic.utils.KeypressThread(callback=stop)
+    rusty_mosaic.terminal.TerminalPlayer.from_mosaic(mosaic).play(
+        should_continue=lambda: not stopped["value"],
+        footer="Press enter to exit...",
+    )
 
 
 def show_image_mosaic(
-    mosaic: rusty_mosaic.mosaic.ImageMosaic,
+    mosaic: "rusty_mosaic.mosaic.ImageMosaic",
 ):
     mosaic.image.show()
 
 
 def show_text_mosaic(
-    mosaic: rusty_mosaic.mosaic.TextMosaic,
+    mosaic: "rusty_mosaic.mosaic.TextMosaic",
 ):
     typer.echo(mosaic.text)
 
@@ -70,13 +97,141 @@ def is_gif(infile: pathlib.Path) -> bool:
     return pathlib.Path(infile).suffix.lower().endswith("gif")
 
 
+def report_decision(decision: "rusty_mosaic.autotune.Decision") -> None:
+    typer.echo(f"Comparator: {decision}", err=True)
+
+
+def get_comparator(
+    name: typing.Optional[str],
+    cache: bool = True,
+) -> "rusty_mosaic.comparisons.TileComparator":
+    """Look up a comparator by name, None or auto picks one by calibrating on this machine
+
+    auto and ivf_distance keep state per caller, so they are built here rather than
+    kept in COMPARATORS.
+    """
+    if name is None or name == "auto":
+        return rusty_mosaic.autotune.AutoComparator(
+            profile_path=(
+                rusty_mosaic.autotune.default_profile_path() if cache else None
+            ),
+            on_decision=report_decision,
+        )
+    if name == "ivf_distance":
+        return rusty_mosaic.ann.IVFComparator()
+
+    comparators = rusty_mosaic.comparisons.COMPARATORS
+    try:
+        return comparators[name]
+    except KeyError:
+        raise typer.BadParameter(
+            f"Unknown comparator {name!r}, expected auto, ivf_distance or one of {', '.join(comparators)}",
+            param_hint="--comparator",
+        )
+
+
+def make_comparator(
+    name: typing.Optional[str],
+    tiles: "rusty_mosaic.tile_library.TileLibrary",
+    n_probe: int = 8,
+    cache: bool = True,
+    default: typing.Optional["rusty_mosaic.comparisons.TileComparator"] = None,
+) -> "rusty_mosaic.comparisons.TileComparator":
+    """Look up a comparator, giving ivf_distance an index for tiles"""
+    if name is None and default is not None:
+        return default
+    cmp = get_comparator(name, cache=cache)
+    if isinstance(cmp, rusty_mosaic.ann.IVFComparator):
+        cmp = rusty_mosaic.ann.IVFComparator(
+            index=tiles.ivf_index(
+                cache_dir=rusty_mosaic.utils.cache_directory() if cache else None
+            ),
+            n_probe=n_probe,
+        )
+    return cmp
+
+
+def report_match_stats(
+    match_stats: typing.List["rusty_mosaic.temporal.FrameMatchStats"],
+) -> None:
+    if not match_stats:
+        return
+    rematched = sum(stats.rematched for stats in match_stats)
+    total = sum(stats.blocks for stats in match_stats)
+    typer.echo(f"Re-matched {rematched} of {total} blocks", err=True)
+
+
+def start_profile(ctx: typer.Context, outfile: typing.Optional[pathlib.Path]) -> None:
+    """Profile the rest of the command and write the report to outfile when it exits"""
+    if outfile is None:
+        return
+    rusty_mosaic.profiling.enable()
+
+    def save_profile() -> None:
+        profiler = rusty_mosaic.profiling.disable()
+        if profiler is not None:
+            profiler.save(outfile)
+
+    ctx.call_on_close(save_profile)
+
+
+# listing the comparators would import the extension just to print --help
+COMPARATOR_HELP = "The name of a comparator in rusty_mosaic.comparisons.COMPARATORS, or ivf_distance for the approximate IVF index. Defaults to auto, which times the exact comparators once per machine and problem size and uses the fastest"
+
+
 class ImageMode(str, enum.Enum):
     color = "RGB"
     grayscale = "L"
 
 
+def make_adaptive_mosaic(
+    infile: pathlib.Path,
+    tiles: "rusty_mosaic.tile_library.TileLibrary",
+    cmp: "rusty_mosaic.comparisons.TileComparator",
+    levels: int,
+    scale: float,
+    invert: bool,
+    image_type: str,
+    tile_directory: pathlib.Path,
+    cache: bool,
+    tile_workers: typing.Optional[int],
+    **kwargs: typing.Any,
+) -> "rusty_mosaic.mosaic.AdaptiveImageMosaic":
+    """Match an image with tiles of levels sizes, tiles being the smallest"""
+    adaptive = rusty_mosaic.mosaic.AdaptiveImageMosaic
+    tile_sizes = adaptive.default_tile_sizes(tiles.tile_size, levels)
+    libraries = {
+        tile_size: rusty_mosaic.tile_library.TileLibrary.from_directory(
+            tile_directory,
+            tile_size=tile_size,
+            image_type=image_type,
+            cache_dir=rusty_mosaic.utils.cache_directory() if cache else None,
+            workers=tile_workers,
+        )
+        for tile_size in tile_sizes[:-1]
+    }
+    libraries[tiles.tile_size] = tiles
+    mosaic = adaptive.load(
+        infile,
+        tiles.tile_size,
+        scale=scale,
+        invert=invert,
+        image_type=image_type,
+        tile_sizes=tile_sizes,
+        **kwargs,
+    )
+    mosaic.replace_tiles(libraries, inplace=True, cmp=cmp)
+    sizes = ", ".join(f"{len(level)} of {level.tile_size}px" for level in mosaic.levels)
+    typer.echo(
+        f"Matched {mosaic.compared} blocks instead of {mosaic.uniform_blocks} ({sizes})",
+        err=True,
+    )
+    return mosaic
+
+
 @app.command()
 def main(
+    ctx: typer.Context,
     infile: pathlib.Path,
     scale: float = 1.0,
     tile_size: int = 8,
@@ -85,38 +240,432 @@ def main(
     invert: bool = False,
     mode: ImageMode = ImageMode.grayscale,
     outfile: typing.Optional[pathlib.Path] = None,
-    tile_directory: pathlib.Path = rusty_mosaic.tile_library.ASCII_TILES,
+    tile_directory: pathlib.Path = rusty_mosaic.assets.ASCII_TILES,
+    comparator: typing.Optional[str] = typer.Option(None, help=COMPARATOR_HELP),
+    cache: bool = typer.Option(True, help="Reuse processed tiles from previous runs"),
+    tile_workers: typing.Optional[int] = typer.Option(
+        None, help="How many tiles to decode in parallel, defaults to one per core"
+    ),
+    temporal_threshold: typing.Optional[float] = typer.Option(
+        None,
+        help="For GIFs, only re-match blocks whose mean squared difference from the previous frame exceeds this",
+    ),
+    n_probe: int = typer.Option(
+        8, help="How many clusters the ivf_distance comparator searches per block"
+    ),
+    memoize: bool = typer.Option(
+        False, help="Match identical blocks once and remember their tiles"
+    ),
+    stream: bool = typer.Option(
+        False,
+        help="For GIFs, decode, match and write frames in batches to bound memory",
+    ),
+    batch_size: int = typer.Option(32, help="How many GIF frames to stream at once"),
+    strip_rows: typing.Optional[int] = typer.Option(
+        None,
+        help="For still images, match and write this many rows of tiles at a time to a .png or .pnm outfile",
+    ),
+    full_resolution: bool = typer.Option(
+        False, help="Save still images without shrinking them to fit 4000 pixels"
+    ),
+    levels: int = typer.Option(
+        1,
+        help="For still images, also use tiles 2, 4, ... times larger than --tile-size where the image is flat",
+    ),
+    variance_threshold: float = typer.Option(
+        100.0, help="With --levels, split tiles whose pixel variance exceeds this"
+    ),
+    error_threshold: typing.Optional[float] = typer.Option(
+        None,
+        help="With --levels, also split tiles whose mean squared difference from their best match exceeds this",
+    ),
+    record: typing.Optional[pathlib.Path] = typer.Option(
+        None,
+        help="Also save the matched tile indices here so `mosaicfy render` can re-render them",
+    ),
+    profile: typing.Optional[pathlib.Path] = typer.Option(
+        None, help="Write per-stage and per-frame timings and peak memory here as JSON"
+    ),
 ):
+    """Turn an image or GIF into a mosaic"""
+    start_profile(ctx, profile)
     if (show, outfile) == (False, None):
         raise ValueError("You must either show the mosaic or save it to a file")
 
     gif = is_gif(infile)
+    # classes are looked up by name so only the one in use gets imported
     callback_map: typing.Dict[
-        typing.Tuple[bool, bool], typing.Tuple[typing.Any, typing.Callable]
+        typing.Tuple[bool, bool], typing.Tuple[str, typing.Callable]
     ] = {
-        (False, False): (rusty_mosaic.mosaic.ImageMosaic, show_image_mosaic),
-        (False, True): (rusty_mosaic.mosaic.GifMosaic, make_show_gif_mosaic(outfile)),
-        (True, True): (
-            rusty_mosaic.mosaic.TextGifMosaic,
-            show_text_gif,
-        ),
-        (True, False): (rusty_mosaic.mosaic.TextMosaic, show_text_mosaic),
+        (False, False): ("ImageMosaic", show_image_mosaic),
+        (False, True): ("GifMosaic", make_show_gif_mosaic(outfile)),
+        (True, True): ("TextGifMosaic", show_text_gif),
+        (True, False): ("TextMosaic", show_text_mosaic),
     }
-    cls, show_callback = callback_map[(text, gif)]
-    cls: rusty_mosaic.mosaic.Mosaic
+    class_name, show_callback = callback_map[(text, gif)]
     show_callback: ShowCallback
-    mosaic = cls.load(infile, tile_size, scale=scale, invert=invert, image_type=mode)
+    if stream and (text or not gif or outfile is None):
+        raise typer.BadParameter(
+            "Streaming needs a GIF input, image output and an --outfile",
+            param_hint="--stream",
+        )
+
+    if strip_rows is not None and (text or gif or outfile is None):
+        raise typer.BadParameter(
+            "Strips need a still image input, image output and an --outfile",
+            param_hint="--strip-rows",
+        )
+
+    if record is not None and (stream or strip_rows is not None):
+        raise typer.BadParameter(
+            "Records cannot be made while streaming", param_hint="--record"
+        )
+
+    if levels > 1 and (text or gif or strip_rows is not None or record is not None):
+        raise typer.BadParameter(
+            "Adaptive tiles need a still image input and image output, without strips or records",
+            param_hint="--levels",
+        )
+
+    if levels > 1 and comparator == "ivf_distance":
+        raise typer.BadParameter(
+            "ivf_distance indexes a single tile size", param_hint="--levels"
+        )
+
     tiles = rusty_mosaic.tile_library.TileLibrary.from_directory(
-        tile_directory, tile_size=tile_size, image_type=mode
+        tile_directory,
+        tile_size=tile_size,
+        image_type=mode,
+        cache_dir=rusty_mosaic.utils.cache_directory() if cache else None,
+        workers=tile_workers,
     )
-    cmp = (
-        rusty_mosaic.comparisons.euclid_distance_rust_i32
-        if gif
-        else rusty_mosaic.comparisons.parallel_euclid_distance_rust_i32
+    cmp = make_comparator(comparator, tiles, n_probe=n_probe, cache=cache)
+    if memoize:
+        cmp = rusty_mosaic.comparisons.MemoizedComparator(cmp)
+    if levels > 1:
+        mosaic = make_adaptive_mosaic(
+            infile,
+            tiles,
+            cmp,
+            levels,
+            scale=scale,
+            invert=invert,
+            image_type=mode,
+            tile_directory=tile_directory,
+            cache=cache,
+            tile_workers=tile_workers,
+            variance_threshold=variance_threshold,
+            error_threshold=error_threshold,
+        )
+        if outfile:
+            mosaic.save(outfile, thumbnail=not full_resolution)
+        if show:
+            show_image_mosaic(mosaic)
+        return
+
+    if stream:
+        report_match_stats(
+            rusty_mosaic.mosaic.GifMosaic.stream(
+                infile,
+                outfile,
+                tiles,
+                tile_size,
+                image_type=mode,
+                scale=scale,
+                invert=invert,
+                cmp=cmp,
+                batch_size=batch_size,
+                threshold=temporal_threshold,
+            )
+        )
+        if show:
+            show_gif(str(outfile))
+        return
+
+    if strip_rows is not None:
+        rusty_mosaic.mosaic.ImageMosaic.stream(
+            infile,
+            outfile,
+            tiles,
+            tile_size,
+            image_type=mode,
+            scale=scale,
+            invert=invert,
+            cmp=cmp,
+            strip_rows=strip_rows,
+        )
+        return
+
+    cls: "rusty_mosaic.mosaic.Mosaic" = getattr(rusty_mosaic.mosaic, class_name)
+    mosaic = cls.load(infile, tile_size, scale=scale, invert=invert, image_type=mode)
+    # image mosaics keep tile indices and render straight into the output on save
+    replace_options = {} if text else {"lazy": True}
+    if gif:
+        mosaic.replace_tiles(
+            tiles,
+            inplace=True,
+            cmp=cmp,
+            threshold=temporal_threshold,
+            **replace_options,
+        )
+        report_match_stats(mosaic.match_stats)
+    else:
+        mosaic.replace_tiles(tiles, inplace=True, cmp=cmp, **replace_options)
+    if memoize:
+        typer.echo(cmp.cache_info(), err=True)
+    if record is not None:
+        rusty_mosaic.mosaic.MosaicRecord.from_mosaic(
+            mosaic,
+            tiles,
+            params={
+                "infile": str(infile),
+                "scale": scale,
+                "invert": invert,
+                "image_type": mode.value,
+                "tile_directory": str(tile_directory),
+                "comparator": comparator,
+            },
+        ).save(record)
+    if outfile and full_resolution and not (text or gif):
+        mosaic.save(outfile, thumbnail=False)
+    elif outfile:
+        mosaic.save(outfile)
+
+    if show:
+        show_callback(mosaic)
+
+
+@app.command()
+def render(
+    ctx: typer.Context,
+    record: pathlib.Path,
+    tile_size: typing.Optional[int] = typer.Option(
+        None,
+        help="Render with tiles of this size, defaults to the size they were matched at",
+    ),
+    text: bool = False,
+    show: bool = False,
+    outfile: typing.Optional[pathlib.Path] = None,
+    tile_directory: typing.Optional[pathlib.Path] = typer.Option(
+        None, help="Defaults to the directory the record was matched with"
+    ),
+    cache: bool = typer.Option(True, help="Reuse processed tiles from previous runs"),
+    full_resolution: bool = typer.Option(
+        False, help="Save still images without shrinking them to fit 4000 pixels"
+    ),
+    profile: typing.Optional[pathlib.Path] = typer.Option(
+        None, help="Write per-stage and per-frame timings and peak memory here as JSON"
+    ),
+):
+    """Render a mosaic saved with --record again without decoding or matching its source"""
+    start_profile(ctx, profile)
+    if (show, outfile) == (False, None):
+        raise ValueError("You must either show the mosaic or save it to a file")
+
+    saved = rusty_mosaic.mosaic.MosaicRecord.load(record)
+    tiles = rusty_mosaic.tile_library.TileLibrary.from_directory(
+        tile_directory
+        or saved.params.get("tile_directory", rusty_mosaic.assets.ASCII_TILES),
+        tile_size=tile_size or saved.tile_size,
+        image_type=saved.params.get("image_type", ImageMode.grayscale.value),
+        cache_dir=rusty_mosaic.utils.cache_directory() if cache else None,
     )
-    mosaic.replace_tiles(tiles, inplace=True, cmp=cmp)
-    if outfile:
+    try:
+        mosaic = saved.render(tiles, text=text)
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="RECORD")
+
+    if outfile and full_resolution and not (text or saved.animated):
+        mosaic.save(outfile, thumbnail=False)
+    elif outfile:
         mosaic.save(outfile)
 
     if show:
+        show_callback: ShowCallback = {
+            (False, False): show_image_mosaic,
+            (False, True): make_show_gif_mosaic(outfile),
+            (True, True): show_text_gif,
+            (True, False): show_text_mosaic,
+        }[(text, saved.animated)]
         show_callback(mosaic)
+
+
+@app.command()
+def batch(
+    inputs: typing.List[str] = typer.Argument(
+        ...,
+        help="Directories, glob patterns, or .txt/.jsonl manifests of images and GIFs",
+    ),
+    output: typing.Optional[str] = typer.Option(
+        None,
+        help="Where to write each mosaic, formatted with {parent}, {stem}, {suffix} and {index}. Defaults to {parent}/{stem}-mosaic{suffix}",
+    ),
+    scale: float = 1.0,
+    tile_size: int = 8,
+    text: bool = False,
+    invert: bool = False,
+    mode: ImageMode = ImageMode.grayscale,
+    tile_directory: pathlib.Path = rusty_mosaic.assets.ASCII_TILES,
+    comparator: typing.Optional[str] = typer.Option(
+        None,
+        help=f"{COMPARATOR_HELP}, defaults to a single threaded comparator since inputs run in parallel",
+    ),
+    cache: bool = typer.Option(True, help="Reuse processed tiles from previous runs"),
+    tile_workers: typing.Optional[int] = typer.Option(
+        None, help="How many tiles to decode in parallel, defaults to one per core"
+    ),
+    temporal_threshold: typing.Optional[float] = typer.Option(
+        None,
+        help="For GIFs, only re-match blocks whose mean squared difference from the previous frame exceeds this",
+    ),
+    n_probe: int = typer.Option(
+        8, help="How many clusters the ivf_distance comparator searches per block"
+    ),
+    full_resolution: bool = typer.Option(
+        False, help="Save still images without shrinking them to fit 4000 pixels"
+    ),
+    jobs: typing.Optional[int] = typer.Option(
+        None, help="How many inputs to process at once, defaults to one per core"
+    ),
+):
+    """Mosaicfy many inputs in one process, building each tile library only once
+
+    A .jsonl manifest can override any setting per input, e.g.
+    {"infile": "cat.gif", "outfile": "out/cat.gif", "tile_size": 16, "text": true}
+    """
+    try:
+        batch_jobs = rusty_mosaic.batch.make_jobs(
+            inputs,
+            output or rusty_mosaic.batch.DEFAULT_TEMPLATE,
+            tile_directory=tile_directory,
+            tile_size=tile_size,
+            image_type=mode.value,
+            scale=scale,
+            text=text,
+            invert=invert,
+            temporal_threshold=temporal_threshold,
+            full_resolution=full_resolution,
+        )
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="INPUTS")
+    if not batch_jobs:
+        raise typer.BadParameter("No images or GIFs found", param_hint="INPUTS")
+
+    pool = rusty_mosaic.tile_library.TileLibraryPool(
+        cache_dir=rusty_mosaic.utils.cache_directory() if cache else None,
+        workers=tile_workers,
+    )
+    width = len(str(len(batch_jobs)))
+
+    def progress(finished: int, result: "rusty_mosaic.batch.BatchResult") -> None:
+        status = (
+            f"-> {result.job.outfile}"
+            if result.ok
+            else f"failed: {type(result.error).__name__}: {result.error}"
+        )
+        typer.echo(
+            f"[{finished:>{width}}/{len(batch_jobs)}] {result.job.infile} {status} ({result.seconds:.2f}s)",
+            err=True,
+        )
+
+    start = time.perf_counter()
+    results = rusty_mosaic.batch.run_batch(
+        batch_jobs,
+        pool,
+        comparator_for=lambda tiles: make_comparator(
+            comparator,
+            tiles,
+            n_probe=n_probe,
+            cache=cache,
+            default=rusty_mosaic.comparisons.default_comparator,
+        ),
+        workers=jobs,
+        progress=progress,
+    )
+    failures = [result for result in results if not result.ok]
+    libraries = "tile library" if len(pool) == 1 else "tile libraries"
+    typer.echo(
+        f"Made {len(results) - len(failures)} of {len(results)} mosaics with {len(pool)} {libraries} in {time.perf_counter() - start:.2f}s",
+        err=True,
+    )
+    for result in failures:
+        typer.echo(f"  {result.job.infile}: {result.error}", err=True)
+    if failures:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket: typing.Optional[pathlib.Path] = typer.Option(
+        None, help="Listen on this unix socket instead of a TCP port"
+    ),
+    tile_directory: typing.List[pathlib.Path] = typer.Option(
+        [rusty_mosaic.assets.ASCII_TILES],
+        help="A tile directory requests may use by name, the first is the default",
+    ),
+    tile_size: typing.List[int] = typer.Option(
+        [8], help="A tile size requests may use, the first is the default"
+    ),
+    mode: ImageMode = typer.Option(
+        ImageMode.grayscale, help="The image mode to warm up on start"
+    ),
+    comparator: typing.Optional[str] = typer.Option(None, help=COMPARATOR_HELP),
+    n_probe: int = typer.Option(
+        8, help="How many clusters the ivf_distance comparator searches per block"
+    ),
+    window: float = typer.Option(
+        2.0,
+        help="How many milliseconds a request waits for others to share its comparator call",
+    ),
+    workers: typing.Optional[int] = typer.Option(
+        None, help="How many requests to work on at once, defaults to one per core"
+    ),
+    max_scale: float = typer.Option(
+        4.0, help="The largest scale a request may ask for"
+    ),
+    max_pixels: int = typer.Option(
+        16_000_000, help="The most pixels a mosaic may have, counting every GIF frame"
+    ),
+    max_body: int = typer.Option(
+        32 * 1024 * 1024, help="The largest upload in bytes, larger ones get a 413"
+    ),
+    cache: bool = typer.Option(True, help="Reuse processed tiles from previous runs"),
+):
+    """Serve mosaics over HTTP with warm tile libraries
+
+    POST an image or GIF to /mosaic?tile_size=8&mode=L&scale=1&text=0&invert=0&library=NAME
+    to get a PNG, GIF or text mosaic back. GET /health reports the service's state.
+    """
+    service = rusty_mosaic.server.MosaicService(
+        tile_directories=tile_directory,
+        tile_sizes=tile_size,
+        max_scale=max_scale,
+        max_pixels=max_pixels,
+        max_body=max_body,
+        pool=rusty_mosaic.tile_library.TileLibraryPool(
+            cache_dir=rusty_mosaic.utils.cache_directory() if cache else None
+        ),
+        # every library gets its own comparator, e.g. ivf_distance with its own index
+        comparator_for=lambda tiles: rusty_mosaic.server.CoalescingComparator(
+            cmp=make_comparator(comparator, tiles, n_probe=n_probe, cache=cache),
+            window=window / 1000,
+        ),
+        workers=workers,
+    )
+    service.warm(mode.value)
+    httpd = rusty_mosaic.server.make_server(service, host, port, socket_path=socket)
+    typer.echo(
+        f"Serving mosaics on {socket or f'http://{host}:{port}'}, press Ctrl+C to stop",
+        err=True,
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+        if socket is not None:
+            socket.unlink(missing_ok=True)
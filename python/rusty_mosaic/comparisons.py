@@ -1,8 +1,17 @@
 import typing
+import hashlib
+import threading
+import collections
+import dataclasses
 import numpy as np
 import numpy.typing as npt
 
-from rusty_mosaic import _lib  # type: ignore
+try:
+    from rusty_mosaic import _lib  # type: ignore
+except ImportError:  # the extension is not built, e.g. slim installs or PyPy
+    _lib = None
+
+RUST_AVAILABLE = _lib is not None
 
 
 IndexArray = npt.NDArray[np.uint]
@@ -29,6 +38,382 @@ class TileComparator(typing.Protocol):
         ...
 
 
-euclid_distance_rust_i32: TileComparator = _lib.find_best_tiles_i32
-euclid_distance_rust_f64: TileComparator = _lib.find_best_tiles_f64
-parallel_euclid_distance_rust_i32: TileComparator = _lib.parallel_find_best_tiles_i32
+_BUFFER_KERNELS = {
+    np.dtype(np.uint8): "find_best_tiles_buffer_u8",
+    np.dtype(np.int32): "find_best_tiles_buffer_i32",
+    np.dtype(np.float64): "find_best_tiles_buffer_f64",
+}
+
+
+def _kernel(name: str) -> typing.Callable[..., IndexArray]:
+    if _lib is None:
+        raise RuntimeError(
+            "The rusty_mosaic._lib extension is not built, use blas_distance instead"
+        )
+    return getattr(_lib, name)
+
+
+def flatten_rows(data: np.ndarray) -> np.ndarray:
+    """View blocks or tiles as one row of values each
+
+    The width is spelled out rather than inferred, which fails when there are no rows,
+    e.g. for an image smaller than one tile.
+    """
+    return data.reshape(data.shape[0], int(np.prod(data.shape[1:], dtype=np.intp)))
+
+
+def _as_rows(data: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    return flatten_rows(np.ascontiguousarray(data, dtype=dtype))
+
+
+def _buffer_comparator(
+    dtype: npt.DTypeLike, parallel: bool, threads: int = 0
+) -> TileComparator:
+    """Build a comparator that lends NumPy buffers to ``_lib`` without copying them
+
+    ``uint8`` blocks and tiles are compared as they are, anything else is cast to ``dtype``.
+    The GIL is released while the kernel runs, on ``threads`` threads when it is
+    parallel, 0 meaning one per core.
+    """
+
+    def compare(
+        image_blocks: typing.Union[IntArray, Float64Array],
+        tiles: typing.Union[IntArray, Float64Array],
+    ) -> IndexArray:
+        image_blocks = np.asarray(image_blocks)
+        tiles = np.asarray(tiles)
+        kernel_dtype = np.dtype(dtype)
+        if image_blocks.dtype == tiles.dtype == np.uint8:
+            kernel_dtype = np.dtype(np.uint8)
+        return _kernel(_BUFFER_KERNELS[kernel_dtype])(
+            _as_rows(image_blocks, kernel_dtype),
+            _as_rows(tiles, kernel_dtype),
+            parallel,
+            threads,
+        )
+
+    return compare
+
+
+euclid_distance_rust_i32: TileComparator = _buffer_comparator(np.int32, parallel=False)
+euclid_distance_rust_f64: TileComparator = _buffer_comparator(np.float64, parallel=True)
+parallel_euclid_distance_rust_i32: TileComparator = _buffer_comparator(
+    np.int32, parallel=True
+)
+
+
+def _u8_comparator(
+    kernel: str, *options: typing.Any, threads: int = 0
+) -> TileComparator:
+    """Build a comparator around one of the ``uint8`` kernels
+
+    Pixel values always fit in a byte, so blocks and tiles are cast to ``uint8`` and
+    compared with 16-bit lanes that the compiler can vectorise. Parallel kernels run on
+    ``threads`` threads, 0 meaning one per core.
+    """
+
+    def compare(
+        image_blocks: typing.Union[IntArray, Float64Array],
+        tiles: typing.Union[IntArray, Float64Array],
+    ) -> IndexArray:
+        return _kernel(kernel)(
+            _as_rows(image_blocks, np.uint8),
+            _as_rows(tiles, np.uint8),
+            *options,
+            threads=threads,
+        )
+
+    return compare
+
+
+euclid_distance_rust_u8: TileComparator = _u8_comparator(
+    "find_best_tiles_buffer_u8", False
+)
+parallel_euclid_distance_rust_u8: TileComparator = _u8_comparator(
+    "find_best_tiles_buffer_u8", True
+)
+# the sum of absolute differences is cheaper and usually picks the same tiles
+sad_distance_rust_u8: TileComparator = _u8_comparator(
+    "find_best_tiles_buffer_sad_u8", False
+)
+parallel_sad_distance_rust_u8: TileComparator = _u8_comparator(
+    "find_best_tiles_buffer_sad_u8", True
+)
+# compare runs of blocks against cache-sized chunks of the library, better for large libraries
+blocked_euclid_distance_rust_u8: TileComparator = _u8_comparator(
+    "find_best_tiles_blocked_u8", False, True
+)
+blocked_sad_distance_rust_u8: TileComparator = _u8_comparator(
+    "find_best_tiles_blocked_u8", True, True
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class BlasComparator:
+    """Find the best tiles with a chunked matrix multiply instead of the ``_lib`` kernels
+
+    Distances are expanded as ``|a|^2 + |b|^2 - 2 a.b``, so the heavy lifting is a single
+    BLAS matrix product per chunk of image blocks. ``|a|^2`` is the same for every tile and
+    is dropped before the argmin. Integer inputs are exact in float64, so the result matches
+    ``euclid_distance_rust_i32`` including the lowest index winning ties.
+
+    Args:
+        memory_budget (int, optional): The most bytes a chunk's distance matrix may use. Defaults to 64 MiB.
+    """
+
+    memory_budget: int = 64 * 1024 * 1024
+
+    def chunk_size(self, n_tiles: int, block_size: int) -> int:
+        """How many image blocks to compare per matrix multiply"""
+        row_bytes = (n_tiles + block_size) * np.dtype(np.float64).itemsize
+        return max(1, self.memory_budget // max(row_bytes, 1))
+
+    def __call__(
+        self,
+        image_blocks: typing.Union[IntArray, Float64Array],
+        tiles: typing.Union[IntArray, Float64Array],
+    ) -> IndexArray:
+        image_blocks = flatten_rows(np.asarray(image_blocks))
+        tiles = flatten_rows(np.asarray(tiles, dtype=np.float64))
+        best = np.zeros(image_blocks.shape[0], dtype=np.uintp)
+        if tiles.shape[0] == 0:
+            return best
+
+        tiles_t = np.ascontiguousarray(tiles.T)
+        tile_norms = np.einsum("ij,ij->i", tiles, tiles)
+        step = self.chunk_size(tiles.shape[0], tiles.shape[1])
+        for start in range(0, image_blocks.shape[0], step):
+            chunk = image_blocks[start : start + step].astype(np.float64)
+            distances = chunk @ tiles_t
+            distances *= -2
+            distances += tile_norms
+            best[start : start + step] = distances.argmin(axis=1)
+        return best
+
+
+blas_distance: TileComparator = BlasComparator()
+
+
+@dataclasses.dataclass(frozen=True)
+class PrunedComparator:
+    """Find the exact best tiles while skipping tiles that provably cannot win
+
+    Tiles are summarised by their sum, norm and a signature of ``groups`` partial sums.
+    Each of these gives a lower bound on the squared distance to a block, so tiles whose
+    bound exceeds the best distance found so far are never compared, and a comparison is
+    abandoned as soon as its partial sum passes the best distance. Tiles are visited in
+    order of how close their mean is to the block's, which lets the search stop early.
+    Results, including ties, are identical to a brute force search.
+
+    Only ``uint8`` blocks and tiles are pruned, anything else falls back to brute force.
+
+    Args:
+        groups (int, optional): How many partial sums make up a tile's signature. Defaults to 16.
+        parallel (bool, optional): Search for several blocks at once. Defaults to True.
+        threads (int, optional): How many threads a parallel search uses, 0 for one per core. Defaults to 0.
+    """
+
+    groups: int = 16
+    parallel: bool = True
+    threads: int = 0
+
+    def __call__(
+        self,
+        image_blocks: typing.Union[IntArray, Float64Array],
+        tiles: typing.Union[IntArray, Float64Array],
+    ) -> IndexArray:
+        image_blocks = np.asarray(image_blocks)
+        tiles = np.asarray(tiles)
+        if not image_blocks.dtype == tiles.dtype == np.uint8:
+            return _buffer_comparator(np.int32, self.parallel, self.threads)(
+                image_blocks, tiles
+            )
+        return _kernel("find_best_tiles_pruned_u8")(
+            _as_rows(image_blocks, np.uint8),
+            _as_rows(tiles, np.uint8),
+            self.groups,
+            self.parallel,
+            self.threads,
+        )
+
+
+pruned_euclid_distance_rust_u8: TileComparator = PrunedComparator()
+
+default_comparator: TileComparator = (
+    euclid_distance_rust_i32 if RUST_AVAILABLE else blas_distance
+)
+default_parallel_comparator: TileComparator = (
+    parallel_euclid_distance_rust_i32 if RUST_AVAILABLE else blas_distance
+)
+
+COMPARATORS: typing.Dict[str, TileComparator] = {
+    "euclid_distance_rust_i32": euclid_distance_rust_i32,
+    "euclid_distance_rust_f64": euclid_distance_rust_f64,
+    "parallel_euclid_distance_rust_i32": parallel_euclid_distance_rust_i32,
+    "blas_distance": blas_distance,
+    "pruned_euclid_distance_rust_u8": pruned_euclid_distance_rust_u8,
+    "euclid_distance_rust_u8": euclid_distance_rust_u8,
+    "parallel_euclid_distance_rust_u8": parallel_euclid_distance_rust_u8,
+    "sad_distance_rust_u8": sad_distance_rust_u8,
+    "parallel_sad_distance_rust_u8": parallel_sad_distance_rust_u8,
+    "blocked_euclid_distance_rust_u8": blocked_euclid_distance_rust_u8,
+    "blocked_sad_distance_rust_u8": blocked_sad_distance_rust_u8,
+}
+
+
+# exact comparators that can be built for a thread count, see threaded_comparator
+_THREADED: typing.Dict[str, typing.Callable[[bool, int], TileComparator]] = {
+    "euclid_distance_rust_i32": lambda parallel, threads: _buffer_comparator(
+        np.int32, parallel, threads
+    ),
+    "euclid_distance_rust_u8": lambda parallel, threads: _u8_comparator(
+        "find_best_tiles_buffer_u8", parallel, threads=threads
+    ),
+    "blocked_euclid_distance_rust_u8": lambda parallel, threads: _u8_comparator(
+        "find_best_tiles_blocked_u8", False, parallel, threads=threads
+    ),
+    "pruned_euclid_distance_rust_u8": lambda parallel, threads: PrunedComparator(
+        parallel=parallel, threads=threads
+    ),
+}
+THREADED_COMPARATORS = tuple(_THREADED)
+
+
+def threaded_comparator(name: str, threads: int = 0) -> TileComparator:
+    """One of THREADED_COMPARATORS running on a set number of threads
+
+    Args:
+        name (str): The comparator, e.g. "euclid_distance_rust_u8"
+        threads (int, optional): 1 runs on the calling thread, more in a pool of that many threads and 0 in a pool with one per core. Defaults to 0.
+    """
+    if name not in _THREADED:
+        raise ValueError(
+            f"Unknown comparator {name!r}, expected one of {', '.join(_THREADED)}"
+        )
+    if threads < 0:
+        raise ValueError(f"threads must not be negative, got {threads}")
+    return _THREADED[name](threads != 1, threads)
+
+
+def find_best_tiles_batched(
+    block_batches: typing.Sequence[np.ndarray],
+    tiles: typing.Union[IntArray, Float64Array],
+    cmp: TileComparator = default_parallel_comparator,
+) -> typing.List[IndexArray]:
+    """Find the best tiles for several block matrices, e.g. GIF frames, with one comparator call
+
+    Args:
+        block_batches (typing.Sequence[np.ndarray]): The flattened blocks of each batch
+        tiles (typing.Union[IntArray, Float64Array]): A list of flattened tiles to replace the image blocks with
+        cmp (TileComparator, optional): A strategy to find the best tiles. Defaults to default_parallel_comparator.
+
+    Returns:
+        typing.List[IndexArray]: The best tile indexes for each batch
+    """
+    if not block_batches:
+        return []
+    best = np.asarray(cmp(np.concatenate(block_batches), tiles))
+    return np.split(best, np.cumsum([len(blocks) for blocks in block_batches])[:-1])
+
+
+class CacheInfo(typing.NamedTuple):
+    hits: int
+    misses: int
+    duplicates: int
+    maxsize: typing.Optional[int]
+    currsize: int
+
+
+@dataclasses.dataclass
+class MemoizedComparator:
+    """Wrap a comparator so that byte-identical blocks are only matched once
+
+    Every batch is deduplicated before it reaches ``cmp`` and the unique results are
+    scattered back. Results are also kept in an LRU cache keyed by the block's bytes,
+    so repeated blocks are free across frames and calls. The cache is cleared when the
+    comparator is called with different tiles.
+
+    Args:
+        cmp (TileComparator, optional): The comparator to call for blocks that have not been seen. Defaults to default_parallel_comparator.
+        maxsize (typing.Optional[int], optional): How many blocks to remember, None for no limit and 0 to only deduplicate within a batch. Defaults to 65536.
+    """
+
+    cmp: TileComparator = default_parallel_comparator
+    maxsize: typing.Optional[int] = 65_536
+    hits: int = dataclasses.field(default=0, init=False)
+    misses: int = dataclasses.field(default=0, init=False)
+    duplicates: int = dataclasses.field(default=0, init=False)
+    _cache: "collections.OrderedDict[bytes, int]" = dataclasses.field(
+        default_factory=collections.OrderedDict, init=False, repr=False
+    )
+    _tiles: typing.Optional[np.ndarray] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+    _tiles_digest: typing.Optional[bytes] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits, self.misses, self.duplicates, self.maxsize, len(self._cache)
+        )
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = self.duplicates = 0
+
+    def _use_tiles(self, tiles: np.ndarray) -> None:
+        if tiles is self._tiles:
+            return
+        digest = hashlib.blake2b(
+            np.ascontiguousarray(tiles).tobytes(), digest_size=16
+        ).digest()
+        if digest != self._tiles_digest:
+            self._cache.clear()
+        self._tiles, self._tiles_digest = tiles, digest
+
+    def __call__(
+        self,
+        image_blocks: typing.Union[IntArray, Float64Array],
+        tiles: typing.Union[IntArray, Float64Array],
+    ) -> IndexArray:
+        image_blocks = flatten_rows(np.ascontiguousarray(image_blocks))
+        row_type = np.dtype(
+            (np.void, image_blocks.dtype.itemsize * image_blocks.shape[1])
+        )
+        keys, first, inverse = np.unique(
+            image_blocks.view(row_type).ravel(), return_index=True, return_inverse=True
+        )
+
+        with self._lock:
+            self._use_tiles(np.asarray(tiles))
+            digest = self._tiles_digest
+            unique_best = np.empty(keys.shape[0], dtype=np.uintp)
+            missing = []
+            for position, key in enumerate(keys):
+                index = self._cache.get(key.tobytes())
+                if index is None:
+                    missing.append(position)
+                else:
+                    self._cache.move_to_end(key.tobytes())
+                    unique_best[position] = index
+            self.hits += keys.shape[0] - len(missing)
+            self.misses += len(missing)
+            self.duplicates += image_blocks.shape[0] - keys.shape[0]
+
+        if missing:
+            unique_best[missing] = self.cmp(image_blocks[first[missing]], tiles)
+
+        with self._lock:
+            # a call with other tiles may have cleared the cache while cmp ran, its
+            # entries must not be mixed with indexes into the tiles used here
+            if self.maxsize != 0 and self._tiles_digest == digest:
+                for position in missing:
+                    self._cache[keys[position].tobytes()] = int(unique_best[position])
+                while self.maxsize is not None and len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return unique_best[inverse.reshape(-1)]
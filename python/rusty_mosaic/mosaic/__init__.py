@@ -1,16 +1,29 @@
 import typing
 import pathlib
+import importlib
 
 import numpy as np
 
 from rusty_mosaic import comparisons
 from rusty_mosaic import tile_library
 
-from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
-from rusty_mosaic.mosaic.text_mosaic import TextMosaic
-from rusty_mosaic.mosaic.gif_mosaic import GifMosaic
-from rusty_mosaic.mosaic.text_gif_mosaic import TextGifMosaic
-
+if typing.TYPE_CHECKING:
+    from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+    from rusty_mosaic.mosaic.text_mosaic import TextMosaic
+    from rusty_mosaic.mosaic.gif_mosaic import GifMosaic
+    from rusty_mosaic.mosaic.text_gif_mosaic import TextGifMosaic
+    from rusty_mosaic.mosaic.mosaic_record import MosaicRecord
+    from rusty_mosaic.mosaic.adaptive_mosaic import AdaptiveImageMosaic
+
+# each class is imported on first use, so still images never import imageio
+_MODULES = {
+    "ImageMosaic": "image_mosaic",
+    "TextMosaic": "text_mosaic",
+    "GifMosaic": "gif_mosaic",
+    "TextGifMosaic": "text_gif_mosaic",
+    "MosaicRecord": "mosaic_record",
+    "AdaptiveImageMosaic": "adaptive_mosaic",
+}
 
 PathLike = typing.Union[str, pathlib.Path]
 
@@ -49,14 +62,14 @@ class Mosaic(typing.Protocol):
     def replace_tiles(
         self,
         tiles: tile_library.TileLibrary,
-        cmp: comparisons.TileComparator = comparisons.euclid_distance_rust_i32,
+        cmp: comparisons.TileComparator = comparisons.default_comparator,
         inplace: bool = False,
     ) -> "Mosaic":
         """Replace the mosaic's tile data with those from the specified tile library
 
         Args:
             tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
-            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.euclid_distance_rust_i32.
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_comparator.
             inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
 
         Returns:
@@ -65,4 +78,24 @@ class Mosaic(typing.Protocol):
         ...
 
 
-__all__ = ["Mosaic", "GifMosaic", "TextGifMosaic", "TextMosaic", "ImageMosaic"]
+__all__ = [
+    "Mosaic",
+    "GifMosaic",
+    "TextGifMosaic",
+    "TextMosaic",
+    "ImageMosaic",
+    "MosaicRecord",
+    "AdaptiveImageMosaic",
+]
+
+
+def __getattr__(name: str) -> typing.Any:
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{_MODULES[name]}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted({*globals(), *__all__})
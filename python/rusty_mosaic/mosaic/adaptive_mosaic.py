@@ -0,0 +1,334 @@
+import typing
+import pathlib
+import dataclasses
+
+from PIL import Image
+import numpy as np
+
+from rusty_mosaic import utils
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+from rusty_mosaic import profiling
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+
+
+@dataclasses.dataclass
+class TileLevel:
+    """The regions of an adaptive mosaic that are covered by tiles of one size
+
+    Args:
+        tile_size (int): The size of every region on this level
+        positions (np.ndarray): The (n, 2) top left row and column of each region, in pixels
+        tile_indices (comparisons.IndexArray): The tile of each region
+        compared (int): How many blocks were sent to the comparator at this size, including those that were split after matching
+    """
+
+    tile_size: int
+    positions: np.ndarray
+    tile_indices: comparisons.IndexArray
+    compared: int
+
+    def __len__(self) -> int:
+        return self.positions.shape[0]
+
+    def pixel_indices(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Index arrays that select every region's (tile_size, tile_size) pixels from a pixmap"""
+        offsets = np.arange(self.tile_size)
+        rows = self.positions[:, 0, None] + offsets
+        cols = self.positions[:, 1, None] + offsets
+        return rows[:, :, None], cols[:, None, :]
+
+
+@dataclasses.dataclass
+class AdaptiveImageMosaic:
+    """An image covered by tiles of several sizes, large where it is flat and small where it has detail
+
+    The image is first split into blocks of the largest size. A block whose variance
+    exceeds ``variance_threshold`` is split into blocks of the next size without being
+    matched. The rest are matched with a single comparator call for the whole level,
+    and when ``error_threshold`` is set, blocks whose best tile still differs from them
+    by more than it are split too. Blocks of the smallest size are never split. Flat
+    regions then cost one comparison per large tile instead of one per small tile.
+
+    Comparing a large block costs as much as comparing the small blocks it covers, so
+    blocks and tiles are first shrunk to ``match_size`` by averaging. Every comparison
+    then costs the same at every level and fewer blocks means less work. Large tiles are
+    only used where the image is flat, which is where shrinking loses the least.
+
+    Until tiles are replaced the mosaic renders as the source image.
+
+    Args:
+        source (np.ndarray): The (H, W[, C]) pixels, cropped to a multiple of the largest tile size
+        tile_sizes (typing.Tuple[int, ...]): The tile sizes from largest to smallest, each a multiple of the next
+        variance_threshold (float, optional): Split blocks whose pixel variance exceeds this without matching them. Defaults to 100.0.
+        error_threshold (typing.Optional[float], optional): Split matched blocks whose mean squared difference from their tile exceeds this. Defaults to None.
+        match_size (typing.Optional[int], optional): The size blocks and tiles are shrunk to for matching, a divisor of every tile size. Defaults to the smallest tile size.
+        levels (typing.List[TileLevel], optional): The matched regions of each size. Defaults to [].
+        tiles (typing.Dict[int, tile_library.TileLibrary], optional): The library of each tile size the levels refer to. Defaults to {}.
+    """
+
+    MAX_SIZE: typing.ClassVar[int] = ImageMosaic.MAX_SIZE
+
+    source: np.ndarray
+    tile_sizes: typing.Tuple[int, ...]
+    variance_threshold: float = 100.0
+    error_threshold: typing.Optional[float] = None
+    match_size: typing.Optional[int] = None
+    levels: typing.List[TileLevel] = dataclasses.field(default_factory=list)
+    tiles: typing.Dict[int, tile_library.TileLibrary] = dataclasses.field(
+        default_factory=dict, repr=False
+    )
+
+    def __post_init__(self):
+        self.tile_sizes = tuple(self.tile_sizes)
+        if not self.tile_sizes or min(self.tile_sizes) < 1:
+            raise ValueError(f"Invalid tile sizes {self.tile_sizes}")
+        for larger, smaller in zip(self.tile_sizes, self.tile_sizes[1:]):
+            if larger <= smaller or larger % smaller:
+                raise ValueError(
+                    "Tile sizes must go from largest to smallest with each a "
+                    f"multiple of the next, got {self.tile_sizes}"
+                )
+        if self.match_size is None:
+            self.match_size = self.tile_sizes[-1]
+        if self.match_size < 1 or self.tile_sizes[-1] % self.match_size:
+            raise ValueError(
+                f"match_size {self.match_size} must divide the smallest tile size "
+                f"{self.tile_sizes[-1]}"
+            )
+        if any(dim % self.tile_sizes[0] for dim in self.source.shape[:2]):
+            raise ValueError(
+                f"The source's {self.source.shape[:2]} pixels are not a multiple "
+                f"of the largest tile size {self.tile_sizes[0]}"
+            )
+
+    @staticmethod
+    def default_tile_sizes(
+        tile_size: int = 8, depth: int = 3
+    ) -> typing.Tuple[int, ...]:
+        """tile_size and the depth - 1 sizes above it that each double the last, largest first"""
+        return tuple(tile_size << level for level in reversed(range(depth)))
+
+    @classmethod
+    def from_image(
+        cls,
+        image: Image.Image,
+        tile_size: int = 8,
+        tile_sizes: typing.Optional[typing.Sequence[int]] = None,
+        **kwargs: typing.Any,
+    ) -> "AdaptiveImageMosaic":
+        """Crop an image to the largest tile size and wrap it
+
+        Args:
+            image (Image.Image): The image to mosaicfy
+            tile_size (int, optional): The smallest tile size, when tile_sizes is not given. Defaults to 8.
+            tile_sizes (typing.Optional[typing.Sequence[int]], optional): The tile sizes from largest to smallest. Defaults to default_tile_sizes(tile_size).
+            **kwargs: Passed on to the mosaic, e.g. variance_threshold or error_threshold
+        """
+        tile_sizes = tuple(tile_sizes or cls.default_tile_sizes(tile_size))
+        with profiling.stage("crop_tile"):
+            image = utils.crop_tile(image, tile_sizes[0])
+        return cls(np.asarray(image), tile_sizes, **kwargs)
+
+    @classmethod
+    def load(
+        cls,
+        filename: typing.Union[str, pathlib.Path],
+        tile_size: int = 8,
+        image_type: str = "L",
+        scale: typing.Union[int, float] = 1,
+        invert: bool = False,
+        **kwargs: typing.Any,
+    ) -> "AdaptiveImageMosaic":
+        image = ImageMosaic.read_image(filename, image_type, scale=scale, invert=invert)
+        return cls.from_image(image, tile_size, **kwargs)
+
+    @property
+    def compared(self) -> int:
+        """How many blocks were sent to the comparator over every level"""
+        return sum(level.compared for level in self.levels)
+
+    @property
+    def uniform_blocks(self) -> int:
+        """How many blocks a uniform grid of the smallest tile size would have"""
+        height, width = self.source.shape[:2]
+        return (height // self.tile_sizes[-1]) * (width // self.tile_sizes[-1])
+
+    def _regions(self, positions: np.ndarray, tile_size: int) -> np.ndarray:
+        level = TileLevel(tile_size, positions, positions[:0, 0], 0)
+        blocks = self.source[level.pixel_indices()]
+        return blocks.reshape(len(level), -1)
+
+    def _variances(self) -> typing.Dict[int, np.ndarray]:
+        """The pixel variance of every grid block of each tile size but the smallest, as (rows, cols)"""
+        smallest = self.tile_sizes[-1]
+        height, width = self.source.shape[:2]
+        blocks = ImageMosaic._array_to_blocks(self.source, smallest)
+        # sums and sums of squares are taken once per smallest block and added up for
+        # each larger size
+        values = blocks.astype(np.float32)
+        shape = (height // smallest, width // smallest)
+        sums = blocks.sum(axis=1, dtype=np.float64).reshape(shape)
+        squares = (
+            np.einsum("ij,ij->i", values, values).astype(np.float64).reshape(shape)
+        )
+        channels = blocks.shape[1] // (smallest * smallest)
+        variances = {}
+        for tile_size in self.tile_sizes[:-1]:
+            factor = tile_size // smallest
+            rows, cols = sums.shape[0] // factor, sums.shape[1] // factor
+            count = tile_size * tile_size * channels
+            mean = sums.reshape(rows, factor, cols, factor).sum(axis=(1, 3)) / count
+            square = squares.reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+            variances[tile_size] = square / count - mean * mean
+        return variances
+
+    def _match_blocks(self, tile_size: int) -> np.ndarray:
+        """Every block of the tile_size grid shrunk to match_size, in row-major order"""
+        factor = tile_size // self.match_size
+        data = self.source
+        if factor > 1:
+            # a box filter in Pillow is several times faster than a NumPy mean over strides
+            data = np.asarray(Image.fromarray(data).reduce(factor))
+        return ImageMosaic._array_to_blocks(data, self.match_size)
+
+    def _shrink_tiles(self, tile_data: np.ndarray, tile_size: int) -> np.ndarray:
+        """Average (n, tile_size * tile_size * C) tiles down to match_size, keeping their dtype"""
+        size = self.match_size
+        if size == tile_size:
+            return tile_data
+        factor = tile_size // size
+        channels = tile_data.shape[1] // (tile_size * tile_size)
+        shrunk = tile_data.reshape(-1, size, factor, size, factor, channels).mean(
+            axis=(2, 4), dtype=np.float32
+        )
+        if np.issubdtype(tile_data.dtype, np.integer):
+            shrunk = np.rint(shrunk)
+        return shrunk.astype(tile_data.dtype).reshape(tile_data.shape[0], -1)
+
+    @staticmethod
+    def _split(positions: np.ndarray, tile_size: int, child_size: int) -> np.ndarray:
+        offsets = np.arange(0, tile_size, child_size)
+        children = np.stack(np.meshgrid(offsets, offsets, indexing="ij"), axis=-1)
+        return (positions[:, None, None, :] + children).reshape(-1, 2)
+
+    def replace_tiles(
+        self,
+        tiles: typing.Mapping[int, tile_library.TileLibrary],
+        cmp: comparisons.TileComparator = comparisons.default_comparator,
+        inplace: bool = False,
+    ) -> "AdaptiveImageMosaic":
+        """Match the image level by level, making one comparator call per tile size
+
+        The error_threshold is checked against the full size tiles.
+
+        Args:
+            tiles (typing.Mapping[int, tile_library.TileLibrary]): A tile library for each of the mosaic's tile sizes
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_comparator.
+            inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
+        """
+        missing = [size for size in self.tile_sizes if size not in tiles]
+        if missing:
+            raise ValueError(f"There is no tile library for tile sizes {missing}")
+
+        height, width = self.source.shape[:2]
+        largest = self.tile_sizes[0]
+        positions = (
+            np.mgrid[0:height:largest, 0:width:largest].reshape(2, -1).T.astype(np.intp)
+        )
+        with profiling.stage("variance"):
+            variances = self._variances()
+        levels = []
+        for depth, tile_size in enumerate(self.tile_sizes):
+            last = depth == len(self.tile_sizes) - 1
+            grid_index = (positions[:, 0] // tile_size) * (width // tile_size) + (
+                positions[:, 1] // tile_size
+            )
+            split = np.zeros(len(positions), dtype=bool)
+            if not last:
+                variance = variances[tile_size].ravel()[grid_index]
+                split = variance > self.variance_threshold
+            kept = np.flatnonzero(~split)
+            compared = kept.size
+            tile_data = tiles[tile_size].tile_data
+            best = np.empty(0, dtype=np.uintp)
+            if kept.size:
+                with profiling.stage("to_blocks"):
+                    blocks = self._match_blocks(tile_size)[grid_index[kept]]
+                with profiling.stage("match"):
+                    best = np.asarray(
+                        cmp(blocks, self._shrink_tiles(tile_data, tile_size))
+                    )
+            if not last and self.error_threshold is not None and kept.size:
+                blocks = self._regions(positions[kept], tile_size)
+                diff = blocks.astype(np.int32) - tile_data[best]
+                error = np.einsum("ij,ij->i", diff, diff) / max(blocks.shape[1], 1)
+                worse = error > self.error_threshold
+                split[kept[worse]] = True
+                kept, best = kept[~worse], best[~worse]
+            levels.append(TileLevel(tile_size, positions[kept], best, compared))
+            if not last:
+                positions = self._split(
+                    positions[split], tile_size, self.tile_sizes[depth + 1]
+                )
+
+        if inplace:
+            self.levels, self.tiles = levels, dict(tiles)
+            return self
+        return dataclasses.replace(self, levels=levels, tiles=dict(tiles))
+
+    @property
+    def shape(self) -> typing.Tuple[int, ...]:
+        """The shape of the rendered pixmap"""
+        if not self.levels:
+            return self.source.shape
+        values = self.tiles[self.tile_sizes[0]].tile_data.shape[1]
+        channels = values // (self.tile_sizes[0] * self.tile_sizes[0])
+        return self.source.shape[:2] + ((channels,) if channels > 1 else ())
+
+    def render(self, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Write the mosaic's pixels into out, one scatter per tile size
+
+        Args:
+            out (typing.Optional[np.ndarray], optional): A C-contiguous uint8 buffer of the mosaic's shape. Defaults to None.
+        """
+        shape = self.shape
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif out.shape != shape or not out.flags.c_contiguous:
+            raise ValueError(f"The output buffer must be a C-contiguous {shape} array")
+
+        with profiling.stage("render"):
+            if not self.levels:
+                np.copyto(out, self.source)
+                return out
+            for level in self.levels:
+                pixels = self.tiles[level.tile_size].tile_data[level.tile_indices]
+                out[level.pixel_indices()] = pixels.reshape(
+                    len(level), level.tile_size, level.tile_size, *shape[2:]
+                )
+        return out
+
+    @property
+    def image(self) -> Image.Image:
+        return Image.fromarray(self.render())
+
+    @property
+    def pixmap(self) -> np.ndarray:
+        return self.render()
+
+    def save(self, outfile: typing.Union[str, pathlib.Path], thumbnail: bool = True):
+        """Save the mosaic as an image
+
+        Args:
+            outfile (typing.Union[str, pathlib.Path]): Where to save the image
+            thumbnail (bool, optional): Shrink images larger than MAX_SIZE. Defaults to True.
+        """
+        image = self.image
+        with profiling.stage("encode"):
+            if thumbnail and any(dim > self.MAX_SIZE for dim in image.size):
+                image = image.copy()
+                image.thumbnail(
+                    (self.MAX_SIZE, self.MAX_SIZE), Image.Resampling.LANCZOS
+                )
+            image.save(str(outfile))
@@ -6,26 +6,66 @@ import numpy as np
 import imageio.v3 as iio
 from PIL import Image
 from PIL import ImageOps
-from concurrent import futures
 
 from rusty_mosaic import utils
 from rusty_mosaic import mosaic
 from rusty_mosaic import comparisons
 from rusty_mosaic import tile_library
+from rusty_mosaic import temporal
+from rusty_mosaic import writers
+from rusty_mosaic import profiling
 
 
 @dataclasses.dataclass
 class GifMosaic:
     frames: typing.List[mosaic.ImageMosaic]
     fps: int
+    match_stats: typing.List[temporal.FrameMatchStats] = dataclasses.field(
+        default_factory=list, repr=False
+    )
 
     @property
     def tile_data(self):
-        """The tile data from each frame"""
-        return np.asarray([frame.pixmap for frame in self.frames])
+        """The tile data from each frame, rendered into a single preallocated array"""
+        if not self.frames:
+            return np.empty((0,), dtype=np.uint8)
+        out = np.empty((len(self.frames), *self.frames[0].shape), dtype=np.uint8)
+        for index, (frame, frame_out) in enumerate(zip(self.frames, out)):
+            with profiling.frame(index):
+                frame.render(out=frame_out)
+        return out
 
-    def save(self, outfile: typing.Union[str, pathlib.Path]):
-        iio.imwrite(outfile, self.tile_data, fps=self.fps, loop=0)
+    @property
+    def tiles(self) -> typing.Optional[tile_library.TileLibrary]:
+        """The tile library every frame is index-backed by, None unless they share one"""
+        tiles = self.frames[0].tiles if self.frames else None
+        if tiles is None or any(
+            frame.tile_indices is None or frame.tiles is not tiles
+            for frame in self.frames
+        ):
+            return None
+        return tiles
+
+    def save(self, outfile: typing.Union[str, pathlib.Path, typing.BinaryIO]):
+        """Save the frames as an animated GIF
+
+        Index-backed frames are composed straight into palette indices with the tile
+        library's palette and only the tiles that change between frames are written.
+        Other frames are rendered and quantized one by one.
+        """
+        tiles = self.tiles
+        if tiles is None:
+            tile_data = self.tile_data
+            with profiling.stage("encode"):
+                iio.imwrite(outfile, tile_data, extension=".gif", fps=self.fps, loop=0)
+            return
+
+        with profiling.stage("palette"):
+            palette = tiles.gif_palette
+        with writers.TileGifWriter(outfile, palette, fps=self.fps) as writer:
+            for index, frame in enumerate(self.frames):
+                with profiling.stage("encode", frame=index):
+                    writer.write(frame.tile_indices.reshape(frame.rows, -1))
 
     @classmethod
     def load(
@@ -36,45 +76,152 @@ class GifMosaic:
         scale: typing.Union[int, float] = 1,
         invert: bool = False,
     ) -> "GifMosaic":
-        metadata = iio.immeta(filename)
-        frames = iio.imread(filename)
-        fps = (
+        with profiling.stage("decode"):
+            frames = iio.imread(filename)
+        fps = cls.frames_per_second(filename, frames.shape[0])
+        mosaics = []
+        for index, image in enumerate(frames):
+            with profiling.frame(index):
+                mosaics.append(
+                    mosaic.ImageMosaic.from_image(
+                        cls._process_frame(image, image_type, scale, invert),
+                        tile_size=tile_size,
+                    )
+                )
+
+        return cls(frames=mosaics, fps=fps)
+
+    @staticmethod
+    def frames_per_second(
+        source: typing.Union[str, pathlib.Path, bytes], n_frames: int
+    ) -> int:
+        """The frame rate of a GIF file or its bytes, 30 when it does not say"""
+        metadata = iio.immeta(source)
+        return (
             metadata.get("fps")
-            or int(frames.shape[0] / metadata.get("duration", 1_000_000_000))
+            or int(n_frames / metadata.get("duration", 1_000_000_000))
             or 30
         )
 
-        def process_frame(frame: np.ndarray) -> Image.Image:
+    @staticmethod
+    def _process_frame(
+        frame: np.ndarray,
+        image_type: str,
+        scale: typing.Union[int, float],
+        invert: bool,
+    ) -> Image.Image:
+        with profiling.stage("scale_image"):
             image = utils.scale_image(
                 Image.fromarray(frame).convert(image_type), scale=scale
             )
             if invert:
                 image = ImageOps.invert(image)
-            return image
+        return image
 
-        mosaics = [
-            mosaic.ImageMosaic.from_image(
-                process_frame(image),
-                tile_size=tile_size,
-            )
-            for image in frames
-        ]
+    @classmethod
+    def stream(
+        cls,
+        filename: typing.Union[str, pathlib.Path],
+        outfile: typing.Union[str, pathlib.Path],
+        tiles: tile_library.TileLibrary,
+        tile_size: int = 8,
+        image_type: str = "L",
+        scale: typing.Union[int, float] = 1,
+        invert: bool = False,
+        cmp: comparisons.TileComparator = comparisons.default_parallel_comparator,
+        batch_size: int = 32,
+        threshold: typing.Optional[float] = None,
+    ) -> typing.List[temporal.FrameMatchStats]:
+        """Load, match and save a GIF mosaic a batch of frames at a time
 
-        return cls(frames=mosaics, fps=fps)
+        Frames are decoded lazily and written as soon as they are matched, so peak memory
+        grows with batch_size rather than with the number of frames.
+
+        Args:
+            filename (typing.Union[str, pathlib.Path]): A path to a GIF to mosaicfy
+            outfile (typing.Union[str, pathlib.Path]): Where to write the resulting GIF
+            tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+            tile_size (int, optional): The size of each image block. Defaults to 8.
+            image_type (str, optional): An image mode. Defaults to "L".
+            scale (typing.Union[int, float], optional): How much larger to make the resulting image. Defaults to 1.
+            invert (bool, optional): Invert the frames before matching. Defaults to False.
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_parallel_comparator.
+            batch_size (int, optional): How many frames to match with one comparator call. Defaults to 32.
+            threshold (typing.Optional[float], optional): Reuse a block's tile from the previous frame while its mean squared difference stays within this threshold. Defaults to None.
+
+        Returns:
+            typing.List[temporal.FrameMatchStats]: Per-frame statistics when threshold is set
+        """
+        fps = cls.frames_per_second(filename, iio.improps(filename).n_images)
+        matcher = (
+            temporal.TemporalMatcher(threshold=threshold, cmp=cmp)
+            if threshold is not None
+            else None
+        )
+        first_frame = 0
+        with writers.TileGifWriter(outfile, tiles.gif_palette, fps=fps) as writer:
+            for batch in utils.batched(iio.imiter(filename), batch_size):
+                mosaics = []
+                for index, frame in enumerate(batch, start=first_frame):
+                    with profiling.frame(index):
+                        mosaics.append(
+                            mosaic.ImageMosaic.from_image(
+                                cls._process_frame(frame, image_type, scale, invert),
+                                tile_size=tile_size,
+                            )
+                        )
+                blocks = [frame.tile_data for frame in mosaics]
+                with profiling.stage("match"):
+                    if matcher is None:
+                        best = comparisons.find_best_tiles_batched(
+                            blocks, tiles.tile_data, cmp
+                        )
+                    else:
+                        best = matcher.match(blocks, tiles.tile_data)
+                for index, (frame, frame_best) in enumerate(
+                    zip(mosaics, best), start=first_frame
+                ):
+                    with profiling.stage("encode", frame=index):
+                        writer.write(np.reshape(frame_best, (frame.rows, -1)))
+                first_frame += len(mosaics)
+
+        return matcher.stats if matcher is not None else []
 
     def replace_tiles(
         self,
         tiles: tile_library.TileLibrary,
-        cmp: comparisons.TileComparator = comparisons.euclid_distance_rust_i32,
+        cmp: comparisons.TileComparator = comparisons.default_parallel_comparator,
         inplace: bool = False,
+        threshold: typing.Optional[float] = None,
+        lazy: bool = False,
     ) -> "GifMosaic":
-        executor = futures.ProcessPoolExecutor()
-        jobs = [
-            executor.submit(mosaic.replace_tiles, tiles, cmp, inplace=True)
-            for mosaic in self.frames
-        ]
-        frames = [future.result() for future in jobs]
+        """Replace every frame's tile data with tiles from the specified tile library
+
+        Args:
+            tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_parallel_comparator.
+            inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
+            threshold (typing.Optional[float], optional): Reuse a block's tile from the previous frame while its mean squared difference stays within this threshold. Defaults to None, which matches every block of every frame.
+            lazy (bool, optional): Keep each frame's tile indices and render pixels on demand. Defaults to False.
+        """
+        blocks = [frame.blocks for frame in self.frames]
+        match_stats = []
+        with profiling.stage("match"):
+            if threshold is None:
+                # stack every frame into one block matrix so the comparator runs once
+                best = comparisons.find_best_tiles_batched(blocks, tiles.tile_data, cmp)
+            else:
+                matcher = temporal.TemporalMatcher(threshold=threshold, cmp=cmp)
+                best = matcher.match(blocks, tiles.tile_data)
+                match_stats = matcher.stats
+        frames = []
+        for index, (frame, frame_best) in enumerate(zip(self.frames, best)):
+            with profiling.frame(index):
+                frames.append(
+                    frame.apply_tiles(tiles, frame_best, inplace=inplace, lazy=lazy)
+                )
         if inplace:
             self.frames = frames
+            self.match_stats = match_stats
             return self
-        return type(self)(frames=frames, fps=self.fps)
+        return type(self)(frames=frames, fps=self.fps, match_stats=match_stats)
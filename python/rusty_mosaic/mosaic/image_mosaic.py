@@ -10,15 +10,42 @@ import numpy as np
 from rusty_mosaic import utils
 from rusty_mosaic import comparisons
 from rusty_mosaic import tile_library
+from rusty_mosaic import writers
+from rusty_mosaic import profiling
 
 
 @dataclasses.dataclass
 class ImageMosaic:
+    """An image as a grid of square blocks
+
+    The blocks are either held as pixels in ``tile_data`` or, once tiles have been
+    applied lazily, as ``tile_indices`` into a ``TileLibrary``. An index-backed mosaic
+    keeps one index per block instead of tile_size * tile_size pixels and only renders
+    pixels when ``image``, ``pixmap`` or ``save`` needs them.
+
+    Args:
+        tile_data (typing.Optional[np.ndarray]): The flattened blocks, None when index-backed
+        tile_size (int): The size of each block
+        rows (int): How many rows of blocks make up the image
+        tile_indices (typing.Optional[comparisons.IndexArray], optional): The tile of each block. Defaults to None.
+        tiles (typing.Optional[tile_library.TileLibrary], optional): The library tile_indices refer to. Defaults to None.
+    """
+
     MAX_SIZE: typing.ClassVar[int] = 4_000
 
-    tile_data: np.ndarray
+    tile_data: typing.Optional[np.ndarray]
     tile_size: int
     rows: int
+    tile_indices: typing.Optional[comparisons.IndexArray] = None
+    tiles: typing.Optional[tile_library.TileLibrary] = dataclasses.field(
+        default=None, repr=False
+    )
+
+    def __post_init__(self):
+        if self.tile_data is None and (self.tile_indices is None or self.tiles is None):
+            raise ValueError(
+                "A mosaic needs either tile_data or tile_indices and tiles"
+            )
 
     @classmethod
     def _image_to_blocks(cls, image: Image.Image, tile_size: int) -> np.ndarray:
@@ -26,26 +53,61 @@ class ImageMosaic:
         return cls._array_to_blocks(data, tile_size)
 
     @staticmethod
-    def _array_to_blocks(data: np.ndarray, tile_size: int) -> np.ndarray:
+    def _array_to_blocks(
+        data: np.ndarray, tile_size: int, out: typing.Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Split a (H, W[, C]) pixmap into a (n_blocks, tile_size * tile_size * C) matrix
+
+        Args:
+            data (np.ndarray): The pixmap, trailing pixels that do not fill a block are ignored
+            tile_size (int): The size of each block
+            out (typing.Optional[np.ndarray], optional): A C-contiguous buffer to write the blocks into. Defaults to None.
+        """
         height, width, channels = [*data.shape, 1][:3]
         rows = height // tile_size
         cols = width // tile_size
-        return np.asarray(
-            [np.split(row, cols, axis=1) for row in np.split(data, rows)]
-        ).reshape(rows * cols, tile_size * tile_size * channels)
+        # view the pixmap as (rows, cols, tile_size, tile_size, C) without copying
+        grid = (
+            data[: rows * tile_size, : cols * tile_size]
+            .reshape(rows, tile_size, cols, tile_size, channels)
+            .swapaxes(1, 2)
+        )
+        if out is None:
+            return grid.reshape(rows * cols, tile_size * tile_size * channels)
+
+        if not out.flags.c_contiguous:
+            raise ValueError("The output buffer must be C-contiguous")
+        np.copyto(out.reshape(rows, cols, tile_size, tile_size, channels), grid)
+        return out
 
     @staticmethod
-    def _blocks_to_pixmap(blocks: np.ndarray, tile_size: int, rows: int) -> np.ndarray:
-        channels = int(blocks.shape[1] / (tile_size * tile_size))
-        if channels == 1:
-            blocks = blocks.reshape(rows, -1, tile_size, tile_size)
-        else:
-            blocks = blocks.reshape(rows, -1, tile_size, tile_size, channels)
+    def _blocks_to_pixmap(
+        blocks: np.ndarray,
+        tile_size: int,
+        rows: int,
+        out: typing.Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Reassemble a (n_blocks, tile_size * tile_size * C) matrix into a (H, W[, C]) pixmap
 
-        pix_map = np.concatenate(
-            [np.concatenate(block, axis=1) for block in blocks], axis=0
+        Args:
+            blocks (np.ndarray): The flattened blocks in row-major order
+            tile_size (int): The size of each block
+            rows (int): How many rows of blocks make up the image
+            out (typing.Optional[np.ndarray], optional): A C-contiguous uint8 buffer to write the pixmap into. Defaults to None.
+        """
+        channels = int(blocks.shape[1] / (tile_size * tile_size))
+        cols = blocks.shape[0] // rows if rows else 0
+        shape = (rows * tile_size, cols * tile_size) + (
+            (channels,) if channels > 1 else ()
         )
-        return pix_map.astype(np.uint8)
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif out.shape != shape or not out.flags.c_contiguous:
+            raise ValueError(f"The output buffer must be a C-contiguous {shape} array")
+
+        grid = out.reshape(rows, tile_size, cols, tile_size, channels).swapaxes(1, 2)
+        grid[...] = blocks.reshape(rows, cols, tile_size, tile_size, channels)
+        return out
 
     @classmethod
     def _blocks_to_image(
@@ -55,25 +117,106 @@ class ImageMosaic:
 
     @classmethod
     def from_image(cls, image: Image.Image, tile_size: int) -> "ImageMosaic":
-        image = utils.crop_tile(image, tile_size)
-        tile_data = cls._image_to_blocks(image, tile_size)
+        with profiling.stage("crop_tile"):
+            image = utils.crop_tile(image, tile_size)
+        with profiling.stage("to_blocks"):
+            tile_data = cls._image_to_blocks(image, tile_size)
         rows = image.size[1] // tile_size
         return cls(tile_size=tile_size, tile_data=tile_data, rows=rows)
 
+    @property
+    def blocks(self) -> np.ndarray:
+        """The flattened blocks, expanded from the tile library when index-backed"""
+        if self.tile_data is not None:
+            return self.tile_data
+        return self.tiles.tile_data[self.tile_indices]
+
+    @property
+    def shape(self) -> typing.Tuple[int, ...]:
+        """The shape of the rendered pixmap"""
+        n_blocks, values = (
+            self.tile_data.shape
+            if self.tile_data is not None
+            else (self.tile_indices.shape[0], self.tiles.tile_data.shape[1])
+        )
+        channels = values // (self.tile_size * self.tile_size)
+        cols = n_blocks // self.rows if self.rows else 0
+        return (self.rows * self.tile_size, cols * self.tile_size) + (
+            (channels,) if channels > 1 else ()
+        )
+
+    def render(self, out: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """Write the mosaic's pixels into out
+
+        An index-backed mosaic is expanded one row of tiles at a time, so apart from
+        out only a single row of blocks is ever materialized.
+
+        Args:
+            out (typing.Optional[np.ndarray], optional): A C-contiguous uint8 buffer of the mosaic's shape. Defaults to None.
+        """
+        if self.tile_data is not None:
+            with profiling.stage("render"):
+                return self._blocks_to_pixmap(
+                    self.tile_data, self.tile_size, self.rows, out
+                )
+
+        shape = self.shape
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif out.shape != shape or not out.flags.c_contiguous:
+            raise ValueError(f"The output buffer must be a C-contiguous {shape} array")
+
+        indices = self.tile_indices.reshape(self.rows, -1)
+        with profiling.stage("render"):
+            for row, row_indices in enumerate(indices):
+                band = out[row * self.tile_size : (row + 1) * self.tile_size]
+                self._blocks_to_pixmap(
+                    self.tiles.tile_data[row_indices], self.tile_size, 1, out=band
+                )
+        return out
+
     @property
     def image(self) -> Image.Image:
-        return self._blocks_to_image(self.tile_data, self.tile_size, self.rows)
+        return Image.fromarray(self.render())
 
     @property
     def pixmap(self) -> np.ndarray:
-        return self._blocks_to_pixmap(self.tile_data, self.tile_size, self.rows)
+        return self.render()
 
-    def save(self, outfile: typing.Union[str, pathlib.Path]):
+    def save(self, outfile: typing.Union[str, pathlib.Path], thumbnail: bool = True):
+        """Save the mosaic as an image
+
+        Args:
+            outfile (typing.Union[str, pathlib.Path]): Where to save the image
+            thumbnail (bool, optional): Shrink images larger than MAX_SIZE. Defaults to True.
+        """
         image = self.image
-        if any(dim > self.MAX_SIZE for dim in image.size):
-            image = image.copy()
-            image.thumbnail((self.MAX_SIZE, self.MAX_SIZE), Image.Resampling.LANCZOS)
-        image.save(str(outfile))
+        with profiling.stage("encode"):
+            if thumbnail and any(dim > self.MAX_SIZE for dim in image.size):
+                image = image.copy()
+                image.thumbnail(
+                    (self.MAX_SIZE, self.MAX_SIZE), Image.Resampling.LANCZOS
+                )
+            image.save(str(outfile))
+
+    @staticmethod
+    def read_image(
+        filename: typing.Union[str, pathlib.Path],
+        image_type: str = "L",
+        scale: typing.Union[int, float] = 1,
+        invert: bool = False,
+    ) -> Image.Image:
+        """Decode, convert, invert and scale an image the way load does before splitting it"""
+        filename = str(filename)
+        with Image.open(filename) as image:
+            with profiling.stage("decode"):
+                image.format = (
+                    filename.split(".")[-1] if not image.format else image.format
+                )
+                image = image.convert(image_type)
+                image = ImageOps.invert(image) if invert else image
+            with profiling.stage("scale_image"):
+                return utils.scale_image(image, scale)
 
     @classmethod
     def load(
@@ -84,27 +227,121 @@ class ImageMosaic:
         scale: typing.Union[int, float] = 1,
         invert: bool = False,
     ):
-        filename = str(filename)
-        with Image.open(filename) as image:
-            image.format = filename.split(".")[-1] if not image.format else image.format
-            image = image.convert(image_type)
-            image = ImageOps.invert(image) if invert else image
-            inst = cls.from_image(utils.scale_image(image, scale), tile_size)
-        return inst
+        image = cls.read_image(filename, image_type, scale=scale, invert=invert)
+        return cls.from_image(image, tile_size)
+
+    @classmethod
+    def stream(
+        cls,
+        filename: typing.Union[str, pathlib.Path],
+        outfile: typing.Union[str, pathlib.Path],
+        tiles: tile_library.TileLibrary,
+        tile_size: int = 8,
+        image_type: str = "L",
+        scale: typing.Union[int, float] = 1,
+        invert: bool = False,
+        cmp: comparisons.TileComparator = comparisons.default_parallel_comparator,
+        strip_rows: int = 16,
+    ) -> None:
+        """Build a full resolution mosaic one horizontal strip of tile rows at a time
+
+        Only the source image is decoded in full. Each strip is scaled, matched and
+        written to outfile (a .png or .pnm) on its own, so the scaled image, the block
+        matrix and the output never exist in memory at once.
+
+        Args:
+            filename (typing.Union[str, pathlib.Path]): A path to an image to mosaicfy
+            outfile (typing.Union[str, pathlib.Path]): Where to write the mosaic, a .png or .pnm file
+            tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+            tile_size (int, optional): The size of each image block. Defaults to 8.
+            image_type (str, optional): An image mode. Defaults to "L".
+            scale (typing.Union[int, float], optional): How much larger to make the resulting image. Defaults to 1.
+            invert (bool, optional): Invert the image before matching. Defaults to False.
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_parallel_comparator.
+            strip_rows (int, optional): How many rows of tiles to process at once. Defaults to 16.
+        """
+        if strip_rows < 1:
+            raise ValueError("A strip must have at least one row of tiles")
+        with Image.open(str(filename)) as image:
+            with profiling.stage("decode"):
+                image = image.convert(image_type)
+                image = ImageOps.invert(image) if invert else image
+            width, height = utils.scaled_size(image, scale)
+            rows, cols = height // tile_size, width // tile_size
+            # center the tile grid like utils.crop_tile does
+            left = (width % tile_size) // 2
+            top = (height % tile_size) // 2
+            with writers.open_strip_writer(
+                outfile, cols * tile_size, rows * tile_size, image_type
+            ) as writer:
+                for first_row in range(0, rows, strip_rows):
+                    strip_height = min(strip_rows, rows - first_row) * tile_size
+                    strip_top = top + first_row * tile_size
+                    with profiling.stage("scale_image"):
+                        strip = utils.scale_band(
+                            image, (width, height), strip_top, strip_top + strip_height
+                        )
+                    with profiling.stage("to_blocks"):
+                        data = np.asarray(strip)[:, left : left + cols * tile_size]
+                        blocks = cls._array_to_blocks(data, tile_size)
+                    with profiling.stage("match"):
+                        best = cmp(blocks, tiles.tile_data)
+                    with profiling.stage("render"):
+                        pixmap = cls._blocks_to_pixmap(
+                            tiles.tile_data[best], tile_size, strip_height // tile_size
+                        )
+                    with profiling.stage("encode"):
+                        writer.write(pixmap)
 
     def replace_tiles(
         self,
         tiles: tile_library.TileLibrary,
-        cmp: comparisons.TileComparator = comparisons.euclid_distance_rust_i32,
+        cmp: comparisons.TileComparator = comparisons.default_comparator,
         inplace: bool = False,
+        lazy: bool = False,
     ) -> "ImageMosaic":
-        best = cmp(self.tile_data, tiles.tile_data)
-        if inplace:
-            self.tile_data = tiles.tile_data[best]
-            return self
+        """Replace the mosaic's blocks with the most similar tiles
 
-        tile_data = tiles.tile_data[best]
-        return type(self)(tile_data, self.tile_size, self.rows)
+        Args:
+            tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_comparator.
+            inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
+            lazy (bool, optional): Keep tile indices and render pixels on demand. Defaults to False.
+        """
+        with profiling.stage("match"):
+            best = cmp(self.blocks, tiles.tile_data)
+        return self.apply_tiles(tiles, best, inplace=inplace, lazy=lazy)
 
+    def apply_tiles(
+        self,
+        tiles: tile_library.TileLibrary,
+        best: comparisons.IndexArray,
+        inplace: bool = False,
+        lazy: bool = False,
+    ) -> "ImageMosaic":
+        """Replace each image block with the tile at the corresponding index in best
+
+        Args:
+            tiles (tile_library.TileLibrary): The tiles best refers to
+            best (comparisons.IndexArray): The tile index of each block
+            inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
+            lazy (bool, optional): Keep best and tiles instead of copying tile pixels. Defaults to False.
+        """
+        best = np.asarray(best)
+        with profiling.stage("apply_tiles"):
+            tile_data, tile_indices = (
+                (None, best) if lazy else (tiles.tile_data[best], None)
+            )
+        if inplace:
+            self.tile_data = tile_data
+            self.tile_indices = tile_indices
+            self.tiles = tiles if lazy else None
+            return self
 
-url = "https://thomasbeebe.smugmug.com/services/api/json/1.4.0/?galleryType=album&albumId=399753739&albumKey=QJ6Cxv&nodeId=DjpZ8N&PageNumber=0&imageId=0&imageKey=&returnModelList=true&PageSize=500&imageSizes=S,Th&method=rpc.gallery.getalbum"
\ No newline at end of file
+        return type(self)(
+            tile_data,
+            self.tile_size,
+            self.rows,
+            tile_indices=tile_indices,
+            tiles=tiles if lazy else None,
+        )
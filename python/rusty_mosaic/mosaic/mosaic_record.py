@@ -0,0 +1,293 @@
+import json
+import zlib
+import struct
+import typing
+import hashlib
+import pathlib
+import dataclasses
+
+import numpy as np
+import numpy.typing as npt
+
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
+from rusty_mosaic.mosaic.text_mosaic import TextMosaic, ASCII_TILE_TEXT_MAP
+
+if typing.TYPE_CHECKING:
+    from rusty_mosaic.mosaic.gif_mosaic import GifMosaic
+    from rusty_mosaic.mosaic.text_gif_mosaic import TextGifMosaic
+
+MAGIC = b"RMOSAIC"
+VERSION = 2
+# version 1 records have no tile_set and only render at their own tile size
+READABLE_VERSIONS = (1, 2)
+# unpack at most this many indices at once, each takes 32 bytes while unpacking
+PACK_CHUNK = 1 << 20
+
+AnyMosaic = typing.Union[ImageMosaic, TextMosaic, "GifMosaic", "TextGifMosaic"]
+
+
+def index_bits(n_tiles: int) -> int:
+    """How many bits it takes to store an index into n_tiles tiles"""
+    return max(1, int(n_tiles - 1).bit_length())
+
+
+def pack_indices(indices: np.ndarray, bits: int) -> bytes:
+    """Pack unsigned indices into a big-endian bit string of ``bits`` bits per index"""
+    indices = np.asarray(indices).ravel()
+    packed = []
+    for start in range(0, indices.size, PACK_CHUNK):
+        chunk = indices[start : start + PACK_CHUNK].astype(">u4")
+        bitplanes = np.unpackbits(chunk.view(np.uint8).reshape(-1, 4), axis=1)
+        packed.append(bitplanes[:, 32 - bits :].ravel())
+    if not packed:
+        return b""
+    return np.packbits(np.concatenate(packed)).tobytes()
+
+
+def unpack_indices(data: bytes, bits: int, count: int) -> np.ndarray:
+    """Reverse pack_indices"""
+    bitstring = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=count * bits)
+    indices = np.empty(count, dtype=np.uintp)
+    for start in range(0, count, PACK_CHUNK):
+        stop = min(start + PACK_CHUNK, count)
+        bitplanes = np.zeros((stop - start, 32), dtype=np.uint8)
+        bitplanes[:, 32 - bits :] = bitstring[start * bits : stop * bits].reshape(
+            -1, bits
+        )
+        indices[start:stop] = np.packbits(bitplanes, axis=1).view(">u4").ravel()
+    return indices
+
+
+@dataclasses.dataclass
+class MosaicRecord:
+    """The result of matching a mosaic, without any pixels
+
+    A record keeps the tile index of every block of every frame, which is all it takes
+    to render the mosaic again with the same tile library. Rendering with the library
+    built at another tile size changes the output size, and rendering through a text
+    map gives the text version, neither of which decodes or matches the source again.
+
+    Records are saved as a short header followed by the zlib compressed indices packed
+    to index_bits(n_tiles) bits each.
+
+    Args:
+        tile_indices (np.ndarray): A (frames, rows, cols) array of tile indexes
+        tile_size (int): The tile size the blocks were matched at
+        n_tiles (int): How many tiles the library had
+        library (str): The fingerprint of the tile library the blocks were matched with
+        fps (typing.Optional[float], optional): Frames per second for animations. Defaults to None.
+        params (typing.Dict[str, typing.Any], optional): The settings the mosaic was made with. Defaults to {}.
+        tile_set (typing.Optional[str], optional): The TileLibrary.tile_set of the library, which identifies it at any tile size. Defaults to None.
+    """
+
+    tile_indices: np.ndarray
+    tile_size: int
+    n_tiles: int
+    library: str
+    fps: typing.Optional[float] = None
+    params: typing.Dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    tile_set: typing.Optional[str] = None
+
+    @property
+    def frames(self) -> int:
+        return self.tile_indices.shape[0]
+
+    @property
+    def rows(self) -> int:
+        return self.tile_indices.shape[1]
+
+    @property
+    def cols(self) -> int:
+        return self.tile_indices.shape[2]
+
+    @property
+    def animated(self) -> bool:
+        return self.fps is not None
+
+    @property
+    def fingerprint(self) -> str:
+        """A digest of the tile library and the settings used to make the mosaic"""
+        return hashlib.blake2b(
+            json.dumps(
+                [self.library, self.tile_size, self.params], sort_keys=True
+            ).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+
+    @staticmethod
+    def _frame_indices(frame: typing.Union[ImageMosaic, TextMosaic]) -> np.ndarray:
+        indices = frame.tile_indices
+        if indices is None:
+            raise ValueError(
+                "Only mosaics whose tiles were applied lazily or as text keep their tile indices"
+            )
+        return np.asarray(indices)
+
+    @classmethod
+    def from_mosaic(
+        cls,
+        mosaic: AnyMosaic,
+        tiles: tile_library.TileLibrary,
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> "MosaicRecord":
+        """Record the tile indices of a mosaic after its tiles were replaced
+
+        Args:
+            mosaic (AnyMosaic): A mosaic whose tiles were applied with lazy=True, or a text mosaic
+            tiles (tile_library.TileLibrary): The tiles the mosaic was matched with
+            params (typing.Optional[typing.Dict[str, typing.Any]], optional): JSON serializable settings to keep with the record. Defaults to None.
+        """
+        # only animations have frames, checking for them avoids importing imageio
+        frames = list(getattr(mosaic, "frames", []))
+        fps = mosaic.fps if frames else None
+        frames = frames or [mosaic]
+        rows = [
+            frame.image_mosaic.rows if isinstance(frame, TextMosaic) else frame.rows
+            for frame in frames
+        ]
+        tile_indices = np.stack(
+            [
+                cls._frame_indices(frame).reshape(frame_rows, -1)
+                for frame, frame_rows in zip(frames, rows)
+            ]
+        )
+        return cls(
+            tile_indices=tile_indices,
+            tile_size=tiles.tile_size,
+            n_tiles=tiles.tile_data.shape[0],
+            library=tiles.fingerprint,
+            fps=fps,
+            params=dict(params or {}),
+            tile_set=tiles.tile_set,
+        )
+
+    def check_tiles(self, tiles: tile_library.TileLibrary) -> None:
+        """Raise a ValueError unless tiles can render this record
+
+        The library must have as many tiles as the one the record was matched with. When
+        it is built at the same tile size it must also have the same data, at any other
+        size the same tile files in the same order.
+        """
+        if tiles.tile_data.shape[0] != self.n_tiles:
+            raise ValueError(
+                f"The record was matched with {self.n_tiles} tiles but the library has {tiles.tile_data.shape[0]}"
+            )
+        if tiles.tile_size == self.tile_size:
+            if tiles.fingerprint != self.library:
+                raise ValueError(
+                    "The tile library has changed since the record was matched"
+                )
+            return
+        if self.tile_set is None or tiles.tile_set is None:
+            raise ValueError(
+                f"Cannot tell whether the tiles are the ones the record was matched with, render it at tile size {self.tile_size}"
+            )
+        if tiles.tile_set != self.tile_set:
+            raise ValueError(
+                "The tile library has other tiles than the record was matched with"
+            )
+
+    def _image_frame(self, tiles: tile_library.TileLibrary, frame: int) -> ImageMosaic:
+        return ImageMosaic(
+            None,
+            tiles.tile_size,
+            self.rows,
+            tile_indices=self.tile_indices[frame].ravel(),
+            tiles=tiles,
+        )
+
+    def _text_frame(
+        self,
+        tiles: tile_library.TileLibrary,
+        frame: int,
+        text_map: npt.NDArray[np.str_],
+    ) -> TextMosaic:
+        image_mosaic = self._image_frame(tiles, frame)
+        text_mosaic = TextMosaic(
+            tile_data=np.full(image_mosaic.tile_indices.shape[0], " "),
+            text_map=text_map,
+            image_mosaic=image_mosaic,
+        )
+        return text_mosaic.apply_tiles(tiles, image_mosaic.tile_indices, inplace=True)
+
+    def render(
+        self,
+        tiles: tile_library.TileLibrary,
+        text: bool = False,
+        text_map: npt.NDArray[np.str_] = ASCII_TILE_TEXT_MAP,
+    ) -> AnyMosaic:
+        """Build the mosaic again from its tile indices
+
+        Args:
+            tiles (tile_library.TileLibrary): The tiles to render with, any tile size works
+            text (bool, optional): Render as text instead of pixels. Defaults to False.
+            text_map (npt.NDArray[np.str_], optional): The character for each tile. Defaults to ASCII_TILE_TEXT_MAP.
+        """
+        self.check_tiles(tiles)
+        if text:
+            frames = [
+                self._text_frame(tiles, frame, text_map) for frame in range(self.frames)
+            ]
+            if not self.animated:
+                return frames[0]
+            from rusty_mosaic.mosaic.text_gif_mosaic import TextGifMosaic
+
+            return TextGifMosaic(frames, self.fps)
+
+        frames = [self._image_frame(tiles, frame) for frame in range(self.frames)]
+        if not self.animated:
+            return frames[0]
+        from rusty_mosaic.mosaic.gif_mosaic import GifMosaic
+
+        return GifMosaic(frames, self.fps)
+
+    def save(self, outfile: typing.Union[str, pathlib.Path]) -> None:
+        bits = index_bits(self.n_tiles)
+        header = json.dumps(
+            {
+                "version": VERSION,
+                "shape": list(self.tile_indices.shape),
+                "bits": bits,
+                "tile_size": self.tile_size,
+                "n_tiles": self.n_tiles,
+                "library": self.library,
+                "fps": self.fps,
+                "params": self.params,
+                "tile_set": self.tile_set,
+            }
+        ).encode("utf-8")
+        payload = zlib.compress(pack_indices(self.tile_indices, bits), 9)
+        with open(outfile, "wb") as fp:
+            fp.write(MAGIC)
+            fp.write(struct.pack(">I", len(header)))
+            fp.write(header)
+            fp.write(payload)
+
+    @classmethod
+    def load(cls, filename: typing.Union[str, pathlib.Path]) -> "MosaicRecord":
+        data = pathlib.Path(filename).read_bytes()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"{filename} is not a mosaic record")
+        offset = len(MAGIC) + 4
+        (header_size,) = struct.unpack(">I", data[len(MAGIC) : offset])
+        header = json.loads(data[offset : offset + header_size])
+        if header["version"] not in READABLE_VERSIONS:
+            raise ValueError(
+                f"{filename} has version {header['version']}, expected {VERSION}"
+            )
+        shape = tuple(header["shape"])
+        tile_indices = unpack_indices(
+            zlib.decompress(data[offset + header_size :]),
+            header["bits"],
+            int(np.prod(shape)),
+        ).reshape(shape)
+        return cls(
+            tile_indices=tile_indices,
+            tile_size=header["tile_size"],
+            n_tiles=header["n_tiles"],
+            library=header["library"],
+            fps=header["fps"],
+            params=header["params"],
+            tile_set=header.get("tile_set"),
+        )
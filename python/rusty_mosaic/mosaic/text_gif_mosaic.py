@@ -6,18 +6,22 @@ import numpy as np
 import imageio.v3 as iio
 from PIL import Image
 from PIL import ImageOps
-from concurrent import futures
 
 from rusty_mosaic import utils
 from rusty_mosaic import mosaic
 from rusty_mosaic import comparisons
 from rusty_mosaic import tile_library
+from rusty_mosaic import temporal
+from rusty_mosaic import profiling
 
 
 @dataclasses.dataclass
 class TextGifMosaic:
     frames: typing.List[mosaic.TextMosaic]
     fps: int
+    match_stats: typing.List[temporal.FrameMatchStats] = dataclasses.field(
+        default_factory=list, repr=False
+    )
 
     @property
     def tile_data(self) -> np.ndarray:
@@ -70,16 +74,34 @@ class TextGifMosaic:
     def replace_tiles(
         self,
         tiles: tile_library.TileLibrary,
-        cmp: comparisons.TileComparator = comparisons.euclid_distance_rust_i32,
+        cmp: comparisons.TileComparator = comparisons.default_parallel_comparator,
         inplace: bool = False,
+        threshold: typing.Optional[float] = None,
     ) -> "TextGifMosaic":
-        executor = futures.ProcessPoolExecutor()
-        jobs = [
-            executor.submit(mosaic.replace_tiles, tiles, cmp, inplace=True)
-            for mosaic in self.frames
+        """Replace every frame's tile data with tiles from the specified tile library
+
+        Args:
+            tiles (tile_library.TileLibrary): The tiles to replace the image blocks with
+            cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_parallel_comparator.
+            inplace (bool, optional): Create a new mosaic or modify the existing one. Defaults to False.
+            threshold (typing.Optional[float], optional): Reuse a block's tile from the previous frame while its mean squared difference stays within this threshold. Defaults to None, which matches every block of every frame.
+        """
+        blocks = [frame.image_mosaic.tile_data for frame in self.frames]
+        match_stats = []
+        with profiling.stage("match"):
+            if threshold is None:
+                # stack every frame into one block matrix so the comparator runs once
+                best = comparisons.find_best_tiles_batched(blocks, tiles.tile_data, cmp)
+            else:
+                matcher = temporal.TemporalMatcher(threshold=threshold, cmp=cmp)
+                best = matcher.match(blocks, tiles.tile_data)
+                match_stats = matcher.stats
+        frames = [
+            frame.apply_tiles(tiles, frame_best, inplace=inplace)
+            for frame, frame_best in zip(self.frames, best)
         ]
-        frames = [future.result() for future in jobs]
         if inplace:
             self.frames = frames
+            self.match_stats = match_stats
             return self
-        return type(self)(frames=frames, fps=self.fps)
+        return type(self)(frames=frames, fps=self.fps, match_stats=match_stats)
@@ -9,6 +9,7 @@ import numpy.typing as npt
 
 from rusty_mosaic import tile_library
 from rusty_mosaic import comparisons
+from rusty_mosaic import profiling
 from rusty_mosaic.mosaic.image_mosaic import ImageMosaic
 
 ASCII_TILE_TEXT_MAP = np.asarray(
@@ -16,11 +17,20 @@ ASCII_TILE_TEXT_MAP = np.asarray(
 )
 
 
+def _ascii_codes(text_map: npt.NDArray[np.str_]) -> typing.Optional[np.ndarray]:
+    """The byte of each character in text_map, or None unless they are all single ASCII characters"""
+    characters = "".join(text_map.tolist())
+    if len(characters) != text_map.size or not characters.isascii():
+        return None
+    return np.frombuffer(characters.encode("ascii"), dtype=np.uint8)
+
+
 @dataclasses.dataclass
 class TextMosaic:
     tile_data: npt.NDArray[np.str_]
     text_map: npt.NDArray[np.str_]
     image_mosaic: ImageMosaic
+    tile_indices: typing.Optional[comparisons.IndexArray] = None
 
     @classmethod
     def from_image(
@@ -50,32 +60,70 @@ class TextMosaic:
         return cls(tile_data=tile_data, text_map=text_map, image_mosaic=image_mosaic)
 
     def save(self, outfile: typing.Union[str, pathlib.Path]) -> None:
-        pathlib.Path(outfile).write_text(self.text)
+        with profiling.stage("encode"):
+            pathlib.Path(outfile).write_text(self.text)
 
     @property
-    def text(self):
-        return "\n".join(
-            "".join(row) for row in self.tile_data.reshape(self.image_mosaic.rows, -1)
-        )
+    def grid(self) -> npt.NDArray[np.str_]:
+        """The characters of the mosaic as a (rows, columns) array"""
+        return self.tile_data.reshape(self.image_mosaic.rows, -1)
+
+    def _cells(self) -> typing.Tuple[np.ndarray, typing.Any, str]:
+        # one fixed width value per cell, so a frame is a single tobytes() call
+        codes = _ascii_codes(self.text_map)
+        if codes is not None and self.tile_indices is not None:
+            return codes[self.tile_indices], np.uint8(ord("\n")), "ascii"
+        return np.asarray(self.tile_data, dtype="<U1"), "\n", "utf-32-le"
+
+    @property
+    def text(self) -> str:
+        if self.tile_data.dtype.itemsize != np.dtype("<U1").itemsize:
+            # the characters of a custom text map can be longer than one character
+            return "\n".join("".join(row) for row in self.grid)
+        cells, newline, encoding = self._cells()
+        rows = self.image_mosaic.rows
+        lines = np.empty((rows, cells.size // max(rows, 1) + 1), dtype=cells.dtype)
+        lines[:, :-1] = cells.reshape(rows, -1)
+        lines[:, -1] = newline
+        # every row ends with a newline, the last one is dropped
+        return lines.tobytes()[: -lines.itemsize].decode(encoding)
 
     def replace_tiles(
         self,
         tiles: tile_library.TileLibrary,
-        cmp: comparisons.TileComparator = comparisons.euclid_distance_rust_i32,
+        cmp: comparisons.TileComparator = comparisons.default_comparator,
         inplace: bool = False,
     ):
+        self._check_text_map(tiles)
+        with profiling.stage("match"):
+            best = cmp(self.image_mosaic.tile_data, tiles.tile_data)
+        return self.apply_tiles(tiles, best, inplace=inplace)
+
+    def _check_text_map(self, tiles: tile_library.TileLibrary) -> None:
         if tiles.tile_data.shape[0] > self.text_map.shape[0]:
             raise ValueError(
                 f"The provided tile library has {tiles.tile_data.shape[0]} tiles but the current text map only has {self.text_map.size} characters"
             )
 
-        best = cmp(self.image_mosaic.tile_data, tiles.tile_data)
+    def apply_tiles(
+        self,
+        tiles: tile_library.TileLibrary,
+        best: comparisons.IndexArray,
+        inplace: bool = False,
+    ) -> "TextMosaic":
+        """Replace each image block with the character for the tile at the corresponding index in best"""
+        self._check_text_map(tiles)
+        best = np.asarray(best)
+        with profiling.stage("apply_tiles"):
+            tile_data = self.text_map[best]
         if inplace:
-            self.tile_data = self.text_map[best]
+            self.tile_data = tile_data
+            self.tile_indices = best
             return self
 
         return type(self)(
-            tile_data=self.text_map[best],
+            tile_data=tile_data,
             text_map=self.text_map,
             image_mosaic=self.image_mosaic,
+            tile_indices=best,
         )
@@ -0,0 +1,171 @@
+import sys
+import json
+import time
+import typing
+import pathlib
+import threading
+import contextlib
+import contextvars
+import dataclasses
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+@dataclasses.dataclass
+class StageSample:
+    """One timed run of a pipeline stage
+
+    Args:
+        stage (str): The name of the stage, e.g. "match" or "encode"
+        start (float): When the stage started, in seconds since profiling was enabled
+        seconds (float): How long the stage took
+        peak_rss (typing.Optional[int]): The process's peak resident memory in bytes when the stage ended, None where it cannot be measured
+        frame (typing.Optional[int], optional): The animation frame the stage worked on. Defaults to None.
+    """
+
+    stage: str
+    start: float
+    seconds: float
+    peak_rss: typing.Optional[int]
+    frame: typing.Optional[int] = None
+
+
+StageHook = typing.Callable[[StageSample], None]
+
+_frame: "contextvars.ContextVar[typing.Optional[int]]" = contextvars.ContextVar(
+    "rusty_mosaic_frame", default=None
+)
+
+
+def peak_rss() -> typing.Optional[int]:
+    """The peak resident set size of this process in bytes"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclasses.dataclass
+class Profiler:
+    """Collects stage timings and peak memory while it is enabled
+
+    Every sample is passed to each hook as soon as its stage ends, so samples can
+    also be forwarded elsewhere while they are collected.
+
+    Args:
+        hooks (typing.List[StageHook], optional): Called with every sample. Defaults to [].
+    """
+
+    hooks: typing.List[StageHook] = dataclasses.field(default_factory=list)
+    samples: typing.List[StageSample] = dataclasses.field(
+        default_factory=list, init=False
+    )
+    _origin: float = dataclasses.field(
+        default_factory=time.perf_counter, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    @contextlib.contextmanager
+    def stage(
+        self, name: str, frame: typing.Optional[int] = None
+    ) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            sample = StageSample(
+                stage=name,
+                start=start - self._origin,
+                seconds=end - start,
+                peak_rss=peak_rss(),
+                frame=frame if frame is not None else _frame.get(),
+            )
+            with self._lock:
+                self.samples.append(sample)
+            for hook in self.hooks:
+                hook(sample)
+
+    def summary(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """The number of calls, total seconds and highest peak RSS of each stage"""
+        stages: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        for sample in self.samples:
+            totals = stages.setdefault(
+                sample.stage, {"calls": 0, "seconds": 0.0, "peak_rss": None}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += sample.seconds
+            if sample.peak_rss is not None:
+                totals["peak_rss"] = max(totals["peak_rss"] or 0, sample.peak_rss)
+        return stages
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "seconds": time.perf_counter() - self._origin,
+            "peak_rss": peak_rss(),
+            "stages": self.summary(),
+            "samples": [dataclasses.asdict(sample) for sample in self.samples],
+        }
+
+    def save(self, outfile: typing.Union[str, pathlib.Path]) -> None:
+        pathlib.Path(outfile).write_text(json.dumps(self.report(), indent=2))
+
+
+_active: typing.Optional[Profiler] = None
+_DISABLED = contextlib.nullcontext()
+
+
+def enable(profiler: typing.Optional[Profiler] = None) -> Profiler:
+    """Start collecting samples, replacing any profiler that is already enabled"""
+    global _active
+    _active = profiler if profiler is not None else Profiler()
+    return _active
+
+
+def disable() -> typing.Optional[Profiler]:
+    """Stop collecting samples and return the profiler that collected them"""
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active() -> typing.Optional[Profiler]:
+    return _active
+
+
+def stage(name: str, frame: typing.Optional[int] = None) -> typing.ContextManager[None]:
+    """Time a block of code as a stage of the pipeline
+
+    When profiling is disabled this returns a shared no-op context manager, so an
+    instrumented block costs a global lookup and a function call.
+
+    Args:
+        name (str): The name of the stage
+        frame (typing.Optional[int], optional): The frame being worked on. Defaults to the frame set with frame().
+    """
+    profiler = _active
+    if profiler is None:
+        return _DISABLED
+    return profiler.stage(name, frame)
+
+
+@contextlib.contextmanager
+def _frame_context(index: int) -> typing.Iterator[None]:
+    token = _frame.set(index)
+    try:
+        yield
+    finally:
+        _frame.reset(token)
+
+
+def frame(index: int) -> typing.ContextManager[None]:
+    """Attribute the stages run inside the block to an animation frame"""
+    if _active is None:
+        return _DISABLED
+    return _frame_context(index)
@@ -0,0 +1,452 @@
+import io
+import sys
+import json
+import time
+import typing
+import pathlib
+import threading
+import socketserver
+import dataclasses
+import urllib.parse
+from http import server
+from concurrent import futures
+
+import numpy as np
+import imageio.v3 as iio
+from PIL import Image
+from PIL import ImageOps
+
+from rusty_mosaic import utils
+from rusty_mosaic import mosaic
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+
+PathLike = typing.Union[str, pathlib.Path]
+ComparatorFactory = typing.Callable[
+    [tile_library.TileLibrary], comparisons.TileComparator
+]
+IMAGE_TYPES = ("L", "RGB")
+
+
+@dataclasses.dataclass
+class _PendingMatch:
+    blocks: np.ndarray
+    done: threading.Event = dataclasses.field(default_factory=threading.Event)
+    best: typing.Optional[comparisons.IndexArray] = None
+    error: typing.Optional[BaseException] = None
+
+
+@dataclasses.dataclass
+class CoalescingComparator:
+    """Merge concurrent comparator calls that use the same tiles into one call
+
+    The first caller for a set of tiles waits ``window`` seconds for others to join,
+    then matches every caller's blocks with a single call to ``cmp`` and hands each
+    caller its share of the result. Many small requests then keep all cores busy in
+    one parallel kernel instead of each running its own.
+
+    Args:
+        cmp (comparisons.TileComparator, optional): The comparator to call. Defaults to comparisons.default_parallel_comparator.
+        window (float, optional): How long the first caller waits for others, in seconds. Defaults to 0.002.
+    """
+
+    cmp: comparisons.TileComparator = comparisons.default_parallel_comparator
+    window: float = 0.002
+    calls: int = dataclasses.field(default=0, init=False)
+    requests: int = dataclasses.field(default=0, init=False)
+    _pending: typing.Dict[int, typing.List[_PendingMatch]] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __call__(
+        self,
+        image_blocks: typing.Union[comparisons.IntArray, comparisons.Float64Array],
+        tiles: typing.Union[comparisons.IntArray, comparisons.Float64Array],
+    ) -> comparisons.IndexArray:
+        request = _PendingMatch(np.asarray(image_blocks))
+        # callers share tiles through a TileLibraryPool, so identity is a cheap key
+        key = id(tiles)
+        with self._lock:
+            self.requests += 1
+            batch = self._pending.setdefault(key, [])
+            batch.append(request)
+            leader = len(batch) == 1
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                batch = self._pending.pop(key)
+                self.calls += 1
+            try:
+                matched = comparisons.find_best_tiles_batched(
+                    [pending.blocks for pending in batch], tiles, self.cmp
+                )
+                for pending, best in zip(batch, matched):
+                    pending.best = best
+            except BaseException as error:
+                for pending in batch:
+                    pending.error = error
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.best
+
+
+@dataclasses.dataclass
+class MosaicRequest:
+    """The settings of one request, parsed from its query string
+
+    A tile_size of None uses the service's default tile size.
+    """
+
+    tile_size: typing.Optional[int] = None
+    image_type: str = "L"
+    scale: float = 1.0
+    text: bool = False
+    invert: bool = False
+    library: typing.Optional[str] = None
+
+    @classmethod
+    def from_query(cls, query: str) -> "MosaicRequest":
+        params = dict(urllib.parse.parse_qsl(query))
+
+        def flag(name: str) -> bool:
+            return params.get(name, "0").lower() in ("1", "true", "yes")
+
+        try:
+            return cls(
+                tile_size=(int(params["tile_size"]) if "tile_size" in params else None),
+                image_type=params.get("mode", cls.image_type),
+                scale=float(params.get("scale", cls.scale)),
+                text=flag("text"),
+                invert=flag("invert"),
+                library=params.get("library"),
+            )
+        except ValueError as error:
+            raise ValueError(f"Invalid query string: {error}") from error
+
+
+@dataclasses.dataclass
+class MosaicService:
+    """Turns uploaded images and GIFs into mosaics with warm tile libraries
+
+    Only the tile directories and tile sizes the service was started with can be used,
+    so requests cannot make it build and keep any number of tile libraries. Requests
+    for larger images than the limits allow are rejected before they are decoded.
+
+    Args:
+        tile_directories (typing.Sequence[PathLike], optional): The tile directories requests may use, the first is the default. Defaults to (ASCII_TILES,).
+        tile_sizes (typing.Sequence[int], optional): The tile sizes requests may use, the first is the default. Defaults to (8,).
+        max_scale (float, optional): The largest scale a request may ask for. Defaults to 4.0.
+        max_pixels (int, optional): The most pixels an upload may decode to or its mosaic may have, counting every frame of a GIF. Defaults to 16_000_000.
+        max_body (int, optional): The largest upload in bytes. Defaults to 32 MiB.
+        pool (tile_library.TileLibraryPool, optional): Where tile libraries are kept. Defaults to a new pool.
+        cmp (comparisons.TileComparator, optional): Matches blocks for every request. Defaults to a CoalescingComparator.
+        comparator_for (typing.Optional[ComparatorFactory], optional): Builds the comparator of a library the first time it is used, e.g. to give ivf_distance that library's index. Defaults to None, which uses cmp for every library.
+        workers (typing.Optional[int], optional): How many requests to work on at once. Defaults to one per core.
+    """
+
+    tile_directories: typing.Sequence[PathLike] = (tile_library.ASCII_TILES,)
+    tile_sizes: typing.Sequence[int] = (8,)
+    max_scale: float = 4.0
+    max_pixels: int = 16_000_000
+    max_body: int = 32 * 1024 * 1024
+    pool: tile_library.TileLibraryPool = dataclasses.field(
+        default_factory=tile_library.TileLibraryPool
+    )
+    cmp: comparisons.TileComparator = dataclasses.field(
+        default_factory=CoalescingComparator
+    )
+    comparator_for: typing.Optional[ComparatorFactory] = None
+    workers: typing.Optional[int] = None
+    _executor: futures.ThreadPoolExecutor = dataclasses.field(init=False, repr=False)
+    _comparators: typing.Dict[tile_library.LibraryKey, comparisons.TileComparator] = (
+        dataclasses.field(default_factory=dict, init=False, repr=False)
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if not self.tile_directories:
+            raise ValueError("The service needs at least one tile directory")
+        if not self.tile_sizes:
+            raise ValueError("The service needs at least one tile size")
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    @property
+    def libraries(self) -> typing.Dict[str, pathlib.Path]:
+        return {
+            pathlib.Path(directory).name: pathlib.Path(directory)
+            for directory in self.tile_directories
+        }
+
+    def _directory(self, request: MosaicRequest) -> pathlib.Path:
+        name = request.library or pathlib.Path(self.tile_directories[0]).name
+        if name not in self.libraries:
+            raise ValueError(
+                f"Unknown library {name!r}, expected one of {', '.join(self.libraries)}"
+            )
+        return self.libraries[name]
+
+    def tiles(self, request: MosaicRequest) -> tile_library.TileLibrary:
+        return self.pool.get(
+            self._directory(request), request.tile_size, request.image_type
+        )
+
+    def comparator(
+        self, request: MosaicRequest, tiles: tile_library.TileLibrary
+    ) -> comparisons.TileComparator:
+        """The comparator for the library of a request"""
+        if self.comparator_for is None:
+            return self.cmp
+        key = self.pool.key(
+            self._directory(request), request.tile_size, request.image_type
+        )
+        with self._lock:
+            if key not in self._comparators:
+                self._comparators[key] = self.comparator_for(tiles)
+            return self._comparators[key]
+
+    @property
+    def comparators(self) -> typing.List[comparisons.TileComparator]:
+        """Every comparator the service has matched blocks with"""
+        if self.comparator_for is None:
+            return [self.cmp]
+        with self._lock:
+            return list(self._comparators.values())
+
+    def warm(self, image_type: str = "L") -> None:
+        """Build the library of every tile directory and tile size ahead of the first request"""
+        for directory in self.tile_directories:
+            for tile_size in self.tile_sizes:
+                self.pool.get(directory, tile_size, image_type)
+
+    def check(self, request: MosaicRequest) -> MosaicRequest:
+        """Raise a ValueError unless the service allows the request, filling in its defaults"""
+        if request.tile_size is None:
+            request = dataclasses.replace(request, tile_size=self.tile_sizes[0])
+        if request.tile_size not in self.tile_sizes:
+            raise ValueError(
+                f"tile_size must be one of {', '.join(map(str, self.tile_sizes))}"
+            )
+        if request.image_type not in IMAGE_TYPES:
+            raise ValueError(f"mode must be one of {', '.join(IMAGE_TYPES)}")
+        # also rejects nan
+        if not 0 < request.scale <= self.max_scale:
+            raise ValueError(f"scale must be above 0 and at most {self.max_scale}")
+        self._directory(request)
+        return request
+
+    def _check_size(
+        self, image: Image.Image, request: MosaicRequest, frames: int = 1
+    ) -> None:
+        # a small scale keeps the mosaic small, but the upload is still decoded in full
+        width, height = utils.scaled_size(image, request.scale)
+        for name, pixels in (
+            ("upload", image.width * image.height * frames),
+            ("mosaic", width * height * frames),
+        ):
+            if pixels > self.max_pixels:
+                raise ValueError(
+                    f"The {name} would have {pixels} pixels, the limit is {self.max_pixels}"
+                )
+
+    def _process(self, image: Image.Image, request: MosaicRequest) -> Image.Image:
+        image = image.convert(request.image_type)
+        image = ImageOps.invert(image) if request.invert else image
+        return utils.scale_image(image, request.scale)
+
+    def _render_image(
+        self, data: bytes, request: MosaicRequest
+    ) -> typing.Tuple[str, bytes]:
+        tiles = self.tiles(request)
+        cmp = self.comparator(request, tiles)
+        with Image.open(io.BytesIO(data)) as image:
+            self._check_size(image, request)
+            image = self._process(image, request)
+        if request.text:
+            text_mosaic = mosaic.TextMosaic.from_image(image, request.tile_size)
+            text_mosaic.replace_tiles(tiles, cmp=cmp, inplace=True)
+            return "text/plain; charset=utf-8", text_mosaic.text.encode("utf-8")
+
+        image_mosaic = mosaic.ImageMosaic.from_image(image, request.tile_size)
+        image_mosaic.replace_tiles(tiles, cmp=cmp, inplace=True, lazy=True)
+        output = io.BytesIO()
+        # favour latency over size, level 1 is several times faster than the default
+        image_mosaic.image.save(output, format="PNG", compress_level=1)
+        return "image/png", output.getvalue()
+
+    def _render_gif(
+        self, data: bytes, request: MosaicRequest
+    ) -> typing.Tuple[str, bytes]:
+        tiles = self.tiles(request)
+        cmp = self.comparator(request, tiles)
+        with Image.open(io.BytesIO(data)) as image:
+            n_frames = getattr(image, "n_frames", 1)
+            self._check_size(image, request, n_frames)
+        fps = mosaic.GifMosaic.frames_per_second(data, n_frames)
+        # decode lazily so only the processed frames are kept, not the whole source
+        images = [
+            self._process(Image.fromarray(frame), request)
+            for frame in iio.imiter(data, extension=".gif")
+        ]
+        if request.text:
+            text_gif_mosaic = mosaic.TextGifMosaic(
+                frames=[
+                    mosaic.TextMosaic.from_image(image, request.tile_size)
+                    for image in images
+                ],
+                fps=fps,
+            )
+            text_gif_mosaic.replace_tiles(tiles, cmp=cmp, inplace=True)
+            text = "\f\n".join(frame.text for frame in text_gif_mosaic.frames)
+            return "text/plain; charset=utf-8", text.encode("utf-8")
+
+        gif_mosaic = mosaic.GifMosaic(
+            frames=[
+                mosaic.ImageMosaic.from_image(image, request.tile_size)
+                for image in images
+            ],
+            fps=fps,
+        )
+        gif_mosaic.replace_tiles(tiles, cmp=cmp, inplace=True, lazy=True)
+        output = io.BytesIO()
+        gif_mosaic.save(output)
+        return "image/gif", output.getvalue()
+
+    def render(self, data: bytes, request: MosaicRequest) -> typing.Tuple[str, bytes]:
+        """Make a mosaic from an uploaded image or GIF
+
+        Returns a PNG for images, a GIF for GIFs, and text when request.text is set. The
+        frames of a text GIF are separated by form feeds.
+
+        Returns:
+            typing.Tuple[str, bytes]: The content type and body of the response
+        """
+        request = self.check(request)
+        render = self._render_gif if data[:4] == b"GIF8" else self._render_image
+        return self._executor.submit(render, data, request).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class MosaicRequestHandler(server.BaseHTTPRequestHandler):
+    """``POST /mosaic`` with an image or GIF body returns the mosaic, ``GET /health`` the service's state
+
+    Query parameters: tile_size, mode (L or RGB), scale, text, invert and library.
+    """
+
+    service: MosaicService
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: typing.Dict[str, typing.Any]) -> None:
+        self._send(status, "application/json", json.dumps(payload).encode("utf-8"))
+
+    def do_GET(self) -> None:
+        if urllib.parse.urlsplit(self.path).path != "/health":
+            return self._send_json(404, {"error": "Not found"})
+        comparators = self.service.comparators
+
+        def total(name: str) -> typing.Optional[int]:
+            counts = [getattr(cmp, name, None) for cmp in comparators]
+            return None if None in counts else sum(counts)
+
+        self._send_json(
+            200,
+            {
+                "status": "ok",
+                "libraries": list(self.service.libraries),
+                "tile_sizes": list(self.service.tile_sizes),
+                "warm_libraries": len(self.service.pool),
+                "comparator_calls": total("calls"),
+                "comparator_requests": total("requests"),
+            },
+        )
+
+    def do_POST(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/mosaic":
+            return self._send_json(404, {"error": "Not found"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self._send_json(400, {"error": "Invalid Content-Length"})
+        if length > self.service.max_body:
+            # the body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            return self._send_json(
+                413, {"error": f"Uploads are limited to {self.service.max_body} bytes"}
+            )
+        data = self.rfile.read(length)
+        if not data:
+            return self._send_json(400, {"error": "Send an image or GIF as the body"})
+        try:
+            content_type, body = self.service.render(
+                data, MosaicRequest.from_query(url.query)
+            )
+        except (ValueError, OSError) as error:
+            return self._send_json(400, {"error": str(error)})
+        except Exception as error:
+            return self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+        self._send(200, content_type, body)
+
+    def address_string(self) -> str:
+        # unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        pass
+
+
+class _QuietDisconnects:
+    def handle_error(self, request: typing.Any, client_address: typing.Any) -> None:
+        # clients that hang up early are not the server's problem
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class ThreadingHTTPServer(_QuietDisconnects, server.ThreadingHTTPServer):
+    pass
+
+
+class ThreadingUnixHTTPServer(
+    _QuietDisconnects, socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def make_server(
+    service: MosaicService,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: typing.Optional[PathLike] = None,
+) -> socketserver.BaseServer:
+    """Build an HTTP server for a service on a TCP port, or on a unix socket when socket_path is set"""
+    handler = type(
+        "BoundMosaicRequestHandler", (MosaicRequestHandler,), {"service": service}
+    )
+    if socket_path is not None:
+        pathlib.Path(socket_path).unlink(missing_ok=True)
+        return ThreadingUnixHTTPServer(str(socket_path), handler)
+    return ThreadingHTTPServer((host, port), handler)
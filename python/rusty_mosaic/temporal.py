@@ -0,0 +1,109 @@
+import typing
+import dataclasses
+
+import numpy as np
+
+from rusty_mosaic import comparisons
+
+
+@dataclasses.dataclass
+class FrameMatchStats:
+    frame: int
+    blocks: int
+    rematched: int
+
+    @property
+    def reused(self) -> int:
+        """How many blocks kept the tile they were given in the previous frame"""
+        return self.blocks - self.rematched
+
+
+@dataclasses.dataclass
+class TemporalMatcher:
+    """Match animation frames while re-matching only the blocks that changed
+
+    Each block is compared with the pixels it had when it was last matched. Blocks whose
+    mean squared difference per value is at most ``threshold`` keep their previous tile
+    index and only the rest are sent to the comparator. Comparing against the last matched
+    pixels rather than the previous frame keeps slow drifts from going unnoticed forever.
+
+    The matcher keeps its state between calls, so frames can be fed in batches.
+
+    Args:
+        threshold (float, optional): The largest mean squared difference for a block to keep its tile. Defaults to 0, i.e. only identical blocks are reused.
+        cmp (comparisons.TileComparator, optional): A strategy to find the best tiles. Defaults to comparisons.default_parallel_comparator.
+    """
+
+    threshold: float = 0.0
+    cmp: comparisons.TileComparator = comparisons.default_parallel_comparator
+    stats: typing.List[FrameMatchStats] = dataclasses.field(default_factory=list)
+    _tiles: typing.Optional[np.ndarray] = dataclasses.field(default=None, repr=False)
+    _reference: typing.Optional[np.ndarray] = dataclasses.field(
+        default=None, repr=False
+    )
+    _best: typing.Optional[comparisons.IndexArray] = dataclasses.field(
+        default=None, repr=False
+    )
+
+    def reset(self) -> None:
+        """Forget the previous frames so the next frame is matched in full"""
+        self.stats = []
+        self._tiles = None
+        self._reference = None
+        self._best = None
+
+    def _changed(self, blocks: np.ndarray) -> np.ndarray:
+        reference = self._reference
+        if reference is None or reference.shape != blocks.shape:
+            self._reference = blocks.copy()
+            return np.ones(blocks.shape[0], dtype=bool)
+
+        # int64 so the summed squares of large tiles (over 33025 values) cannot overflow
+        diff = blocks.astype(np.int64) - reference
+        error = np.einsum("ij,ij->i", diff, diff) / max(blocks.shape[1], 1)
+        changed = error > self.threshold
+        reference[changed] = blocks[changed]
+        return changed
+
+    def match(
+        self,
+        block_batches: typing.Sequence[np.ndarray],
+        tiles: np.ndarray,
+    ) -> typing.List[comparisons.IndexArray]:
+        """Find the best tiles for consecutive frames
+
+        Args:
+            block_batches (typing.Sequence[np.ndarray]): The flattened blocks of each frame, in order
+            tiles (np.ndarray): A list of flattened tiles to replace the image blocks with
+
+        Returns:
+            typing.List[comparisons.IndexArray]: The best tile indexes for each frame
+        """
+        if tiles is not self._tiles:
+            self.reset()
+            self._tiles = tiles
+
+        # which blocks need matching only depends on pixels, so every changed block of
+        # every frame can go to the comparator in a single call
+        masks = [self._changed(np.asarray(blocks)) for blocks in block_batches]
+        matched = comparisons.find_best_tiles_batched(
+            [np.asarray(blocks)[mask] for blocks, mask in zip(block_batches, masks)],
+            tiles,
+            self.cmp,
+        )
+
+        results = []
+        for mask, frame_best in zip(masks, matched):
+            if self._best is None or self._best.shape != mask.shape:
+                best = np.asarray(frame_best, dtype=np.uintp)
+            else:
+                best = self._best.copy()
+                best[mask] = frame_best
+            self._best = best
+            self.stats.append(
+                FrameMatchStats(
+                    frame=len(self.stats), blocks=mask.size, rematched=int(mask.sum())
+                )
+            )
+            results.append(best)
+        return results
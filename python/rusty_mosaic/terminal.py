@@ -0,0 +1,156 @@
+import sys
+import time
+import typing
+import dataclasses
+
+import numpy as np
+import numpy.typing as npt
+
+if typing.TYPE_CHECKING:
+    from rusty_mosaic.mosaic import TextGifMosaic
+
+CSI = "\x1b["
+HIDE_CURSOR = f"{CSI}?25l"
+SHOW_CURSOR = f"{CSI}?25h"
+CLEAR_SCREEN = f"{CSI}2J{CSI}H"
+# unchanged cells between two changed ones are rewritten rather than jumped over when
+# the gap is shorter than a cursor move
+MERGE_GAP = 6
+
+
+def move_to(row: int, col: int) -> str:
+    """The escape sequence that moves the cursor to a zero based cell"""
+    return f"{CSI}{row + 1};{col + 1}H"
+
+
+def draw(grid: npt.NDArray[np.str_]) -> str:
+    """Draw a whole frame from the top left corner of the screen"""
+    return f"{CSI}H" + "\n".join("".join(row) for row in grid.tolist())
+
+
+def diff(previous: npt.NDArray[np.str_], current: npt.NDArray[np.str_]) -> str:
+    """The escape sequences that turn a screen showing previous into current
+
+    Only runs of changed cells are written, each after a cursor move. Frames of
+    different shapes are drawn again in full.
+
+    Args:
+        previous (npt.NDArray[np.str_]): The (rows, columns) characters on the screen
+        current (npt.NDArray[np.str_]): The (rows, columns) characters to show
+    """
+    if previous.shape != current.shape:
+        return CLEAR_SCREEN + draw(current)
+    changed = previous != current
+    parts = []
+    for row in np.flatnonzero(changed.any(axis=1)):
+        cols = np.flatnonzero(changed[row])
+        breaks = np.flatnonzero(np.diff(cols) > MERGE_GAP)
+        starts = cols[np.r_[0, breaks + 1]]
+        ends = cols[np.r_[breaks, cols.size - 1]] + 1
+        line = current[row]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            parts.append(move_to(row, start))
+            parts.append("".join(line[start:end].tolist()))
+    return "".join(parts)
+
+
+@dataclasses.dataclass
+class TerminalPlayer:
+    """Play text frames in an ANSI terminal without flicker or drift
+
+    The update from each frame to the next is computed before playback starts, and
+    only the cells that change are written. Frames are due at fixed times on a
+    monotonic clock. When drawing falls behind, late frames are dropped rather than
+    slowing the animation down. Every character should take up one terminal cell.
+
+    Args:
+        frames (typing.Sequence[npt.NDArray[np.str_]]): The (rows, columns) characters of each frame
+        fps (float): Frames per second
+        out (typing.TextIO, optional): Where to write. Defaults to sys.stdout.
+        loop (bool, optional): Start over after the last frame. Defaults to True.
+        clock (typing.Callable[[], float], optional): The time in seconds. Defaults to time.monotonic.
+        sleep (typing.Callable[[float], None], optional): Waits for a number of seconds. Defaults to time.sleep.
+    """
+
+    frames: typing.Sequence[npt.NDArray[np.str_]]
+    fps: float
+    out: typing.TextIO = dataclasses.field(default_factory=lambda: sys.stdout)
+    loop: bool = True
+    clock: typing.Callable[[], float] = time.monotonic
+    sleep: typing.Callable[[float], None] = time.sleep
+    shown: int = dataclasses.field(default=0, init=False)
+    dropped: int = dataclasses.field(default=0, init=False)
+    _updates: typing.List[str] = dataclasses.field(
+        default_factory=list, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if not self.frames:
+            raise ValueError("There are no frames to play")
+        if self.fps <= 0:
+            raise ValueError(f"fps must be positive, got {self.fps}")
+        # _updates[i] turns the screen from frame i - 1 into frame i, wrapping around
+        self._updates = [
+            diff(self.frames[index - 1], frame)
+            for index, frame in enumerate(self.frames)
+        ]
+
+    @classmethod
+    def from_mosaic(
+        cls, mosaic: "TextGifMosaic", **kwargs: typing.Any
+    ) -> "TerminalPlayer":
+        return cls(
+            frames=[frame.grid for frame in mosaic.frames], fps=mosaic.fps, **kwargs
+        )
+
+    def _update(self, on_screen: int, index: int) -> str:
+        if index == (on_screen + 1) % len(self.frames):
+            return self._updates[index]
+        return diff(self.frames[on_screen], self.frames[index])
+
+    def play(
+        self,
+        should_continue: typing.Callable[[], bool] = lambda: True,
+        footer: str = "",
+    ) -> None:
+        """Play until should_continue returns False, or the last frame when not looping
+
+        Args:
+            should_continue (typing.Callable[[], bool], optional): Checked before every frame. Defaults to always continuing.
+            footer (str, optional): A line shown below the frames. Defaults to "".
+        """
+        rows = max(frame.shape[0] for frame in self.frames)
+        interval = 1 / self.fps
+        write = self.out.write
+        write(HIDE_CURSOR + CLEAR_SCREEN + draw(self.frames[0]))
+        if footer:
+            write(move_to(rows, 0) + footer)
+        self.out.flush()
+        self.shown, self.dropped = 1, 0
+        on_screen = 0
+        start = self.clock()
+        tick = 1
+        try:
+            while should_continue():
+                delay = start + tick * interval - self.clock()
+                if delay > 0:
+                    self.sleep(delay)
+                else:
+                    # skip every frame whose time has already passed
+                    late = int(-delay / interval)
+                    if not self.loop:
+                        # never skip past the last frame, it stays on screen
+                        late = max(min(late, len(self.frames) - 1 - tick), 0)
+                    self.dropped += late
+                    tick += late
+                if not self.loop and tick >= len(self.frames):
+                    break
+                index = tick % len(self.frames)
+                write(self._update(on_screen, index))
+                self.out.flush()
+                on_screen = index
+                self.shown += 1
+                tick += 1
+        finally:
+            write(move_to(rows + bool(footer), 0) + SHOW_CURSOR + "\n")
+            self.out.flush()
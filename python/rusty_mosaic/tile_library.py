@@ -1,14 +1,138 @@
+import os
+import json
 import typing
+import hashlib
 import pathlib
+import functools
+import threading
 import dataclasses
+from concurrent import futures
 
 from PIL import Image
 import numpy as np
 
 
 from rusty_mosaic import utils
+from rusty_mosaic import ann
+from rusty_mosaic import writers
+from rusty_mosaic import profiling
+from rusty_mosaic.assets import ASCII_TILES
 
-ASCII_TILES = pathlib.Path(__file__).parent / "__assets__" / "ascii_tiles"
+# Shrink by integer factors while decoding until the image is within this factor of the
+# tile size, then finish with a Lanczos resize
+REDUCING_GAP = 3.0
+# Part of every tile cache key. Bump it whenever _process_tile changes the pixels it
+# produces, so data cached by an older version is processed again instead of reused
+PROCESSING_VERSION = 2
+
+PathLike = typing.Union[str, pathlib.Path]
+# (file name, modification time in ns, size in bytes)
+ManifestEntry = typing.Tuple[str, int, int]
+
+
+def _manifest(image_paths: typing.Sequence[pathlib.Path]) -> typing.List[ManifestEntry]:
+    entries = []
+    for image_path in image_paths:
+        stat = image_path.stat()
+        entries.append((image_path.name, stat.st_mtime_ns, stat.st_size))
+    return entries
+
+
+def _digest(*parts: typing.Any) -> str:
+    return hashlib.blake2b(
+        json.dumps(parts).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+@dataclasses.dataclass
+class TileCache:
+    """Processed tile data kept on disk as memory-mapped ``.npy`` files
+
+    Each (directory, tile size, image type, PROCESSING_VERSION) gets a small JSON
+    manifest listing the name, mtime and size of every tile it was built from. On a warm
+    run the data is memory-mapped straight from disk; otherwise only added or changed
+    files are reprocessed and unchanged rows are copied over from the previous data file.
+    """
+
+    directory: pathlib.Path
+
+    def _manifest_path(self, path: pathlib.Path, tile_size: int, image_type: str):
+        key = _digest(str(path.resolve()), tile_size, image_type, PROCESSING_VERSION)
+        return self.directory / f"tiles-{key}.json"
+
+    def _read_manifest(
+        self, manifest_path: pathlib.Path
+    ) -> typing.Dict[str, typing.Any]:
+        try:
+            manifest = json.loads(manifest_path.read_text())
+        except (OSError, ValueError):
+            return {"files": [], "data": None}
+        if not (self.directory / str(manifest.get("data"))).exists():
+            return {"files": [], "data": None}
+        return manifest
+
+    def load(
+        self,
+        path: pathlib.Path,
+        image_paths: typing.Sequence[pathlib.Path],
+        tile_size: int,
+        image_type: str,
+        process: typing.Callable[
+            [typing.Sequence[pathlib.Path]], typing.List[np.ndarray]
+        ],
+    ) -> np.ndarray:
+        """Get the tile data for ``image_paths``, processing only files the cache has not seen
+
+        Args:
+            path (pathlib.Path): The tile directory
+            image_paths (typing.Sequence[pathlib.Path]): The tiles in library order
+            tile_size (int): The size of each tile
+            image_type (str): An image mode
+            process (typing.Callable): Turns a list of tile paths into flattened tile data
+
+        Returns:
+            np.ndarray: A read-only memory map of the tile data
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest_path = self._manifest_path(path, tile_size, image_type)
+        manifest = self._read_manifest(manifest_path)
+        entries = _manifest(image_paths)
+        cached_files = [tuple(entry) for entry in manifest["files"]]
+        if cached_files == entries:
+            return np.load(self.directory / manifest["data"], mmap_mode="r")
+
+        cached_rows = {entry: row for row, entry in enumerate(cached_files)}
+        stale = [
+            image_path
+            for image_path, entry in zip(image_paths, entries)
+            if entry not in cached_rows
+        ]
+        fresh = iter(process(stale))
+        previous = (
+            np.load(self.directory / manifest["data"], mmap_mode="r")
+            if manifest["data"]
+            else None
+        )
+        tile_data = np.asarray(
+            [
+                previous[cached_rows[entry]] if entry in cached_rows else next(fresh)
+                for entry in entries
+            ]
+        )
+
+        data_name = f"{manifest_path.stem}-{_digest(entries)}.npy"
+        utils.write_atomic(
+            self.directory / data_name, lambda fp: np.save(fp, tile_data)
+        )
+        utils.write_atomic(
+            manifest_path,
+            lambda fp: fp.write(
+                json.dumps({"files": entries, "data": data_name}).encode("utf-8")
+            ),
+        )
+        if manifest["data"] and manifest["data"] != data_name:
+            (self.directory / manifest["data"]).unlink(missing_ok=True)
+        return np.load(self.directory / data_name, mmap_mode="r")
 
 
 @dataclasses.dataclass
@@ -16,26 +140,203 @@ class TileLibrary:
 
     tile_size: int
     tile_data: np.ndarray
+    tile_names: typing.Tuple[str, ...] = ()
 
     @staticmethod
     def _process_tile(
         tile_path: str, tile_size: int, image_type: str = "L"
     ) -> np.ndarray:
         with Image.open(tile_path) as image:
+            # let JPEG decode at 1/2, 1/4 or 1/8 scale when the tile is much smaller
+            image.draft(image_type, (tile_size, tile_size))
             image = utils.crop_largest_square(image)
-            image = utils.resize_image(image, (tile_size, tile_size))
+            image = utils.resize_image(
+                image, (tile_size, tile_size), reducing_gap=REDUCING_GAP
+            )
             data = np.asarray(image.convert(image_type)).flatten()
         return data
 
+    @classmethod
+    def _process_tiles(
+        cls,
+        image_paths: typing.Sequence[pathlib.Path],
+        tile_size: int,
+        image_type: str = "L",
+        workers: typing.Optional[int] = None,
+    ) -> typing.List[np.ndarray]:
+        tile_paths = [str(image_path.absolute()) for image_path in image_paths]
+        if workers == 1 or len(tile_paths) <= 1:
+            return [
+                cls._process_tile(tile_path, tile_size, image_type)
+                for tile_path in tile_paths
+            ]
+
+        # PIL releases the GIL while decoding and resizing so threads scale with cores
+        with futures.ThreadPoolExecutor(
+            max_workers=workers or os.cpu_count() or 1
+        ) as executor:
+            return list(
+                executor.map(
+                    cls._process_tile,
+                    tile_paths,
+                    [tile_size] * len(tile_paths),
+                    [image_type] * len(tile_paths),
+                )
+            )
+
     @classmethod
     def from_directory(
         cls,
-        path: typing.Union[str, pathlib.Path] = ASCII_TILES,
+        path: PathLike = ASCII_TILES,
         tile_size: int = 8,
         image_type: str = "L",
+        cache_dir: typing.Optional[PathLike] = None,
+        workers: typing.Optional[int] = None,
     ) -> "TileLibrary":
-        tile_data = [
-            cls._process_tile(str(image_path.absolute()), tile_size, image_type)
-            for image_path in sorted(pathlib.Path(path).glob("*"))
-        ]
-        return cls(tile_size=tile_size, tile_data=np.asarray(tile_data))
+        """Build a tile library from every image in a directory
+
+        Files that PIL has no decoder for are skipped.
+
+        Args:
+            path (PathLike, optional): A directory of tile images. Defaults to ASCII_TILES.
+            tile_size (int, optional): The size of each tile. Defaults to 8.
+            image_type (str, optional): An image mode. Defaults to "L".
+            cache_dir (typing.Optional[PathLike], optional): Keep processed tiles here and reuse them on later calls. Defaults to None.
+            workers (typing.Optional[int], optional): How many tiles to decode at once. Defaults to one per core.
+        """
+        path = pathlib.Path(path)
+        with profiling.stage("tiles.scan"):
+            image_paths = sorted(
+                image_path
+                for image_path in path.glob("*")
+                if utils.is_image_file(image_path)
+            )
+        if cache_dir is None or not image_paths:
+            with profiling.stage("tiles.decode"):
+                tile_data = cls._process_tiles(
+                    image_paths, tile_size, image_type, workers
+                )
+            return cls(
+                tile_size=tile_size,
+                tile_data=np.asarray(tile_data),
+                tile_names=tuple(image_path.name for image_path in image_paths),
+            )
+
+        def process(stale: typing.Sequence[pathlib.Path]) -> typing.List[np.ndarray]:
+            with profiling.stage("tiles.decode"):
+                return cls._process_tiles(stale, tile_size, image_type, workers)
+
+        with profiling.stage("tiles.cache"):
+            tile_data = TileCache(pathlib.Path(cache_dir)).load(
+                path, image_paths, tile_size, image_type, process
+            )
+        return cls(
+            tile_size=tile_size,
+            tile_data=tile_data,
+            tile_names=tuple(image_path.name for image_path in image_paths),
+        )
+
+    @property
+    def fingerprint(self) -> str:
+        """A digest of the tile data"""
+        return utils.fingerprint_array(self.tile_data)
+
+    @property
+    def tile_set(self) -> typing.Optional[str]:
+        """A digest of the tile file names in library order, the same at every tile size
+
+        None for libraries that were not built from a directory.
+        """
+        return _digest(list(self.tile_names)) if self.tile_names else None
+
+    @functools.cached_property
+    def gif_palette(self) -> writers.TilePalette:
+        """The GIF palette of the library, built once and shared by every GIF it renders"""
+        return writers.TilePalette.from_library(self.tile_data, self.tile_size)
+
+    def ivf_index(
+        self,
+        n_lists: typing.Optional[int] = None,
+        cache_dir: typing.Optional[PathLike] = None,
+    ) -> ann.IVFIndex:
+        """Build an approximate nearest tile index, reusing one saved in cache_dir
+
+        Args:
+            n_lists (typing.Optional[int], optional): How many clusters to make. Defaults to the square root of the number of tiles.
+            cache_dir (typing.Optional[PathLike], optional): Keep the index here and reuse it on later calls. Defaults to None.
+        """
+        fingerprint = self.fingerprint
+        if cache_dir is None:
+            return ann.IVFIndex.build(self.tile_data, fingerprint, n_lists=n_lists)
+
+        index_path = (
+            pathlib.Path(cache_dir) / f"ivf-{fingerprint}-{n_lists or 'auto'}.npz"
+        )
+        if index_path.exists():
+            return ann.IVFIndex.load(index_path)
+        index = ann.IVFIndex.build(self.tile_data, fingerprint, n_lists=n_lists)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        utils.write_atomic(index_path, index.save)
+        return index
+
+
+# (tile directory, tile size, image type)
+LibraryKey = typing.Tuple[str, int, str]
+
+
+@dataclasses.dataclass
+class TileLibraryPool:
+    """Keep one TileLibrary per (tile directory, tile size, image type) for reuse
+
+    Libraries are built on first request and shared by every later caller, including
+    callers on other threads. Each key is built once even if it is requested
+    concurrently.
+
+    Args:
+        cache_dir (typing.Optional[PathLike], optional): Passed to TileLibrary.from_directory. Defaults to None.
+        workers (typing.Optional[int], optional): Passed to TileLibrary.from_directory. Defaults to None.
+    """
+
+    cache_dir: typing.Optional[PathLike] = None
+    workers: typing.Optional[int] = None
+    _libraries: typing.Dict[LibraryKey, "futures.Future[TileLibrary]"] = (
+        dataclasses.field(default_factory=dict, init=False, repr=False)
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    @staticmethod
+    def key(path: PathLike, tile_size: int, image_type: str) -> LibraryKey:
+        return (str(pathlib.Path(path).resolve()), tile_size, str(image_type))
+
+    def get(
+        self, path: PathLike = ASCII_TILES, tile_size: int = 8, image_type: str = "L"
+    ) -> TileLibrary:
+        """The library for a tile directory, building it if this is the first request"""
+        key = self.key(path, tile_size, image_type)
+        with self._lock:
+            future = self._libraries.get(key)
+            owner = future is None
+            if owner:
+                future = self._libraries[key] = futures.Future()
+        if owner:
+            try:
+                future.set_result(
+                    TileLibrary.from_directory(
+                        path,
+                        tile_size=tile_size,
+                        image_type=image_type,
+                        cache_dir=self.cache_dir,
+                        workers=self.workers,
+                    )
+                )
+            except BaseException as error:
+                # let a later request try again instead of caching the failure
+                with self._lock:
+                    del self._libraries[key]
+                future.set_exception(error)
+        return future.result()
+
+    def __len__(self) -> int:
+        return len(self._libraries)
@@ -1,24 +1,94 @@
+import os
 import typing
+import hashlib
+import pathlib
+import tempfile
+import itertools
 import dataclasses
 import threading
+import numpy as np
 from PIL import Image
 
 
+def cache_directory() -> pathlib.Path:
+    """Where rusty_mosaic keeps data that is expensive to recompute
+
+    Honors ``RUSTY_MOSAIC_CACHE_DIR`` and then ``XDG_CACHE_HOME``.
+    """
+    override = os.environ.get("RUSTY_MOSAIC_CACHE_DIR")
+    if override:
+        return pathlib.Path(override)
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "rusty_mosaic"
+
+
+def write_atomic(
+    target: pathlib.Path, write: typing.Callable[[typing.IO[bytes]], None]
+) -> None:
+    """Write a file through write next to target and rename it into place, so readers never see a partial file"""
+    fd, tmp_name = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            write(tmp)
+        os.replace(tmp_name, target)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def fingerprint_array(data: np.ndarray) -> str:
+    """A digest of an array's shape, dtype and contents"""
+    data = np.ascontiguousarray(data)
+    digest = hashlib.blake2b(
+        str((data.shape, data.dtype.str)).encode("utf-8"), digest_size=16
+    )
+    digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
 def resize_image(
-    image: Image.Image, target_size: typing.Tuple[int, int]
+    image: Image.Image,
+    target_size: typing.Tuple[int, int],
+    reducing_gap: typing.Optional[float] = None,
 ) -> Image.Image:
     if target_size == image.size:
         return image
 
-    return image.resize(target_size, Image.Resampling.LANCZOS)
+    return image.resize(
+        target_size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap
+    )
+
 
+def is_image_file(path: pathlib.Path) -> bool:
+    """Whether PIL has a decoder registered for the file's extension"""
+    return path.is_file() and path.suffix.lower() in Image.registered_extensions()
 
-def scale_image(image: Image.Image, scale: typing.Union[int, float]) -> Image.Image:
+
+def scaled_size(
+    image: Image.Image, scale: typing.Union[int, float]
+) -> typing.Tuple[int, int]:
     if scale <= 0:
         raise ValueError("Scaling factor must be non-zero")
-    return resize_image(
-        image,
-        (int(image.size[0] * scale), int(image.size[1] * scale)),
+    return (int(image.size[0] * scale), int(image.size[1] * scale))
+
+
+def scale_image(image: Image.Image, scale: typing.Union[int, float]) -> Image.Image:
+    return resize_image(image, scaled_size(image, scale))
+
+
+def scale_band(
+    image: Image.Image, target_size: typing.Tuple[int, int], top: int, bottom: int
+) -> Image.Image:
+    """Resize image to target_size but only produce the output rows from top to bottom"""
+    width, height = target_size
+    if target_size == image.size:
+        return image.crop((0, top, width, bottom))
+
+    ratio = image.size[1] / height
+    return image.resize(
+        (width, bottom - top),
+        Image.Resampling.LANCZOS,
+        box=(0, top * ratio, image.size[0], bottom * ratio),
     )
 
 
@@ -52,6 +122,18 @@ def crop_tile(image: Image.Image, tile_size: int) -> Image.Image:
     )
 
 
+T = typing.TypeVar("T")
+
+
+def batched(iterable: typing.Iterable[T], size: int) -> typing.Iterator[typing.List[T]]:
+    """Split an iterable into lists of at most size items without consuming it up front"""
+    if size < 1:
+        raise ValueError("Batch size must be at least one")
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
 class KeypressThread(threading.Thread):
 
     def __init__(
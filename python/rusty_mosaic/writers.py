@@ -0,0 +1,388 @@
+import zlib
+import struct
+import typing
+import pathlib
+import dataclasses
+
+import numpy as np
+from PIL import Image
+from PIL import GifImagePlugin
+
+
+@dataclasses.dataclass
+class TilePalette:
+    """One GIF color table for every frame that is built from a tile library
+
+    Every tile is mapped to palette indices once. Libraries with at most 255 colors
+    keep them exactly. With exactly 256, the rarest color is replaced by its nearest
+    neighbour, and larger libraries are quantized to 255 colors once rather than once
+    per frame. The entry after the colors is transparent.
+
+    Args:
+        colors (np.ndarray): The (n, 3) RGB palette, at most 256 colors including the transparent one
+        tiles (np.ndarray): The (n_tiles + 1, tile_size, tile_size) palette indices of each tile, the extra tile is transparent
+        transparency (int): The palette index of transparent pixels
+        exact (bool): Whether every tile keeps its exact colors
+    """
+
+    colors: np.ndarray
+    tiles: np.ndarray
+    transparency: int
+    exact: bool
+
+    @classmethod
+    def from_library(cls, tile_data: np.ndarray, tile_size: int) -> "TilePalette":
+        """Build the palette for the flattened uint8 tiles of a library"""
+        n_tiles = tile_data.shape[0]
+        pixels = np.ascontiguousarray(tile_data, dtype=np.uint8).reshape(
+            n_tiles * tile_size * tile_size, -1
+        )
+        # one integer per color, so np.unique works on a flat array
+        packed = pixels.astype(np.uint32) @ np.array(
+            [1 << 16, 1 << 8, 1][-pixels.shape[1] :], dtype=np.uint32
+        )
+        unique, indices, counts = np.unique(
+            packed, return_inverse=True, return_counts=True
+        )
+        exact = unique.size < 256
+        if unique.size == 256:
+            # fold the rarest color into its nearest neighbour to free an entry for
+            # transparency, which shrinks every frame after the first
+            channels = np.stack([unique >> 16, unique >> 8, unique], axis=1) & 255
+            rarest = int(np.argmin(counts))
+            distance = ((channels - channels[rarest]).astype(np.int64) ** 2).sum(axis=1)
+            distance[rarest] = np.iinfo(np.int64).max
+            indices = np.where(indices == rarest, int(np.argmin(distance)), indices)
+            indices = indices - (indices > rarest)
+            unique = np.delete(unique, rarest)
+        if unique.size <= 256:
+            gray = pixels.shape[1] == 1
+            colors = (
+                np.repeat(unique[:, None], 3, axis=1)
+                if gray
+                else np.stack([unique >> 16, unique >> 8, unique], axis=1)
+            ).astype(np.uint8)
+        else:
+            sheet = Image.fromarray(
+                pixels.reshape(n_tiles * tile_size, tile_size, -1).squeeze(-1)
+                if pixels.shape[1] == 1
+                else pixels.reshape(n_tiles * tile_size, tile_size, 3)
+            ).convert("RGB")
+            quantized = sheet.quantize(
+                colors=255, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE
+            )
+            indices = np.asarray(quantized)
+            colors = np.asarray(quantized.getpalette()[: 255 * 3], dtype=np.uint8)
+            colors = colors.reshape(-1, 3)
+            exact = False
+
+        # the spare entry becomes the transparent color
+        transparency = colors.shape[0]
+        colors = np.concatenate([colors, np.zeros((1, 3), dtype=np.uint8)])
+
+        tiles = np.empty((n_tiles + 1, tile_size, tile_size), dtype=np.uint8)
+        tiles[:n_tiles] = np.asarray(indices, dtype=np.uint8).reshape(
+            n_tiles, tile_size, tile_size
+        )
+        tiles[n_tiles] = transparency
+        return cls(colors=colors, tiles=tiles, transparency=transparency, exact=exact)
+
+    @property
+    def tile_size(self) -> int:
+        return self.tiles.shape[1]
+
+    def compose(self, grid: np.ndarray) -> np.ndarray:
+        """The palette indices of the pixels of a (rows, cols) grid of tile indices"""
+        rows, cols = grid.shape
+        size = self.tile_size
+        return self.tiles[grid].transpose(0, 2, 1, 3).reshape(rows * size, cols * size)
+
+    def image(self, pixels: np.ndarray) -> Image.Image:
+        image = Image.fromarray(pixels)
+        # putpalette turns the L image into a P image
+        image.putpalette(self.colors.tobytes())
+        return image
+
+
+class TileGifWriter:
+    """Write an animated GIF of mosaic frames given as grids of tile indices
+
+    Every frame shares one global palette built from the tile library, so no frame
+    is quantized on its own. After the first frame only the rectangle of tiles that
+    changed is written, with unchanged tiles inside it left transparent. A frame where
+    nothing changed extends the previous frame's duration instead. Frame times are
+    rounded from the start of the animation, so rounding to centiseconds does not make
+    playback drift.
+
+    Args:
+        outfile (typing.Union[str, pathlib.Path, typing.BinaryIO]): Where to write the GIF, a file object is left open
+        palette (TilePalette): The palette of the tile library the indices refer to
+        fps (float): Frames per second
+        loop (int, optional): How many times to loop, 0 loops forever. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        outfile: typing.Union[str, pathlib.Path, typing.BinaryIO],
+        palette: TilePalette,
+        fps: float,
+        loop: int = 0,
+    ):
+        self.palette = palette
+        self.frame_ms = 1000 / fps
+        self.loop = loop
+        self.frames = 0
+        self.written = 0
+        self._owned = not hasattr(outfile, "write")
+        self._fp = open(outfile, "wb") if self._owned else outfile
+        self._previous: typing.Optional[np.ndarray] = None
+        # the image, offset and start time of the frame waiting for its duration
+        self._pending: typing.Optional[
+            typing.Tuple[Image.Image, typing.Tuple[int, int], int]
+        ] = None
+        self._closed = False
+
+    def __enter__(self) -> "TileGifWriter":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+    def _flush(self, end_frame: int) -> None:
+        if self._pending is None:
+            return
+        image, offset, start_frame = self._pending
+        duration = round(end_frame * self.frame_ms / 10) - round(
+            start_frame * self.frame_ms / 10
+        )
+        self._fp.writelines(
+            GifImagePlugin.getdata(
+                image,
+                offset=offset,
+                duration=duration * 10,
+                transparency=self.palette.transparency,
+                # leave each frame in place for the next one to draw over
+                disposal=1,
+            )
+        )
+        self.written += 1
+        self._pending = None
+
+    def write(self, grid: np.ndarray) -> None:
+        """Append a frame given as the (rows, cols) tile index of each block"""
+        grid = np.asarray(grid, dtype=np.intp)
+        previous = self._previous
+        if previous is not None and previous.shape != grid.shape:
+            raise ValueError(
+                f"Every frame must have {previous.shape} tiles, got {grid.shape}"
+            )
+        if previous is None:
+            image = self.palette.image(self.palette.compose(grid))
+            header, _ = GifImagePlugin.getheader(
+                image, info={"loop": self.loop, "duration": self.frame_ms}
+            )
+            self._fp.writelines(header)
+            self._pending = (image, (0, 0), 0)
+        else:
+            changed = grid != previous
+            if changed.any():
+                self._flush(self.frames)
+                rows = np.flatnonzero(changed.any(axis=1))
+                cols = np.flatnonzero(changed.any(axis=0))
+                box = np.s_[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+                # unchanged tiles inside the rectangle use the transparent last tile
+                patch = np.where(changed[box], grid[box], len(self.palette.tiles) - 1)
+                size = self.palette.tile_size
+                self._pending = (
+                    self.palette.image(self.palette.compose(patch)),
+                    (int(cols[0]) * size, int(rows[0]) * size),
+                    self.frames,
+                )
+        self._previous = grid
+        self.frames += 1
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._flush(self.frames)
+        self._fp.write(b";")  # trailer
+        if self._owned:
+            self._fp.close()
+
+
+class PngWriter:
+    """Write an 8-bit grayscale or RGB PNG a band of rows at a time
+
+    Rows are filtered with the PNG "Up" filter and fed through a single zlib stream,
+    so only the current band is ever held in memory.
+
+    Args:
+        outfile (typing.Union[str, pathlib.Path]): Where to write the PNG
+        width (int): The image width in pixels
+        height (int): The image height in pixels
+        mode (str, optional): "L" or "RGB". Defaults to "L".
+        compression (int, optional): The zlib compression level. Defaults to 6.
+    """
+
+    COLOR_TYPES: typing.ClassVar[typing.Dict[str, int]] = {"L": 0, "RGB": 2}
+    UP_FILTER: typing.ClassVar[int] = 2
+
+    def __init__(
+        self,
+        outfile: typing.Union[str, pathlib.Path],
+        width: int,
+        height: int,
+        mode: str = "L",
+        compression: int = 6,
+    ):
+        if mode not in self.COLOR_TYPES:
+            raise ValueError(f"Cannot write {mode} images as PNG bands")
+        self.outfile = pathlib.Path(outfile)
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._previous_row = np.zeros(width * len(mode), dtype=np.uint8)
+        self._compressor = zlib.compressobj(compression)
+        self._fp = open(outfile, "wb")
+        self._fp.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(
+            b"IHDR",
+            struct.pack(">IIBBBBB", width, height, 8, self.COLOR_TYPES[mode], 0, 0, 0),
+        )
+
+    def __enter__(self) -> "PngWriter":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        # let the error that stopped the rows propagate rather than the missing rows
+        if exc_info[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._fp.write(struct.pack(">I", len(data)))
+        self._fp.write(kind)
+        self._fp.write(data)
+        self._fp.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, rows: np.ndarray) -> None:
+        """Append a (h, width[, C]) uint8 band below the rows written so far"""
+        rows = np.asarray(rows, dtype=np.uint8)
+        if rows.shape[0] == 0:
+            return
+        rows = rows.reshape(rows.shape[0], -1)
+        if rows.shape[1] != self._previous_row.shape[0]:
+            raise ValueError("Rows do not match the image width and mode")
+        if self.rows + rows.shape[0] > self.height:
+            raise ValueError("More rows were written than the image height")
+
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = self.UP_FILTER
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        np.subtract(rows[0], self._previous_row, out=filtered[0, 1:])
+        self._previous_row = rows[-1].copy()
+        self.rows += rows.shape[0]
+
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+        if self.rows != self.height:
+            self.abort()
+            raise ValueError(f"Only {self.rows} of {self.height} rows were written")
+        try:
+            self._chunk(b"IDAT", self._compressor.flush())
+            self._chunk(b"IEND", b"")
+        finally:
+            self._fp.close()
+
+    def abort(self) -> None:
+        """Close the file and delete it, nothing written so far is a valid PNG"""
+        self._fp.close()
+        self.outfile.unlink(missing_ok=True)
+
+
+class PnmWriter:
+    """Write a binary PGM (grayscale) or PPM (RGB) a band of rows at a time
+
+    Args:
+        outfile (typing.Union[str, pathlib.Path]): Where to write the image
+        width (int): The image width in pixels
+        height (int): The image height in pixels
+        mode (str, optional): "L" or "RGB". Defaults to "L".
+    """
+
+    MAGIC: typing.ClassVar[typing.Dict[str, bytes]] = {"L": b"P5", "RGB": b"P6"}
+
+    def __init__(
+        self,
+        outfile: typing.Union[str, pathlib.Path],
+        width: int,
+        height: int,
+        mode: str = "L",
+    ):
+        if mode not in self.MAGIC:
+            raise ValueError(f"Cannot write {mode} images as PNM bands")
+        self.outfile = pathlib.Path(outfile)
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._row_values = width * len(mode)
+        self._fp = open(outfile, "wb")
+        self._fp.write(b"%s\n%d %d\n255\n" % (self.MAGIC[mode], width, height))
+
+    def __enter__(self) -> "PnmWriter":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        # let the error that stopped the rows propagate rather than the missing rows
+        if exc_info[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self, rows: np.ndarray) -> None:
+        """Append a (h, width[, C]) uint8 band below the rows written so far"""
+        rows = np.ascontiguousarray(rows, dtype=np.uint8)
+        if rows.shape[0] == 0:
+            return
+        rows = rows.reshape(rows.shape[0], -1)
+        if rows.shape[1] != self._row_values:
+            raise ValueError("Rows do not match the image width and mode")
+        if self.rows + rows.shape[0] > self.height:
+            raise ValueError("More rows were written than the image height")
+        self._fp.write(rows.tobytes())
+        self.rows += rows.shape[0]
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+        if self.rows != self.height:
+            self.abort()
+            raise ValueError(f"Only {self.rows} of {self.height} rows were written")
+        self._fp.close()
+
+    def abort(self) -> None:
+        """Close the file and delete the partial image"""
+        self._fp.close()
+        self.outfile.unlink(missing_ok=True)
+
+
+StripWriter = typing.Union[PngWriter, PnmWriter]
+
+
+def open_strip_writer(
+    outfile: typing.Union[str, pathlib.Path], width: int, height: int, mode: str = "L"
+) -> StripWriter:
+    """Open a writer that accepts an image in horizontal bands, picked by file extension"""
+    suffix = pathlib.Path(outfile).suffix.lower()
+    if suffix == ".png":
+        return PngWriter(outfile, width, height, mode)
+    if suffix in (".pgm", ".ppm", ".pnm"):
+        return PnmWriter(outfile, width, height, mode)
+    raise ValueError(f"Cannot write {suffix} files in strips, use .png or .pnm")
@@ -0,0 +1,410 @@
+//! The distance kernels and tile searches, free of Python, NumPy and rayon so they can be
+//! tested on their own with `rustc --edition 2021 --test src/kernels.rs`. lib.rs wraps
+//! them for Python and spreads blocks over thread pools, which leaves every result as it is.
+
+/// Widened to i64, a sum of squared differences of pixel values overflows an i32 past
+/// about 33k values, i.e. a 105 pixel RGB tile
+pub(crate) fn elementwise_squared_difference_i32(vec1: &[i32], vec2: &[i32]) -> i64 {
+    assert_eq!(vec1.len(), vec2.len(), "Vectors must be of the same length");
+
+    vec1.iter()
+        .zip(vec2.iter())
+        .map(|(&x, &y)| (x as i64 - y as i64).pow(2))
+        .sum()
+}
+
+// 255 * 257 is the largest sum of absolute u8 differences that still fits in a u16
+const SAD_U16_LANE: usize = 257;
+// 255^2 * 66051 is the largest sum of squared u8 differences that still fits in a u32
+const SQUARED_U32_LANE: usize = 66051;
+// Keep a chunk of tiles around the size of L1 cache while blocks are compared against it
+const TILE_CHUNK_BYTES: usize = 32 * 1024;
+
+/// Squared differences of u8 values fit in a u16 (255^2 = 65025), so the multiply runs on
+/// 16-bit lanes and sums run on 32-bit lanes. Only the sums of runs of SQUARED_U32_LANE
+/// values are widened to u64, so tiles of any size are compared without overflowing.
+pub(crate) fn elementwise_squared_difference_u8(vec1: &[u8], vec2: &[u8]) -> u64 {
+    assert_eq!(vec1.len(), vec2.len(), "Vectors must be of the same length");
+
+    vec1.chunks(SQUARED_U32_LANE)
+        .zip(vec2.chunks(SQUARED_U32_LANE))
+        .map(|(chunk1, chunk2)| {
+            chunk1
+                .iter()
+                .zip(chunk2.iter())
+                .map(|(&x, &y)| {
+                    let diff = x.abs_diff(y) as u16;
+                    (diff * diff) as u32
+                })
+                .sum::<u32>() as u64
+        })
+        .sum()
+}
+
+pub(crate) fn elementwise_absolute_difference_u8(vec1: &[u8], vec2: &[u8]) -> u64 {
+    assert_eq!(vec1.len(), vec2.len(), "Vectors must be of the same length");
+
+    vec1.chunks(SAD_U16_LANE)
+        .zip(vec2.chunks(SAD_U16_LANE))
+        .map(|(chunk1, chunk2)| {
+            chunk1
+                .iter()
+                .zip(chunk2.iter())
+                .map(|(&x, &y)| x.abs_diff(y) as u16)
+                .sum::<u16>() as u64
+        })
+        .sum()
+}
+
+pub(crate) fn elementwise_squared_difference_f64(vec1: &[f64], vec2: &[f64]) -> f64 {
+    assert_eq!(vec1.len(), vec2.len(), "Vectors must be of the same length");
+
+    vec1.iter()
+        .zip(vec2.iter())
+        .map(|(&x, &y)| (x - y).powi(2))
+        .sum()
+}
+
+pub(crate) fn find_best_tile_i32(image: &[i32], tiles: &Vec<Vec<i32>>) -> usize {
+    tiles.iter()
+        .enumerate()
+        .map(|(index, vec)| (index, elementwise_squared_difference_i32(image, vec)))
+        .min_by_key(|&(_, diff)| diff)
+        .map(|(index, _)| index)
+        .unwrap_or(0)
+}
+
+/// Tiles are searched sequentially, the blocks are already spread over the pool and a
+/// nested parallel iterator would split every block into tasks too small to pay off
+pub(crate) fn find_best_tile_f64(image: &[f64], tiles: &Vec<Vec<f64>>, diff_func: fn(&[f64], &[f64]) -> f64) -> usize {
+    tiles.iter()
+        .enumerate()
+        .map(|(index, vec)| (index, diff_func(image, vec)))
+        .min_by(|&(_, diff1), &(_, diff2)| diff1.partial_cmp(&diff2).unwrap_or(std::cmp::Ordering::Equal))
+        .map(|(index, _)| index)
+        .unwrap_or(0)
+}
+
+pub(crate) fn find_best_tile_buffer<T, D: PartialOrd + Copy>(
+    image: &[T],
+    tiles: &[T],
+    width: usize,
+    diff_func: fn(&[T], &[T]) -> D,
+) -> usize {
+    let mut best_index = 0;
+    let mut best_diff: Option<D> = None;
+    for (index, tile) in tiles.chunks_exact(width).enumerate() {
+        let diff = diff_func(image, tile);
+        // strict comparison keeps the lowest index on ties, like `min_by_key`
+        if best_diff.map_or(true, |best| diff < best) {
+            best_index = index;
+            best_diff = Some(diff);
+        }
+    }
+    best_index
+}
+
+/// Compare a run of blocks against one cache-sized chunk of tiles at a time instead of
+/// streaming the whole library through the cache once per block.
+pub(crate) fn find_best_tiles_blocked<T: Sync, D: PartialOrd + Copy>(
+    images: &[T],
+    tiles: &[T],
+    width: usize,
+    diff_func: fn(&[T], &[T]) -> D,
+) -> Vec<usize> {
+    let tiles_per_chunk = (TILE_CHUNK_BYTES / (width * std::mem::size_of::<T>())).max(1);
+    let block_count = images.len() / width;
+    let mut best_index = vec![0usize; block_count];
+    let mut best_diff: Vec<Option<D>> = vec![None; block_count];
+    for (chunk_number, tile_chunk) in tiles.chunks(tiles_per_chunk * width).enumerate() {
+        let offset = chunk_number * tiles_per_chunk;
+        for (slot, image) in images.chunks_exact(width).enumerate() {
+            for (index, tile) in tile_chunk.chunks_exact(width).enumerate() {
+                let diff = diff_func(image, tile);
+                if best_diff[slot].map_or(true, |best| diff < best) {
+                    best_index[slot] = offset + index;
+                    best_diff[slot] = Some(diff);
+                }
+            }
+        }
+    }
+    best_index
+}
+
+fn group_sums_u8(values: &[u8], groups: usize) -> Vec<i64> {
+    values
+        .chunks_exact(values.len() / groups)
+        .map(|group| group.iter().map(|&value| value as i64).sum())
+        .collect()
+}
+
+fn norm_u8(values: &[u8]) -> f64 {
+    (values.iter().map(|&value| (value as u64).pow(2)).sum::<u64>() as f64).sqrt()
+}
+
+fn greatest_common_divisor(a: usize, b: usize) -> usize {
+    if b == 0 {
+        a
+    } else {
+        greatest_common_divisor(b, a % b)
+    }
+}
+
+/// Sum squared differences chunk by chunk, giving up once the total exceeds `limit`
+fn bounded_squared_difference_u8(vec1: &[u8], vec2: &[u8], chunk: usize, limit: u64) -> Option<u64> {
+    let mut total = 0u64;
+    for (chunk1, chunk2) in vec1.chunks(chunk).zip(vec2.chunks(chunk)) {
+        total += elementwise_squared_difference_u8(chunk1, chunk2);
+        if total > limit {
+            return None;
+        }
+    }
+    Some(total)
+}
+
+/// Per-tile summaries that bound the squared distance to a tile from below.
+///
+/// For a block `a` and tile `b` with `n` values split into `groups` equal chunks:
+///   (sum(a) - sum(b))^2 / n <= |a - b|^2                                (means)
+///   sum over chunks of (sum(a_g) - sum(b_g))^2 / (n / groups) <= |a - b|^2  (signature)
+///   (|a| - |b|)^2 <= |a - b|^2                                          (norms)
+/// Tiles are visited in order of their distance in sum from the block, so the search
+/// stops as soon as the mean bound alone exceeds the best distance so far.
+pub(crate) struct TileIndex {
+    width: usize,
+    groups: usize,
+    order: Vec<usize>,
+    sorted_sums: Vec<i64>,
+    norms: Vec<f64>,
+    signatures: Vec<i64>,
+}
+
+impl TileIndex {
+    pub(crate) fn new(tiles: &[u8], width: usize, groups: usize) -> TileIndex {
+        let groups = greatest_common_divisor(width, groups.max(1));
+        let signatures: Vec<i64> = tiles
+            .chunks_exact(width)
+            .flat_map(|tile| group_sums_u8(tile, groups))
+            .collect();
+        let sums: Vec<i64> = signatures.chunks_exact(groups).map(|signature| signature.iter().sum()).collect();
+        let mut order: Vec<usize> = (0..sums.len()).collect();
+        order.sort_by_key(|&index| (sums[index], index));
+        TileIndex {
+            width,
+            groups,
+            sorted_sums: order.iter().map(|&index| sums[index]).collect(),
+            order,
+            norms: tiles.chunks_exact(width).map(norm_u8).collect(),
+            signatures,
+        }
+    }
+
+    pub(crate) fn find_best_tile(&self, image: &[u8], tiles: &[u8]) -> usize {
+        let group_len = self.width / self.groups;
+        let image_signature = group_sums_u8(image, self.groups);
+        let image_sum: i64 = image_signature.iter().sum();
+        let image_norm = norm_u8(image);
+
+        let mut best_index = 0;
+        let mut best_diff = u64::MAX;
+        let mut below = self.sorted_sums.partition_point(|&sum| sum < image_sum);
+        let mut above = below;
+        loop {
+            let gap_below = if below > 0 { Some(image_sum - self.sorted_sums[below - 1]) } else { None };
+            let gap_above = self.sorted_sums.get(above).map(|&sum| sum - image_sum);
+            let (position, gap) = match (gap_below, gap_above) {
+                (Some(gap_b), Some(gap_a)) if gap_b <= gap_a => {
+                    below -= 1;
+                    (below, gap_b)
+                }
+                (_, Some(gap_a)) => {
+                    above += 1;
+                    (above - 1, gap_a)
+                }
+                (Some(gap_b), None) => {
+                    below -= 1;
+                    (below, gap_b)
+                }
+                (None, None) => break,
+            };
+            // every remaining tile is at least this far away in sum, strict comparisons
+            // keep tiles that could tie so the lowest index still wins
+            if best_diff != u64::MAX && (gap as i128).pow(2) > best_diff as i128 * self.width as i128 {
+                break;
+            }
+
+            let index = self.order[position];
+            if best_diff != u64::MAX {
+                let norm_gap = image_norm - self.norms[index];
+                // the margin absorbs rounding in the square roots, distances are integers
+                if norm_gap * norm_gap > best_diff as f64 + 1.0 {
+                    continue;
+                }
+                let signature = &self.signatures[index * self.groups..(index + 1) * self.groups];
+                let signature_bound: i128 = image_signature
+                    .iter()
+                    .zip(signature.iter())
+                    .map(|(&x, &y)| ((x - y) as i128).pow(2))
+                    .sum();
+                if signature_bound > best_diff as i128 * group_len as i128 {
+                    continue;
+                }
+            }
+
+            let tile = &tiles[index * self.width..(index + 1) * self.width];
+            if let Some(diff) = bounded_squared_difference_u8(image, tile, group_len, best_diff) {
+                if diff < best_diff || (diff == best_diff && index < best_index) {
+                    best_index = index;
+                    best_diff = diff;
+                }
+            }
+        }
+        best_index
+    }
+}
+
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    /// A small xorshift generator, so the tests need no crates
+    struct Rng(u64);
+
+    impl Rng {
+        fn next(&mut self) -> u64 {
+            self.0 ^= self.0 << 13;
+            self.0 ^= self.0 >> 7;
+            self.0 ^= self.0 << 17;
+            self.0
+        }
+
+        fn values(&mut self, count: usize, levels: u64) -> Vec<u8> {
+            (0..count).map(|_| (self.next() % levels) as u8).collect()
+        }
+    }
+
+    /// The exact squared distances in i64 and the lowest index among the nearest tiles
+    fn brute_force(image: &[u8], tiles: &[u8], width: usize) -> usize {
+        let mut best = (i64::MAX, 0);
+        for (index, tile) in tiles.chunks_exact(width).enumerate() {
+            let diff: i64 = image.iter().zip(tile).map(|(&x, &y)| (x as i64 - y as i64).pow(2)).sum();
+            best = best.min((diff, index));
+        }
+        best.1
+    }
+
+    fn brute_force_sad(image: &[u8], tiles: &[u8], width: usize) -> usize {
+        let mut best = (i64::MAX, 0);
+        for (index, tile) in tiles.chunks_exact(width).enumerate() {
+            let diff: i64 = image.iter().zip(tile).map(|(&x, &y)| (x as i64 - y as i64).abs()).sum();
+            best = best.min((diff, index));
+        }
+        best.1
+    }
+
+    /// Every kernel's pick for every block, named so a failure says which kernel differs
+    fn every_kernel(images: &[u8], tiles: &[u8], width: usize) -> Vec<(&'static str, Vec<usize>)> {
+        let as_i32 = |values: &[u8]| values.iter().map(|&value| value as i32).collect::<Vec<i32>>();
+        let as_f64 = |values: &[u8]| values.iter().map(|&value| value as f64).collect::<Vec<f64>>();
+        let (images_i32, tiles_i32) = (as_i32(images), as_i32(tiles));
+        let (images_f64, tiles_f64) = (as_f64(images), as_f64(tiles));
+        let tile_rows_i32: Vec<Vec<i32>> = tiles_i32.chunks_exact(width).map(|tile| tile.to_vec()).collect();
+        let tile_rows_f64: Vec<Vec<f64>> = tiles_f64.chunks_exact(width).map(|tile| tile.to_vec()).collect();
+        let mut found = vec![
+            (
+                "buffer_u8",
+                images.chunks_exact(width).map(|image| find_best_tile_buffer(image, tiles, width, elementwise_squared_difference_u8)).collect(),
+            ),
+            (
+                "buffer_i32",
+                images_i32.chunks_exact(width).map(|image| find_best_tile_buffer(image, &tiles_i32, width, elementwise_squared_difference_i32)).collect(),
+            ),
+            (
+                "buffer_f64",
+                images_f64.chunks_exact(width).map(|image| find_best_tile_buffer(image, &tiles_f64, width, elementwise_squared_difference_f64)).collect(),
+            ),
+            ("vec_i32", images_i32.chunks_exact(width).map(|image| find_best_tile_i32(image, &tile_rows_i32)).collect()),
+            (
+                "vec_f64",
+                images_f64.chunks_exact(width).map(|image| find_best_tile_f64(image, &tile_rows_f64, elementwise_squared_difference_f64)).collect(),
+            ),
+            ("blocked_u8", find_best_tiles_blocked(images, tiles, width, elementwise_squared_difference_u8)),
+        ];
+        for groups in [1, 4, 16, 7] {
+            let index = TileIndex::new(tiles, width, groups);
+            found.push(("pruned_u8", images.chunks_exact(width).map(|image| index.find_best_tile(image, tiles)).collect()));
+        }
+        found
+    }
+
+    fn check(images: &[u8], tiles: &[u8], width: usize) {
+        let expected: Vec<usize> = images.chunks_exact(width).map(|image| brute_force(image, tiles, width)).collect();
+        for (name, found) in every_kernel(images, tiles, width) {
+            assert_eq!(found, expected, "{} differs from a brute force search", name);
+        }
+        let expected_sad: Vec<usize> = images.chunks_exact(width).map(|image| brute_force_sad(image, tiles, width)).collect();
+        let sad: Vec<usize> = images
+            .chunks_exact(width)
+            .map(|image| find_best_tile_buffer(image, tiles, width, elementwise_absolute_difference_u8))
+            .collect();
+        assert_eq!(sad, expected_sad, "sad_u8 differs from a brute force search");
+        let blocked_sad = find_best_tiles_blocked(images, tiles, width, elementwise_absolute_difference_u8);
+        assert_eq!(blocked_sad, expected_sad, "blocked_sad_u8 differs from a brute force search");
+    }
+
+    #[test]
+    fn random_tiles_match_brute_force() {
+        let mut rng = Rng(0x9e3779b97f4a7c15);
+        for width in [1, 3, 16, 64, 192] {
+            check(&rng.values(200 * width, 256), &rng.values(300 * width, 256), width);
+        }
+    }
+
+    #[test]
+    fn ties_go_to_the_lowest_index() {
+        let mut rng = Rng(42);
+        for width in [4, 16, 64] {
+            // four levels make many tiles equally far from a block
+            let images = rng.values(300 * width, 4);
+            let mut tiles = rng.values(40 * width, 4);
+            // and duplicate tiles are always tied
+            let copy = tiles[..10 * width].to_vec();
+            tiles.extend(copy);
+            check(&images, &tiles, width);
+        }
+    }
+
+    #[test]
+    fn tiles_either_side_of_a_block_tie() {
+        let width = 16;
+        let images = vec![128u8; width];
+        let tiles: Vec<u8> = [130u8, 129, 127, 129].iter().flat_map(|&value| vec![value; width]).collect();
+        check(&images, &tiles, width);
+        assert_eq!(find_best_tiles_blocked(&images, &tiles, width, elementwise_squared_difference_u8), vec![1]);
+    }
+
+    #[test]
+    fn more_tiles_than_one_cache_chunk() {
+        let mut rng = Rng(7);
+        let width = 64;
+        // TILE_CHUNK_BYTES / 64 = 512 tiles per chunk, ties across chunks keep the lowest index
+        let mut tiles = rng.values(1500 * width, 8);
+        let copy = tiles[..600 * width].to_vec();
+        tiles.extend(copy);
+        check(&rng.values(100 * width, 8), &tiles, width);
+    }
+
+    #[test]
+    fn large_tiles_do_not_overflow() {
+        // 255^2 over 100k values is far past a u32
+        let width = 100_000;
+        let images = vec![0u8; width];
+        let mut tiles = vec![255u8; width];
+        tiles.extend(vec![254u8; width]);
+        tiles.extend(vec![255u8; width]);
+        assert_eq!(elementwise_squared_difference_u8(&images, &tiles[..width]), 255u64 * 255 * width as u64);
+        assert_eq!(elementwise_absolute_difference_u8(&images, &tiles[..width]), 255u64 * width as u64);
+        check(&images, &tiles, width);
+    }
+}
@@ -1,67 +1,267 @@
+use std::collections::HashMap;
+use std::sync::{Arc, Mutex, OnceLock};
+
+use numpy::{Element, IntoPyArray, PyArray1, PyReadonlyArray2};
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
 use rayon::prelude::*;
 
-fn elementwise_squared_difference_i32(vec1: &[i32], vec2: &[i32]) -> i32 {
-    assert_eq!(vec1.len(), vec2.len(), "Vectors must be of the same length");
+mod kernels;
+
+use kernels::*;
+
+const BLOCK_CHUNK: usize = 64;
 
-    vec1.iter()
-        .zip(vec2.iter())
-        .map(|(&x, &y)| (x - y).pow(2))
-        .sum()
+/// The pool with `threads` threads, built on first use and kept for later calls.
+///
+/// Parallel kernels run in these pools rather than in rayon's global pool, so every
+/// caller decides how many threads a kernel gets. 0 means one thread per core.
+fn thread_pool(threads: usize) -> PyResult<Arc<rayon::ThreadPool>> {
+    static POOLS: OnceLock<Mutex<HashMap<usize, Arc<rayon::ThreadPool>>>> = OnceLock::new();
+    let mut pools = POOLS
+        .get_or_init(|| Mutex::new(HashMap::new()))
+        .lock()
+        .unwrap_or_else(|poisoned| poisoned.into_inner());
+    if let Some(pool) = pools.get(&threads) {
+        return Ok(Arc::clone(pool));
+    }
+    let pool = rayon::ThreadPoolBuilder::new()
+        .num_threads(threads)
+        .thread_name(move |index| format!("rusty_mosaic-{}-{}", threads, index))
+        .build()
+        .map_err(|error| {
+            PyValueError::new_err(format!("Could not start {} threads: {}", threads, error))
+        })?;
+    let pool = Arc::new(pool);
+    pools.insert(threads, Arc::clone(&pool));
+    Ok(pool)
 }
 
-fn elementwise_squared_difference_f64(vec1: &[f64], vec2: &[f64]) -> f64 {
-    assert_eq!(vec1.len(), vec2.len(), "Vectors must be of the same length");
+/// Run a kernel without the GIL, inside the pool for `threads` when it is parallel
+fn run_kernel<R: Send>(
+    py: Python<'_>,
+    parallel: bool,
+    threads: usize,
+    kernel: impl FnOnce() -> R + Send,
+) -> PyResult<R> {
+    if !parallel {
+        return Ok(py.allow_threads(kernel));
+    }
+    let pool = thread_pool(threads)?;
+    Ok(py.allow_threads(move || pool.install(kernel)))
+}
 
-    vec1.iter()
-        .zip(vec2.iter())
-        .map(|(&x, &y)| (x - y).powi(2))
-        .sum()
+#[pyfunction]
+fn find_best_tiles_i32(py: Python<'_>, images: Vec<Vec<i32>>, tiles: Vec<Vec<i32>>) -> PyResult<Vec<usize>> {
+    run_kernel(py, false, 1, || {
+        images
+            .iter()
+            .map(|image| find_best_tile_i32(image, &tiles))
+            .collect()
+    })
 }
 
 #[pyfunction]
-fn find_best_tiles_i32(images: Vec<Vec<i32>>, tiles: Vec<Vec<i32>>) -> Vec<usize> {
-    images
-        .iter()
-        .map(|image| find_best_tile_i32(image, &tiles))
-        .collect()
+#[pyo3(signature = (images, tiles, threads = 0))]
+fn parallel_find_best_tiles_i32(
+    py: Python<'_>,
+    images: Vec<Vec<i32>>,
+    tiles: Vec<Vec<i32>>,
+    threads: usize,
+) -> PyResult<Vec<usize>> {
+    run_kernel(py, true, threads, || {
+        images
+            .par_iter()
+            .map(|image| find_best_tile_i32(image, &tiles))
+            .collect()
+    })
 }
 
 #[pyfunction]
-fn parallel_find_best_tiles_i32(images: Vec<Vec<i32>>, tiles: Vec<Vec<i32>>) -> Vec<usize> {
-    images
-        .par_iter()
-        .map(|image| find_best_tile_i32(image, &tiles))
-        .collect()
+#[pyo3(signature = (images, tiles, threads = 0))]
+fn find_best_tiles_f64(
+    py: Python<'_>,
+    images: Vec<Vec<f64>>,
+    tiles: Vec<Vec<f64>>,
+    threads: usize,
+) -> PyResult<Vec<usize>> {
+    run_kernel(py, true, threads, || {
+        images
+            .par_iter()
+            .map(|image| find_best_tile_f64(image, &tiles, elementwise_squared_difference_f64))
+            .collect()
+    })
+}
+
+/// Borrow the rows of two C-contiguous 2D arrays as flat slices plus the shared row width
+fn block_buffers<'a, 'py, T: Element>(
+    images: &'a PyReadonlyArray2<'py, T>,
+    tiles: &'a PyReadonlyArray2<'py, T>,
+) -> PyResult<(&'a [T], &'a [T], usize)> {
+    let width = images.shape()[1];
+    if tiles.shape()[1] != width {
+        return Err(PyValueError::new_err(format!(
+            "Image blocks have {} values but tiles have {}",
+            width,
+            tiles.shape()[1]
+        )));
+    }
+    if width == 0 {
+        return Err(PyValueError::new_err("Image blocks must not be empty"));
+    }
+    Ok((images.as_slice()?, tiles.as_slice()?, width))
+}
+
+fn find_best_tiles_buffer<T: Sync, D: PartialOrd + Copy>(
+    images: &[T],
+    tiles: &[T],
+    width: usize,
+    parallel: bool,
+    diff_func: fn(&[T], &[T]) -> D,
+) -> Vec<usize> {
+    if parallel {
+        images
+            .par_chunks_exact(width)
+            .map(|image| find_best_tile_buffer(image, tiles, width, diff_func))
+            .collect()
+    } else {
+        images
+            .chunks_exact(width)
+            .map(|image| find_best_tile_buffer(image, tiles, width, diff_func))
+            .collect()
+    }
 }
 
-fn find_best_tile_i32(image: &[i32], tiles: &Vec<Vec<i32>>) -> usize {
-    tiles.iter()
-        .enumerate()
-        .map(|(index, vec)| (index, elementwise_squared_difference_i32(image, vec)))
-        .min_by_key(|&(_, diff)| diff)
-        .map(|(index, _)| index)
-        .unwrap_or(0)
+#[pyfunction]
+#[pyo3(signature = (images, tiles, parallel = false, threads = 0))]
+fn find_best_tiles_buffer_u8<'py>(
+    py: Python<'py>,
+    images: PyReadonlyArray2<'py, u8>,
+    tiles: PyReadonlyArray2<'py, u8>,
+    parallel: bool,
+    threads: usize,
+) -> PyResult<&'py PyArray1<usize>> {
+    let (image_data, tile_data, width) = block_buffers(&images, &tiles)?;
+    let best = run_kernel(py, parallel, threads, || {
+        find_best_tiles_buffer(image_data, tile_data, width, parallel, elementwise_squared_difference_u8)
+    })?;
+    Ok(best.into_pyarray(py))
+}
+
+#[pyfunction]
+#[pyo3(signature = (images, tiles, parallel = false, threads = 0))]
+fn find_best_tiles_buffer_i32<'py>(
+    py: Python<'py>,
+    images: PyReadonlyArray2<'py, i32>,
+    tiles: PyReadonlyArray2<'py, i32>,
+    parallel: bool,
+    threads: usize,
+) -> PyResult<&'py PyArray1<usize>> {
+    let (image_data, tile_data, width) = block_buffers(&images, &tiles)?;
+    let best = run_kernel(py, parallel, threads, || {
+        find_best_tiles_buffer(image_data, tile_data, width, parallel, elementwise_squared_difference_i32)
+    })?;
+    Ok(best.into_pyarray(py))
 }
 
 #[pyfunction]
-fn find_best_tiles_f64(images: Vec<Vec<f64>>, tiles: Vec<Vec<f64>>) -> Vec<usize> {
+#[pyo3(signature = (images, tiles, parallel = false, threads = 0))]
+fn find_best_tiles_buffer_f64<'py>(
+    py: Python<'py>,
+    images: PyReadonlyArray2<'py, f64>,
+    tiles: PyReadonlyArray2<'py, f64>,
+    parallel: bool,
+    threads: usize,
+) -> PyResult<&'py PyArray1<usize>> {
+    let (image_data, tile_data, width) = block_buffers(&images, &tiles)?;
+    let best = run_kernel(py, parallel, threads, || {
+        find_best_tiles_buffer(image_data, tile_data, width, parallel, elementwise_squared_difference_f64)
+    })?;
+    Ok(best.into_pyarray(py))
+}
+
+fn find_best_tiles_blocked_parallel<T: Sync, D: PartialOrd + Copy + Send>(
+    images: &[T],
+    tiles: &[T],
+    width: usize,
+    parallel: bool,
+    diff_func: fn(&[T], &[T]) -> D,
+) -> Vec<usize> {
+    if !parallel {
+        return find_best_tiles_blocked(images, tiles, width, diff_func);
+    }
     images
-        .par_iter()
-        .map(|image| find_best_tile_f64(image, &tiles, elementwise_squared_difference_f64))
-        .collect()
+        .par_chunks(BLOCK_CHUNK * width)
+        .map(|image_chunk| find_best_tiles_blocked(image_chunk, tiles, width, diff_func))
+        .collect::<Vec<Vec<usize>>>()
+        .concat()
 }
 
-fn find_best_tile_f64(image: &[f64], tiles: &Vec<Vec<f64>>, diff_func: fn(&[f64], &[f64]) -> f64) -> usize {
-    tiles.par_iter()
-        .enumerate()
-        .map(|(index, vec)| (index, diff_func(image, vec)))
-        .min_by(|&(_, diff1), &(_, diff2)| diff1.partial_cmp(&diff2).unwrap_or(std::cmp::Ordering::Equal))
-        .map(|(index, _)| index)
-        .unwrap_or(0)
+#[pyfunction]
+#[pyo3(signature = (images, tiles, parallel = false, threads = 0))]
+fn find_best_tiles_buffer_sad_u8<'py>(
+    py: Python<'py>,
+    images: PyReadonlyArray2<'py, u8>,
+    tiles: PyReadonlyArray2<'py, u8>,
+    parallel: bool,
+    threads: usize,
+) -> PyResult<&'py PyArray1<usize>> {
+    let (image_data, tile_data, width) = block_buffers(&images, &tiles)?;
+    let best = run_kernel(py, parallel, threads, || {
+        find_best_tiles_buffer(image_data, tile_data, width, parallel, elementwise_absolute_difference_u8)
+    })?;
+    Ok(best.into_pyarray(py))
 }
 
+#[pyfunction]
+#[pyo3(signature = (images, tiles, sad = false, parallel = false, threads = 0))]
+fn find_best_tiles_blocked_u8<'py>(
+    py: Python<'py>,
+    images: PyReadonlyArray2<'py, u8>,
+    tiles: PyReadonlyArray2<'py, u8>,
+    sad: bool,
+    parallel: bool,
+    threads: usize,
+) -> PyResult<&'py PyArray1<usize>> {
+    let (image_data, tile_data, width) = block_buffers(&images, &tiles)?;
+    let diff_func: fn(&[u8], &[u8]) -> u64 = if sad {
+        elementwise_absolute_difference_u8
+    } else {
+        elementwise_squared_difference_u8
+    };
+    let best = run_kernel(py, parallel, threads, || {
+        find_best_tiles_blocked_parallel(image_data, tile_data, width, parallel, diff_func)
+    })?;
+    Ok(best.into_pyarray(py))
+}
 
+#[pyfunction]
+#[pyo3(signature = (images, tiles, groups = 16, parallel = false, threads = 0))]
+fn find_best_tiles_pruned_u8<'py>(
+    py: Python<'py>,
+    images: PyReadonlyArray2<'py, u8>,
+    tiles: PyReadonlyArray2<'py, u8>,
+    groups: usize,
+    parallel: bool,
+    threads: usize,
+) -> PyResult<&'py PyArray1<usize>> {
+    let (image_data, tile_data, width) = block_buffers(&images, &tiles)?;
+    let best = run_kernel(py, parallel, threads, || {
+        let index = TileIndex::new(tile_data, width, groups);
+        if parallel {
+            image_data
+                .par_chunks_exact(width)
+                .map(|image| index.find_best_tile(image, tile_data))
+                .collect()
+        } else {
+            image_data
+                .chunks_exact(width)
+                .map(|image| index.find_best_tile(image, tile_data))
+                .collect::<Vec<usize>>()
+        }
+    })?;
+    Ok(best.into_pyarray(py))
+}
 
 /// A Python module implemented in Rust.
 #[pymodule]
@@ -70,5 +270,11 @@ fn rusty_mosaic(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(find_best_tiles_i32, m)?)?;
     m.add_function(wrap_pyfunction!(parallel_find_best_tiles_i32, m)?)?;
     m.add_function(wrap_pyfunction!(find_best_tiles_f64, m)?)?;
+    m.add_function(wrap_pyfunction!(find_best_tiles_buffer_u8, m)?)?;
+    m.add_function(wrap_pyfunction!(find_best_tiles_buffer_i32, m)?)?;
+    m.add_function(wrap_pyfunction!(find_best_tiles_buffer_f64, m)?)?;
+    m.add_function(wrap_pyfunction!(find_best_tiles_pruned_u8, m)?)?;
+    m.add_function(wrap_pyfunction!(find_best_tiles_buffer_sad_u8, m)?)?;
+    m.add_function(wrap_pyfunction!(find_best_tiles_blocked_u8, m)?)?;
     Ok(())
 }
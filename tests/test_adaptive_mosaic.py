@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic import adaptive_mosaic
+
+TILE_SIZES = (16, 8, 4)
+
+
+def flat_tiles(tile_size, values):
+    data = np.repeat(np.asarray(values, dtype=np.uint8)[:, None], tile_size**2, axis=1)
+    return tile_library.TileLibrary(tile_size=tile_size, tile_data=data)
+
+
+def random_tiles(tile_size, n_tiles=12, seed=0):
+    rng = np.random.default_rng(seed + tile_size)
+    data = rng.integers(0, 256, (n_tiles, tile_size * tile_size), dtype=np.uint8)
+    return tile_library.TileLibrary(tile_size=tile_size, tile_data=data)
+
+
+def half_flat_source():
+    """A 32 x 32 image, flat on the left and noise on the right"""
+    source = np.full((32, 32), 100, dtype=np.uint8)
+    source[:, 16:] = np.random.default_rng(0).integers(0, 256, (32, 16))
+    return source
+
+
+def regions(mosaic):
+    return {
+        (level.tile_size, int(row), int(col))
+        for level in mosaic.levels
+        for row, col in level.positions
+    }
+
+
+def test_flat_regions_get_large_tiles_and_detail_small_ones():
+    tiles = {size: flat_tiles(size, [0, 100, 255]) for size in TILE_SIZES}
+    mosaic = adaptive_mosaic.AdaptiveImageMosaic(
+        half_flat_source(), TILE_SIZES
+    ).replace_tiles(tiles, cmp=comparisons.blas_distance)
+
+    found = regions(mosaic)
+    assert {(16, 0, 0), (16, 16, 0)} == {r for r in found if r[0] == 16}
+    assert not [r for r in found if r[0] == 8]
+    assert {(4, row, col) for row in range(0, 32, 4) for col in range(16, 32, 4)} == {
+        r for r in found if r[0] == 4
+    }
+    # two large blocks were matched, the noisy ones were split before matching
+    assert [level.compared for level in mosaic.levels] == [2, 0, 32]
+    assert mosaic.compared < mosaic.uniform_blocks
+
+
+def test_every_pixel_is_covered_once():
+    tiles = {size: random_tiles(size) for size in TILE_SIZES}
+    mosaic = adaptive_mosaic.AdaptiveImageMosaic(
+        half_flat_source(), TILE_SIZES, variance_threshold=50
+    ).replace_tiles(tiles, cmp=comparisons.blas_distance)
+    covered = np.zeros((32, 32), dtype=int)
+    for size, row, col in regions(mosaic):
+        covered[row : row + size, col : col + size] += 1
+    np.testing.assert_array_equal(covered, 1)
+
+
+def test_error_threshold_splits_blocks_no_tile_fits():
+    source = np.full((32, 32), 100, dtype=np.uint8)
+    # only the 8 pixel library has a tile close to the image
+    tiles = {
+        16: flat_tiles(16, [0, 255]),
+        8: flat_tiles(8, [0, 100, 255]),
+        4: flat_tiles(4, [0, 255]),
+    }
+    kept = adaptive_mosaic.AdaptiveImageMosaic(source, TILE_SIZES).replace_tiles(
+        tiles, cmp=comparisons.blas_distance
+    )
+    assert {size for size, _, _ in regions(kept)} == {16}
+
+    split = adaptive_mosaic.AdaptiveImageMosaic(
+        source, TILE_SIZES, error_threshold=10
+    ).replace_tiles(tiles, cmp=comparisons.blas_distance)
+    assert {size for size, _, _ in regions(split)} == {8}
+    assert [len(level) for level in split.levels] == [0, 16, 0]
+    # the split blocks were matched at 16 pixels before they were split
+    assert split.levels[0].compared == 4
+    np.testing.assert_array_equal(split.render(), source)
+
+
+def test_render_places_the_chosen_tiles():
+    tiles = {size: random_tiles(size) for size in TILE_SIZES}
+    mosaic = adaptive_mosaic.AdaptiveImageMosaic(
+        half_flat_source(), TILE_SIZES, variance_threshold=50
+    ).replace_tiles(tiles, cmp=comparisons.blas_distance)
+    pixmap = mosaic.render()
+    assert pixmap.shape == (32, 32)
+    for level in mosaic.levels:
+        size = level.tile_size
+        for (row, col), index in zip(level.positions, level.tile_indices):
+            np.testing.assert_array_equal(
+                pixmap[row : row + size, col : col + size],
+                tiles[size].tile_data[index].reshape(size, size),
+            )
+    out = np.empty((32, 32), dtype=np.uint8)
+    assert mosaic.render(out) is out
+    np.testing.assert_array_equal(out, pixmap)
+    with pytest.raises(ValueError, match="output buffer"):
+        mosaic.render(np.empty((32, 31), dtype=np.uint8))
+
+
+def test_unmatched_mosaic_renders_the_source():
+    source = half_flat_source()
+    mosaic = adaptive_mosaic.AdaptiveImageMosaic(source, TILE_SIZES)
+    np.testing.assert_array_equal(mosaic.render(), source)
+
+
+@pytest.mark.parametrize(
+    "tile_sizes, match_size, error",
+    [
+        ((), None, "Invalid tile sizes"),
+        ((16, 0), None, "Invalid tile sizes"),
+        ((8, 16), None, "largest to smallest"),
+        ((16, 12), None, "multiple of the next"),
+        ((16, 16), None, "largest to smallest"),
+        ((16, 8), 3, "must divide the smallest tile size"),
+        ((16, 8), 16, "must divide the smallest tile size"),
+        ((16, 8), 0, "must divide the smallest tile size"),
+        ((24, 8), None, "not a multiple of the largest tile size"),
+    ],
+)
+def test_constructor_validates_sizes(tile_sizes, match_size, error):
+    with pytest.raises(ValueError, match=error):
+        adaptive_mosaic.AdaptiveImageMosaic(
+            np.zeros((32, 32), dtype=np.uint8), tile_sizes, match_size=match_size
+        )
+
+
+def test_replace_tiles_needs_every_tile_size():
+    mosaic = adaptive_mosaic.AdaptiveImageMosaic(half_flat_source(), TILE_SIZES)
+    with pytest.raises(ValueError, match=r"tile sizes \[4\]"):
+        mosaic.replace_tiles({16: flat_tiles(16, [0]), 8: flat_tiles(8, [0])})
+
+
+@pytest.mark.parametrize("match_size", [1, 2, 4])
+def test_shrunk_matching_picks_the_same_flat_tiles(match_size):
+    tiles = {size: flat_tiles(size, [0, 100, 255]) for size in TILE_SIZES}
+    mosaic = adaptive_mosaic.AdaptiveImageMosaic(
+        half_flat_source(), TILE_SIZES, match_size=match_size
+    ).replace_tiles(tiles, cmp=comparisons.blas_distance)
+    assert mosaic.levels[0].tile_indices.tolist() == [1, 1]
+    np.testing.assert_array_equal(mosaic.render()[:, :16], 100)
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from concurrent import futures
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rusty_mosaic import aio
+from rusty_mosaic import mosaic
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+
+N_FRAMES = 11
+
+
+@pytest.fixture
+def tiles():
+    data = np.random.default_rng(0).integers(0, 256, (20, 64), dtype=np.uint8)
+    return tile_library.TileLibrary(tile_size=8, tile_data=data)
+
+
+@pytest.fixture
+def animation():
+    rng = np.random.default_rng(1)
+    frames = [
+        mosaic.ImageMosaic.from_image(
+            Image.fromarray(rng.integers(0, 256, (16, 24), dtype=np.uint8)), 8
+        )
+        for _ in range(N_FRAMES)
+    ]
+    return mosaic.GifMosaic(frames=frames, fps=10)
+
+
+@pytest.fixture
+def executor():
+    with futures.ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def test_iter_replace_tiles_yields_every_frame_in_order(animation, tiles, executor):
+    async def collect():
+        return [
+            update
+            async for update in aio.iter_replace_tiles(
+                animation,
+                tiles,
+                cmp=comparisons.blas_distance,
+                batch_size=4,
+                executor=executor,
+            )
+        ]
+
+    updates = asyncio.run(collect())
+    assert [update.index for update in updates] == list(range(N_FRAMES))
+    assert {update.total for update in updates} == {N_FRAMES}
+    assert updates[-1].done == 1
+    for update, frame in zip(updates, animation.frames):
+        best = comparisons.blas_distance(frame.blocks, tiles.tile_data)
+        np.testing.assert_array_equal(update.frame.blocks, tiles.tile_data[best])
+    # the animation itself is left as it was
+    assert animation.frames[0].tile_data is not updates[0].frame.tile_data
+
+
+def test_progress_is_called_for_every_frame(animation, tiles, executor):
+    seen = []
+    result = asyncio.run(
+        aio.replace_tiles_async(
+            animation,
+            tiles,
+            cmp=comparisons.blas_distance,
+            executor=executor,
+            progress=lambda update: seen.append((update.index, update.done)),
+            batch_size=3,
+        )
+    )
+    assert [index for index, _ in seen] == list(range(N_FRAMES))
+    assert seen[-1][1] == 1
+    assert len(result.frames) == N_FRAMES
+    assert result.fps == animation.fps
+
+
+def test_cancelling_stops_after_the_batch_in_progress(animation, tiles, executor):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocking_comparator(image_blocks, tiles):
+        calls.append(image_blocks.shape[0])
+        started.set()
+        release.wait(10)
+        return comparisons.blas_distance(image_blocks, tiles)
+
+    seen = []
+
+    async def cancel_during_first_batch():
+        task = asyncio.ensure_future(
+            aio.replace_tiles_async(
+                animation,
+                tiles,
+                cmp=blocking_comparator,
+                executor=executor,
+                progress=seen.append,
+                batch_size=4,
+            )
+        )
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+        task.cancel()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_during_first_batch())
+    executor.shutdown(wait=True)
+    # one batch of four frames of six blocks, then nothing else was submitted
+    assert calls == [24]
+    assert not seen
+
+
+def test_set_executor_is_used_by_default(animation, tiles):
+    class CountingExecutor(futures.ThreadPoolExecutor):
+        submitted = 0
+
+        def submit(self, *args, **kwargs):
+            CountingExecutor.submitted += 1
+            return super().submit(*args, **kwargs)
+
+    with CountingExecutor(max_workers=1) as counting:
+        previous = aio.set_executor(counting)
+        try:
+            assert aio.get_executor() is counting
+            asyncio.run(
+                aio.replace_tiles_async(
+                    animation, tiles, cmp=comparisons.blas_distance, batch_size=4
+                )
+            )
+        finally:
+            assert aio.set_executor(previous) is counting
+    # one submission per batch of frames
+    assert CountingExecutor.submitted == 3
@@ -0,0 +1,63 @@
+import numpy as np
+
+from rusty_mosaic import ann
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+
+
+def test_ivf_comparator_keeps_one_index_per_library():
+    cmp = ann.IVFComparator(n_probe=1_000)
+    rng = np.random.default_rng(0)
+    for tile_size in (8, 4):
+        tiles = tile_library.TileLibrary.from_directory(tile_size=tile_size).tile_data
+        blocks = rng.integers(0, 256, (50, tiles.shape[1]), dtype=np.uint8)
+        np.testing.assert_array_equal(
+            cmp(blocks, tiles), comparisons.blas_distance(blocks, tiles)
+        )
+
+
+def test_ivf_comparator_rebuilds_for_reordered_tiles():
+    rng = np.random.default_rng(1)
+    tiles = rng.integers(0, 256, (64, 16), dtype=np.uint8)
+    blocks = rng.integers(0, 256, (200, 16), dtype=np.uint8)
+    cmp = ann.IVFComparator(n_probe=1)
+    cmp(blocks, tiles)
+    reordered = tiles[::-1].copy()
+    np.testing.assert_array_equal(
+        cmp(blocks, reordered), ann.IVFComparator(n_probe=1)(blocks, reordered)
+    )
+
+
+def test_importing_ann_registers_no_comparator():
+    assert "ivf_distance" not in comparisons.COMPARATORS
+
+
+def test_ivf_comparator_hashes_each_tile_array_once(monkeypatch):
+    hashed = []
+    fingerprint_array = ann.utils.fingerprint_array
+
+    def counting_fingerprint(data):
+        hashed.append(data)
+        return fingerprint_array(data)
+
+    monkeypatch.setattr(ann.utils, "fingerprint_array", counting_fingerprint)
+    rng = np.random.default_rng(2)
+    tiles = rng.integers(0, 256, (64, 16), dtype=np.uint8)
+    blocks = rng.integers(0, 256, (20, 16), dtype=np.uint8)
+    cmp = ann.IVFComparator(n_probe=1)
+    for _ in range(3):
+        cmp(blocks, tiles)
+    assert len(hashed) == 1
+    # an equal copy is hashed but shares the index
+    cmp(blocks, tiles.copy())
+    assert len(hashed) == 2
+    assert len(cmp._indexes) == 1
+    # a reshaped view of the same data is a different array
+    cmp(blocks.reshape(20, 4, 4), tiles.reshape(64, 4, 4))
+    assert len(hashed) == 3
+
+
+def test_ivf_comparator_without_blocks():
+    tiles = np.random.default_rng(3).integers(0, 256, (20, 8, 8), dtype=np.uint8)
+    best = ann.IVFComparator()(np.zeros((0, 8, 8), dtype=np.uint8), tiles)
+    assert best.shape == (0,)
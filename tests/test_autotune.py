@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from rusty_mosaic import autotune
+from rusty_mosaic import comparisons
+
+# the sum of absolute differences is a different distance, it is not expected to agree
+EXACT_COMPARATORS = [
+    name for name in comparisons.COMPARATORS if "sad" not in name.split("_")
+]
+
+
+def tied_problem(width: int = 16):
+    rng = np.random.default_rng(0)
+    # four levels make many tiles equally far from a block, and copies always tie
+    tiles = rng.integers(0, 4, (40, width), dtype=np.uint8)
+    tiles = np.concatenate([tiles, tiles[:10]])
+    blocks = rng.integers(0, 4, (300, width), dtype=np.uint8)
+    return blocks, tiles
+
+
+def highest_index_on_ties(image_blocks, tiles):
+    distances = (
+        (image_blocks[:, None, :].astype(np.int64) - tiles[None, :, :]) ** 2
+    ).sum(axis=2)
+    return (tiles.shape[0] - 1 - distances[:, ::-1].argmin(axis=1)).astype(np.uintp)
+
+
+@pytest.mark.parametrize("name", EXACT_COMPARATORS)
+@pytest.mark.parametrize("dtype", [np.uint8, np.int64])
+def test_comparators_agree_with_blas_distance_on_ties(name, dtype):
+    if name != "blas_distance" and not comparisons.RUST_AVAILABLE:
+        pytest.skip("needs the compiled extension")
+    blocks, tiles = tied_problem()
+    blocks, tiles = blocks.astype(dtype), tiles.astype(dtype)
+    np.testing.assert_array_equal(
+        comparisons.COMPARATORS[name](blocks, tiles),
+        comparisons.blas_distance(blocks, tiles),
+    )
+
+
+def test_blas_distance_picks_the_lowest_index_on_ties():
+    blocks, tiles = tied_problem()
+    distances = ((blocks[:, None, :].astype(np.int64) - tiles[None, :, :]) ** 2).sum(
+        axis=2
+    )
+    np.testing.assert_array_equal(
+        comparisons.blas_distance(blocks, tiles), distances.argmin(axis=1)
+    )
+
+
+def test_calibration_rejects_comparators_that_disagree(monkeypatch):
+    monkeypatch.setitem(comparisons.COMPARATORS, "ties_high", highest_index_on_ties)
+    monkeypatch.setattr(
+        autotune,
+        "candidates",
+        lambda u8, cores=None: [
+            autotune.Candidate("blas_distance"),
+            autotune.Candidate("ties_high"),
+        ],
+    )
+    blocks, tiles = tied_problem()
+    auto = autotune.AutoComparator(profile_path=None)
+    np.testing.assert_array_equal(
+        auto(blocks, tiles), comparisons.blas_distance(blocks, tiles)
+    )
+    decision = auto.last_decision
+    assert decision.comparator == "blas_distance"
+    assert decision.rejected == ["ties_high"]
+    assert list(decision.timings) == ["blas_distance"]
+    assert "rejected ties_high" in str(decision)
+
+
+def test_importing_autotune_registers_no_comparator():
+    assert "auto" not in comparisons.COMPARATORS
+
+
+def test_a_single_candidate_is_used_without_timing(monkeypatch):
+    monkeypatch.setattr(
+        autotune,
+        "candidates",
+        lambda u8, cores=None: [autotune.Candidate("blas_distance")],
+    )
+    blocks, tiles = tied_problem()
+    auto = autotune.AutoComparator(profile_path=None)
+    auto(blocks, tiles)
+    decision = auto.last_decision
+    assert (decision.comparator, decision.rejected, decision.measured) == (
+        "blas_distance",
+        [],
+        True,
+    )
+    assert str(decision).endswith("(calibrated now)")
+
+
+def test_no_blocks_skip_calibration():
+    auto = autotune.AutoComparator(profile_path=None)
+    best = auto(np.zeros((0, 8, 8), dtype=np.uint8), np.zeros((5, 8, 8), np.uint8))
+    assert best.shape == (0,)
+    assert auto.last_decision is None
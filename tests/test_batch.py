@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rusty_mosaic import batch
+
+
+def write_image(path):
+    pixmap = np.random.default_rng(0).integers(0, 256, (32, 32), dtype=np.uint8)
+    Image.fromarray(pixmap).save(path)
+
+
+def test_outputs_of_an_earlier_run_are_not_inputs(tmp_path):
+    for name in ("a.png", "b.png", "a-mosaic.png", "b-mosaic.png"):
+        write_image(tmp_path / name)
+    jobs = batch.make_jobs([tmp_path])
+    assert [job.infile.name for job in jobs] == ["a.png", "b.png"]
+    assert [job.outfile.name for job in jobs] == ["a-mosaic.png", "b-mosaic.png"]
+
+
+def test_jobs_writing_the_same_file_are_rejected(tmp_path):
+    for name in ("a.png", "b.png"):
+        write_image(tmp_path / name)
+    with pytest.raises(ValueError, match="would both be written"):
+        batch.make_jobs([tmp_path], str(tmp_path / "out.png"))
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        ({"infile": "a.png", "tile_sise": 4}, "line 2: unknown settings tile_sise"),
+        ({"tile_size": 4}, "line 2: missing infile"),
+        (["a.png"], "line 2: expected an object"),
+    ],
+)
+def test_invalid_manifest_entries_name_the_line(tmp_path, line, error):
+    manifest = tmp_path / "inputs.jsonl"
+    manifest.write_text(json.dumps({"infile": "b.png"}) + "\n" + json.dumps(line))
+    with pytest.raises(ValueError, match=error) as raised:
+        batch.make_jobs([manifest])
+    assert str(manifest) in str(raised.value)
+
+
+def test_manifest_entries_override_defaults(tmp_path):
+    manifest = tmp_path / "inputs.jsonl"
+    manifest.write_text(
+        "# comments and blank lines are skipped\n\n"
+        + json.dumps({"infile": "a.png", "mode": "RGB", "text": True})
+    )
+    (job,) = batch.make_jobs([manifest], tile_size=16)
+    assert job.infile == tmp_path / "a.png"
+    assert job.outfile == tmp_path / "a-mosaic.txt"
+    assert (job.image_type, job.text, job.tile_size) == ("RGB", True, 16)
+
+
+def test_run_batch_makes_every_mosaic(tmp_path):
+    for name in ("a.png", "b.png"):
+        write_image(tmp_path / name)
+    results = batch.run_batch(batch.make_jobs([tmp_path]), workers=2)
+    assert all(result.ok for result in results)
+    for name in ("a-mosaic.png", "b-mosaic.png"):
+        with Image.open(tmp_path / name) as image:
+            assert image.size == (32, 32)
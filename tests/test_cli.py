@@ -0,0 +1,43 @@
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+from typer.testing import CliRunner
+
+from rusty_mosaic import cli
+
+OPTIONS = ["--outfile", "out.png", "--comparator", "blas_distance", "--no-cache"]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    pixels = np.random.default_rng(0).integers(0, 256, (32, 32), dtype=np.uint8)
+    Image.fromarray(pixels).save(tmp_path / "source.png")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("name", ["render", "batch", "serve"])
+def test_existing_file_named_like_a_command_is_an_input(workdir, name):
+    shutil.copy(workdir / "source.png", workdir / name)
+
+    result = CliRunner().invoke(cli.app, [name, *OPTIONS])
+
+    assert result.exit_code == 0, result.output
+    assert (workdir / "out.png").exists()
+
+
+@pytest.mark.parametrize("args", [["main", "source.png"], ["source.png"]])
+def test_main_is_the_default_command(workdir, args):
+    result = CliRunner().invoke(cli.app, [*args, *OPTIONS])
+
+    assert result.exit_code == 0, result.output
+    assert (workdir / "out.png").exists()
+
+
+def test_commands_still_run_when_no_such_file_exists(workdir):
+    result = CliRunner().invoke(cli.app, ["render", "--help"])
+
+    assert result.exit_code == 0, result.output
+    assert "Render a mosaic saved with --record" in result.output
@@ -0,0 +1,45 @@
+import numpy as np
+
+from rusty_mosaic import comparisons
+
+
+def test_memoized_comparator_ignores_results_for_replaced_tiles():
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 256, (8, 16), dtype=np.uint8)
+    old_tiles = rng.integers(0, 256, (5, 16), dtype=np.uint8)
+    new_tiles = old_tiles[::-1].copy()
+    memo = comparisons.MemoizedComparator(cmp=comparisons.blas_distance)
+
+    def switching_comparator(image_blocks, tiles):
+        # another caller switches tiles while the first call is still matching
+        if tiles is old_tiles:
+            memo(blocks, new_tiles)
+        return comparisons.blas_distance(image_blocks, tiles)
+
+    memo.cmp = switching_comparator
+    memo(blocks, old_tiles)
+    memo.cmp = comparisons.blas_distance
+    np.testing.assert_array_equal(
+        memo(blocks, new_tiles), comparisons.blas_distance(blocks, new_tiles)
+    )
+
+
+def test_flatten_rows_keeps_the_width_without_rows():
+    assert comparisons.flatten_rows(np.zeros((0, 8, 8, 3))).shape == (0, 192)
+    assert comparisons.flatten_rows(np.zeros((2, 4, 4))).shape == (2, 16)
+    assert comparisons.flatten_rows(np.zeros((3,))).shape == (3, 1)
+
+
+def test_blas_distance_without_blocks_or_tiles():
+    blocks = np.zeros((0, 8, 8), dtype=np.uint8)
+    tiles = np.zeros((5, 8, 8), dtype=np.uint8)
+    assert comparisons.blas_distance(blocks, tiles).shape == (0,)
+    assert comparisons.blas_distance(tiles, blocks).tolist() == [0] * 5
+
+
+def test_memoized_comparator_without_blocks():
+    memo = comparisons.MemoizedComparator(cmp=comparisons.blas_distance)
+    tiles = np.zeros((5, 8, 8), dtype=np.uint8)
+    best = memo(np.zeros((0, 8, 8), dtype=np.uint8), tiles)
+    assert best.shape == (0,)
+    assert memo.cache_info().misses == 0
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from rusty_mosaic import comparisons
+
+_lib = pytest.importorskip(
+    "rusty_mosaic._lib", reason="needs the compiled extension, run maturin develop"
+)
+
+BUFFER_KERNELS = [
+    ("find_best_tiles_buffer_u8", np.uint8, ()),
+    ("find_best_tiles_buffer_i32", np.int32, ()),
+    ("find_best_tiles_buffer_f64", np.float64, ()),
+    ("find_best_tiles_blocked_u8", np.uint8, (False,)),
+    ("find_best_tiles_pruned_u8", np.uint8, (16,)),
+]
+
+
+def tied_problem(width: int = 48):
+    rng = np.random.default_rng(0)
+    tiles = rng.integers(0, 4, (60, width), dtype=np.uint8)
+    tiles = np.concatenate([tiles, tiles[:20]])
+    blocks = rng.integers(0, 4, (500, width), dtype=np.uint8)
+    return blocks, tiles
+
+
+@pytest.mark.parametrize("name, dtype, options", BUFFER_KERNELS)
+@pytest.mark.parametrize("parallel, threads", [(False, 0), (True, 0), (True, 3)])
+def test_kernels_agree_with_blas_distance(name, dtype, options, parallel, threads):
+    blocks, tiles = tied_problem()
+    best = getattr(_lib, name)(
+        blocks.astype(dtype), tiles.astype(dtype), *options, parallel, threads
+    )
+    assert best.dtype == np.uintp
+    np.testing.assert_array_equal(best, comparisons.blas_distance(blocks, tiles))
+
+
+@pytest.mark.parametrize("name, dtype, options", BUFFER_KERNELS)
+def test_kernels_reject_mismatched_widths(name, dtype, options):
+    blocks, tiles = tied_problem()
+    with pytest.raises(ValueError, match="values but tiles have"):
+        getattr(_lib, name)(blocks[:, :8].astype(dtype), tiles.astype(dtype), *options)
+
+
+def test_kernels_reject_non_contiguous_buffers():
+    blocks, tiles = tied_problem()
+    with pytest.raises(Exception):
+        _lib.find_best_tiles_buffer_u8(blocks[:, ::2], tiles[:, ::2])
+
+
+def test_list_kernels_agree_with_buffer_kernels():
+    blocks, tiles = tied_problem(16)
+    expected = comparisons.blas_distance(blocks, tiles)
+    as_lists = blocks.astype(int).tolist(), tiles.astype(int).tolist()
+    assert _lib.find_best_tiles_i32(*as_lists) == expected.tolist()
+    assert _lib.parallel_find_best_tiles_i32(*as_lists, threads=2) == expected.tolist()
+    as_floats = blocks.astype(float).tolist(), tiles.astype(float).tolist()
+    assert _lib.find_best_tiles_f64(*as_floats) == expected.tolist()
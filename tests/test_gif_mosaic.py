@@ -0,0 +1,83 @@
+import imageio.v3 as iio
+import numpy as np
+import pytest
+
+from rusty_mosaic import comparisons
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic import gif_mosaic
+
+N_FRAMES = 7
+
+
+@pytest.fixture
+def tiles():
+    data = np.random.default_rng(0).integers(0, 256, (20, 64), dtype=np.uint8)
+    return tile_library.TileLibrary(tile_size=8, tile_data=data)
+
+
+@pytest.fixture
+def source(tmp_path):
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 256, (N_FRAMES, 16, 24, 3), dtype=np.uint8)
+    # nearly repeat a frame so temporal matching has blocks to reuse
+    frames[3] = frames[2] ^ 1
+    path = tmp_path / "source.gif"
+    iio.imwrite(path, frames, extension=".gif", duration=100, loop=0)
+    return path
+
+
+def eager(source, outfile, tiles, threshold=None):
+    animation = gif_mosaic.GifMosaic.load(source, tile_size=8)
+    animation = animation.replace_tiles(
+        tiles, cmp=comparisons.blas_distance, threshold=threshold, lazy=True
+    )
+    animation.save(outfile)
+    return animation
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, N_FRAMES + 1])
+def test_stream_matches_eager(source, tiles, tmp_path, batch_size):
+    eager(source, tmp_path / "eager.gif", tiles)
+
+    stats = gif_mosaic.GifMosaic.stream(
+        source,
+        tmp_path / "stream.gif",
+        tiles,
+        tile_size=8,
+        cmp=comparisons.blas_distance,
+        batch_size=batch_size,
+    )
+
+    assert stats == []
+    expected = iio.imread(tmp_path / "eager.gif")
+    actual = iio.imread(tmp_path / "stream.gif")
+    assert actual.shape[0] == N_FRAMES
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_stream_with_threshold_matches_eager(source, tiles, tmp_path):
+    animation = eager(source, tmp_path / "eager.gif", tiles, threshold=100.0)
+
+    stats = gif_mosaic.GifMosaic.stream(
+        source,
+        tmp_path / "stream.gif",
+        tiles,
+        tile_size=8,
+        cmp=comparisons.blas_distance,
+        batch_size=2,
+        threshold=100.0,
+    )
+
+    assert stats == animation.match_stats
+    assert stats[3].reused > 0
+    np.testing.assert_array_equal(
+        iio.imread(tmp_path / "stream.gif"), iio.imread(tmp_path / "eager.gif")
+    )
+
+
+def test_stream_keeps_the_frame_rate(source, tiles, tmp_path):
+    gif_mosaic.GifMosaic.stream(source, tmp_path / "stream.gif", tiles, tile_size=8)
+
+    assert gif_mosaic.GifMosaic.frames_per_second(
+        tmp_path / "stream.gif", N_FRAMES
+    ) == gif_mosaic.GifMosaic.frames_per_second(source, N_FRAMES)
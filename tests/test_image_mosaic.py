@@ -0,0 +1,225 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic import gif_mosaic
+from rusty_mosaic.mosaic import image_mosaic
+
+ImageMosaic = image_mosaic.ImageMosaic
+
+
+def split_blocks(data, tile_size):
+    """The per-tile split the reshapes replaced"""
+    height, width, channels = [*data.shape, 1][:3]
+    rows = height // tile_size
+    cols = width // tile_size
+    return np.asarray(
+        [np.split(row, cols, axis=1) for row in np.split(data, rows)]
+    ).reshape(rows * cols, tile_size * tile_size * channels)
+
+
+def join_blocks(blocks, tile_size, rows):
+    """The per-tile concatenation the reshapes replaced"""
+    channels = int(blocks.shape[1] / (tile_size * tile_size))
+    if channels == 1:
+        blocks = blocks.reshape(rows, -1, tile_size, tile_size)
+    else:
+        blocks = blocks.reshape(rows, -1, tile_size, tile_size, channels)
+    return np.concatenate(
+        [np.concatenate(block, axis=1) for block in blocks], axis=0
+    ).astype(np.uint8)
+
+
+def pixmap(shape, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+SHAPES = [(24, 32), (24, 32, 3), (8, 8), (8, 8, 3)]
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_array_to_blocks_matches_split(shape):
+    data = pixmap(shape)
+
+    blocks = ImageMosaic._array_to_blocks(data, 8)
+
+    np.testing.assert_array_equal(blocks, split_blocks(data, 8))
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_array_to_blocks_into_out(shape):
+    data = pixmap(shape)
+    expected = split_blocks(data, 8)
+    out = np.zeros_like(expected)
+
+    blocks = ImageMosaic._array_to_blocks(data, 8, out=out)
+
+    assert blocks is out
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_array_to_blocks_ignores_trailing_pixels():
+    data = pixmap((27, 35, 3))
+
+    blocks = ImageMosaic._array_to_blocks(data, 8)
+
+    np.testing.assert_array_equal(blocks, split_blocks(data[:24, :32], 8))
+
+
+def test_array_to_blocks_rejects_non_contiguous_out():
+    data = pixmap((16, 16))
+    out = np.zeros((4, 128), dtype=np.uint8)[:, ::2]
+
+    with pytest.raises(ValueError):
+        ImageMosaic._array_to_blocks(data, 8, out=out)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_blocks_to_pixmap_matches_concatenate(shape):
+    blocks = split_blocks(pixmap(shape), 8)
+    rows = shape[0] // 8
+
+    np.testing.assert_array_equal(
+        ImageMosaic._blocks_to_pixmap(blocks, 8, rows), join_blocks(blocks, 8, rows)
+    )
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_blocks_to_pixmap_into_out(shape):
+    blocks = split_blocks(pixmap(shape), 8)
+    out = np.zeros(shape, dtype=np.uint8)
+
+    result = ImageMosaic._blocks_to_pixmap(blocks, 8, shape[0] // 8, out=out)
+
+    assert result is out
+    np.testing.assert_array_equal(out, join_blocks(blocks, 8, shape[0] // 8))
+
+
+def test_blocks_to_pixmap_rejects_wrong_out_shape():
+    blocks = split_blocks(pixmap((16, 16)), 8)
+
+    with pytest.raises(ValueError):
+        ImageMosaic._blocks_to_pixmap(
+            blocks, 8, 2, out=np.zeros((16, 8), dtype=np.uint8)
+        )
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_round_trip(shape):
+    data = pixmap(shape)
+
+    blocks = ImageMosaic._array_to_blocks(data, 8)
+
+    np.testing.assert_array_equal(
+        ImageMosaic._blocks_to_pixmap(blocks, 8, shape[0] // 8), data
+    )
+
+
+def test_round_trip_through_buffers():
+    data = pixmap((24, 32, 3))
+    blocks = np.empty((12, 8 * 8 * 3), dtype=np.uint8)
+    out = np.empty_like(data)
+
+    ImageMosaic._array_to_blocks(data, 8, out=blocks)
+    ImageMosaic._blocks_to_pixmap(blocks, 8, 3, out=out)
+
+    np.testing.assert_array_equal(out, data)
+
+
+def tile_library_of(tile_size, channels=1, n_tiles=10, seed=1):
+    data = pixmap((n_tiles, tile_size * tile_size * channels), seed=seed)
+    return tile_library.TileLibrary(tile_size=tile_size, tile_data=data)
+
+
+@pytest.fixture(params=[(24, 32), (24, 32, 3)], ids=["L", "RGB"])
+def matched(request):
+    shape = request.param
+    source = ImageMosaic(
+        ImageMosaic._array_to_blocks(pixmap(shape), 8), tile_size=8, rows=3
+    )
+    tiles = tile_library_of(8, channels=[*shape, 1][2])
+    best = np.random.default_rng(2).integers(0, 10, 12)
+    return (
+        source.apply_tiles(tiles, best),
+        source.apply_tiles(tiles, best, lazy=True),
+    )
+
+
+def test_lazy_mosaic_keeps_indices(matched):
+    eager, lazy = matched
+
+    assert lazy.tile_data is None
+    assert lazy.tile_indices is not None
+    assert eager.tile_indices is None
+    assert lazy.shape == eager.shape
+
+
+def test_lazy_render_matches_eager(matched):
+    eager, lazy = matched
+
+    np.testing.assert_array_equal(lazy.render(), eager.render())
+    np.testing.assert_array_equal(lazy.pixmap, eager.pixmap)
+    np.testing.assert_array_equal(np.asarray(lazy.image), np.asarray(eager.image))
+    np.testing.assert_array_equal(lazy.blocks, eager.blocks)
+
+
+def test_lazy_render_into_out(matched):
+    eager, lazy = matched
+    out = np.zeros(lazy.shape, dtype=np.uint8)
+
+    assert lazy.render(out=out) is out
+    np.testing.assert_array_equal(out, eager.render())
+
+
+def test_lazy_render_rejects_wrong_out_shape(matched):
+    _, lazy = matched
+
+    with pytest.raises(ValueError):
+        lazy.render(out=np.zeros((8, 8), dtype=np.uint8))
+
+
+def test_lazy_save_matches_eager(matched, tmp_path):
+    eager, lazy = matched
+    eager.save(tmp_path / "eager.png")
+    lazy.save(tmp_path / "lazy.png")
+
+    with Image.open(tmp_path / "eager.png") as expected:
+        with Image.open(tmp_path / "lazy.png") as actual:
+            np.testing.assert_array_equal(np.asarray(actual), np.asarray(expected))
+
+
+def test_lazy_replace_tiles_matches_eager():
+    source = ImageMosaic(
+        ImageMosaic._array_to_blocks(pixmap((24, 32)), 8), tile_size=8, rows=3
+    )
+    tiles = tile_library_of(8)
+
+    eager = source.replace_tiles(tiles)
+    lazy = source.replace_tiles(tiles, lazy=True)
+
+    np.testing.assert_array_equal(lazy.render(), eager.render())
+    # the lazy mosaic's blocks can be matched again
+    np.testing.assert_array_equal(
+        lazy.replace_tiles(tiles).render(), eager.replace_tiles(tiles).render()
+    )
+
+
+def test_gif_lazy_tile_data_matches_eager():
+    tiles = tile_library_of(8)
+    frames = [
+        ImageMosaic(
+            ImageMosaic._array_to_blocks(pixmap((16, 24), seed=seed), 8),
+            tile_size=8,
+            rows=2,
+        )
+        for seed in range(4)
+    ]
+    animation = gif_mosaic.GifMosaic(frames, fps=10)
+
+    eager = animation.replace_tiles(tiles)
+    lazy = animation.replace_tiles(tiles, lazy=True)
+
+    assert lazy.tiles is tiles
+    assert eager.tiles is None
+    np.testing.assert_array_equal(lazy.tile_data, eager.tile_data)
@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import pathlib
+import subprocess
+
+import pytest
+
+PYTHON_SOURCE = pathlib.Path(__file__).resolve().parent.parent / "python"
+# generous enough for a loaded CI machine, tight enough to catch an eager NumPy import
+IMPORT_BUDGET_MS = 200
+HELP_BUDGET_MS = 700
+RUNS = 3
+
+MEASURE = """
+import sys, json, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], "<scenario>", "exec"))
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, sorted(sys.modules)]))
+"""
+
+HELP = """
+import io, contextlib
+from rusty_mosaic import cli
+with contextlib.redirect_stdout(io.StringIO()):
+    cli.app(["--help"], standalone_mode=False)
+"""
+
+
+def measure(code: str):
+    """The fastest of RUNS fresh interpreters running code, in ms, and the modules it loaded"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(PYTHON_SOURCE), env.get("PYTHONPATH")])
+    )
+    runs = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE, code],
+            check=True,
+            capture_output=True,
+            text=True,
+            env=env,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return min(seconds for seconds, _ in runs) * 1000, set(runs[0][1])
+
+
+@pytest.mark.parametrize(
+    "code, budget_ms, forbidden",
+    [
+        (
+            "import rusty_mosaic",
+            IMPORT_BUDGET_MS,
+            ("typer", "numpy", "PIL", "imageio", "rusty_mosaic._lib"),
+        ),
+        (
+            HELP,
+            HELP_BUDGET_MS,
+            ("numpy", "PIL", "imageio", "rusty_mosaic._lib"),
+        ),
+    ],
+    ids=["import rusty_mosaic", "mosaicfy --help"],
+)
+def test_startup_stays_lazy_and_within_budget(code, budget_ms, forbidden):
+    milliseconds, modules = measure(code)
+    assert not [module for module in forbidden if module in modules]
+    assert milliseconds <= budget_ms
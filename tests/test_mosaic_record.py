@@ -0,0 +1,78 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from rusty_mosaic import mosaic
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic import mosaic_record
+
+
+@pytest.mark.parametrize("bits", [1, 3, 7, 8, 13, 16, 24, 32])
+def test_pack_indices_round_trip(bits, monkeypatch):
+    # small chunks so every width also crosses chunk boundaries
+    monkeypatch.setattr(mosaic_record, "PACK_CHUNK", 7)
+    indices = np.random.default_rng(bits).integers(0, 2**bits, 100, dtype=np.uint64)
+    packed = mosaic_record.pack_indices(indices, bits)
+    assert len(packed) == (100 * bits + 7) // 8
+    np.testing.assert_array_equal(
+        mosaic_record.unpack_indices(packed, bits, indices.size), indices
+    )
+
+
+def test_pack_indices_empty():
+    assert mosaic_record.pack_indices(np.array([], dtype=np.uintp), 5) == b""
+    assert mosaic_record.unpack_indices(b"", 5, 0).size == 0
+
+
+def test_index_bits():
+    assert [mosaic_record.index_bits(n) for n in (1, 2, 3, 92, 256, 257)] == [
+        1,
+        1,
+        2,
+        7,
+        8,
+        9,
+    ]
+
+
+def make_record(tiles):
+    pixmap = np.random.default_rng(0).integers(0, 256, (32, 48), dtype=np.uint8)
+    image_mosaic = mosaic.ImageMosaic(
+        mosaic.ImageMosaic._array_to_blocks(pixmap, tiles.tile_size),
+        tiles.tile_size,
+        32 // tiles.tile_size,
+    )
+    image_mosaic.replace_tiles(tiles, inplace=True, lazy=True)
+    return mosaic.MosaicRecord.from_mosaic(image_mosaic, tiles)
+
+
+def test_record_renders_at_another_tile_size(tmp_path):
+    record = make_record(tile_library.TileLibrary.from_directory(tile_size=8))
+    record.save(tmp_path / "poe.rmosaic")
+    loaded = mosaic.MosaicRecord.load(tmp_path / "poe.rmosaic")
+    assert loaded.tile_set == record.tile_set is not None
+    np.testing.assert_array_equal(loaded.tile_indices, record.tile_indices)
+
+    rendered = loaded.render(tile_library.TileLibrary.from_directory(tile_size=4))
+    assert rendered.shape[:2] == (16, 24)
+
+
+def test_record_rejects_other_tiles_with_the_same_count(tmp_path):
+    record = make_record(tile_library.TileLibrary.from_directory(tile_size=8))
+    for tile in sorted(tile_library.ASCII_TILES.iterdir()):
+        shutil.copy(tile, tmp_path / f"other-{tile.name}")
+    others = tile_library.TileLibrary.from_directory(tmp_path, tile_size=4)
+    assert others.tile_data.shape[0] == record.n_tiles
+
+    with pytest.raises(ValueError, match="other tiles"):
+        record.render(others)
+
+
+def test_record_without_tile_set_only_renders_at_its_tile_size():
+    tiles = tile_library.TileLibrary.from_directory(tile_size=8)
+    record = make_record(tiles)
+    record.tile_set = None
+    record.render(tiles)
+    with pytest.raises(ValueError, match="render it at tile size 8"):
+        record.render(tile_library.TileLibrary.from_directory(tile_size=4))
@@ -0,0 +1,153 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+from typer.testing import CliRunner
+
+from rusty_mosaic import cli
+from rusty_mosaic import comparisons
+from rusty_mosaic import profiling
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic import image_mosaic
+
+
+@pytest.fixture(autouse=True)
+def disabled():
+    profiling.disable()
+    yield
+    profiling.disable()
+
+
+@pytest.fixture
+def tiles():
+    data = np.random.default_rng(0).integers(0, 256, (20, 64), dtype=np.uint8)
+    return tile_library.TileLibrary(tile_size=8, tile_data=data)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.png"
+    pixels = np.random.default_rng(1).integers(0, 256, (32, 48), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+    return path
+
+
+def test_disabled_helpers_share_a_no_op_context():
+    assert profiling.stage("match") is profiling.stage("encode")
+    assert profiling.frame(0) is profiling.stage("match")
+    with profiling.frame(1), profiling.stage("match"):
+        pass
+    assert profiling.active() is None
+
+
+def test_stages_are_recorded_with_their_frame():
+    profiler = profiling.enable()
+    with profiling.stage("decode"):
+        pass
+    with profiling.frame(3):
+        with profiling.stage("match"):
+            with profiling.stage("render", frame=5):
+                pass
+
+    assert profiling.disable() is profiler
+    assert [(sample.stage, sample.frame) for sample in profiler.samples] == [
+        ("decode", None),
+        ("render", 5),
+        ("match", 3),
+    ]
+    assert all(sample.seconds >= 0 for sample in profiler.samples)
+    with profiling.stage("encode"):
+        pass
+    assert len(profiler.samples) == 3
+
+
+def test_frames_do_not_leak_across_threads():
+    profiler = profiling.enable()
+
+    def work():
+        with profiling.stage("match"):
+            pass
+
+    with profiling.frame(2):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+    assert [sample.frame for sample in profiler.samples] == [None]
+
+
+def test_a_failing_stage_is_still_recorded():
+    profiler = profiling.enable()
+
+    with pytest.raises(RuntimeError):
+        with profiling.stage("match"):
+            raise RuntimeError("boom")
+
+    assert [sample.stage for sample in profiler.samples] == ["match"]
+
+
+def test_hooks_see_every_sample():
+    seen = []
+    profiler = profiling.enable(profiling.Profiler(hooks=[seen.append]))
+    with profiling.stage("match"):
+        pass
+
+    assert seen == profiler.samples
+
+
+def test_summary_totals_each_stage():
+    profiler = profiling.enable()
+    for _ in range(3):
+        with profiling.stage("match"):
+            pass
+    with profiling.stage("encode"):
+        pass
+
+    summary = profiler.summary()
+    assert {stage: totals["calls"] for stage, totals in summary.items()} == {
+        "match": 3,
+        "encode": 1,
+    }
+    assert summary["match"]["seconds"] == pytest.approx(
+        sum(s.seconds for s in profiler.samples if s.stage == "match")
+    )
+
+
+def test_profiling_does_not_change_the_mosaic(source, tiles):
+    def build():
+        mosaic = image_mosaic.ImageMosaic.load(source, tile_size=8)
+        return mosaic.replace_tiles(tiles, cmp=comparisons.blas_distance).render()
+
+    expected = build()
+    profiler = profiling.enable()
+    actual = build()
+
+    np.testing.assert_array_equal(actual, expected)
+    stages = {sample.stage for sample in profiler.samples}
+    assert {"decode", "crop_tile", "to_blocks", "match", "render"} <= stages
+
+
+def test_cli_writes_the_report(source, tmp_path):
+    report = tmp_path / "profile.json"
+
+    result = CliRunner().invoke(
+        cli.app,
+        [
+            str(source),
+            "--outfile",
+            str(tmp_path / "out.png"),
+            "--comparator",
+            "blas_distance",
+            "--no-cache",
+            "--profile",
+            str(report),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    data = json.loads(report.read_text())
+    assert {"seconds", "peak_rss", "stages", "samples"} <= set(data)
+    assert "match" in data["stages"]
+    assert profiling.active() is None
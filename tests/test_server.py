@@ -0,0 +1,131 @@
+import io
+import json
+import threading
+import http.client
+
+import numpy as np
+import pytest
+import imageio.v3 as iio
+from PIL import Image
+
+from rusty_mosaic import ann
+from rusty_mosaic import server
+
+
+def png_bytes(size: int = 32) -> bytes:
+    pixmap = np.random.default_rng(0).integers(0, 256, (size, size), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixmap).save(output, format="PNG")
+    return output.getvalue()
+
+
+def gif_bytes(n_frames: int = 4, size: int = 16) -> bytes:
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (n_frames, size, size, 3), dtype=np.uint8)
+    return iio.imwrite("<bytes>", frames, extension=".gif", duration=100, loop=0)
+
+
+def test_service_builds_a_comparator_per_library():
+    built = []
+
+    def comparator_for(tiles):
+        built.append(tiles)
+        return ann.IVFComparator(index=tiles.ivf_index())
+
+    service = server.MosaicService(comparator_for=comparator_for, tile_sizes=(8, 4))
+    try:
+        for tile_size in (8, 4, 8):
+            content_type, body = service.render(
+                png_bytes(), server.MosaicRequest(tile_size=tile_size)
+            )
+            assert content_type == "image/png"
+            with Image.open(io.BytesIO(body)) as image:
+                assert image.size == (32, 32)
+    finally:
+        service.close()
+    assert [tiles.tile_size for tiles in built] == [8, 4]
+    assert len(service.comparators) == 2
+
+
+@pytest.mark.parametrize(
+    "request_",
+    [
+        server.MosaicRequest(tile_size=16),
+        server.MosaicRequest(scale=0),
+        server.MosaicRequest(scale=float("nan")),
+        server.MosaicRequest(scale=100),
+        server.MosaicRequest(image_type="CMYK"),
+        server.MosaicRequest(library="missing"),
+    ],
+)
+def test_service_rejects_requests_out_of_range(request_):
+    service = server.MosaicService()
+    try:
+        with pytest.raises(ValueError):
+            service.render(png_bytes(), request_)
+    finally:
+        service.close()
+    assert len(service.pool) == 0
+
+
+def test_service_rejects_too_many_pixels():
+    service = server.MosaicService(max_pixels=1000)
+    try:
+        with pytest.raises(ValueError, match="limit is 1000"):
+            service.render(png_bytes(), server.MosaicRequest())
+    finally:
+        service.close()
+
+
+def test_service_rejects_large_uploads_scaled_down():
+    service = server.MosaicService(max_pixels=1000)
+    try:
+        # the 16 x 16 mosaic is small, but the 64 x 64 upload is not
+        with pytest.raises(ValueError, match="upload would have 4096 pixels"):
+            service.render(png_bytes(64), server.MosaicRequest(scale=0.25))
+    finally:
+        service.close()
+
+
+def test_service_counts_every_gif_frame():
+    service = server.MosaicService(max_pixels=1000)
+    try:
+        with pytest.raises(ValueError, match="upload would have 1280 pixels"):
+            service.render(
+                gif_bytes(n_frames=5), server.MosaicRequest(scale=0.5, tile_size=8)
+            )
+    finally:
+        service.close()
+
+
+def test_service_decodes_gif_frames_one_at_a_time(monkeypatch):
+    def imread(*args, **kwargs):
+        raise AssertionError("GIFs should be decoded with imiter")
+
+    monkeypatch.setattr(server.iio, "imread", imread)
+    service = server.MosaicService()
+    try:
+        content_type, body = service.render(gif_bytes(), server.MosaicRequest())
+    finally:
+        service.close()
+    monkeypatch.undo()
+    assert content_type == "image/gif"
+    assert iio.imread(body, extension=".gif").shape[:3] == (4, 16, 16)
+
+
+def test_server_rejects_large_bodies():
+    service = server.MosaicService(max_body=100)
+    httpd = server.make_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        connection = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+        connection.request("POST", "/mosaic", body=png_bytes())
+        response = connection.getresponse()
+        assert response.status == 413
+        assert response.getheader("Connection") == "close"
+        assert "100 bytes" in json.loads(response.read())["error"]
+        connection.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,63 @@
+import numpy as np
+
+from rusty_mosaic import comparisons
+from rusty_mosaic import temporal
+
+
+def frames_and_tiles():
+    rng = np.random.default_rng(0)
+    tiles = rng.integers(0, 256, (32, 16), dtype=np.uint8)
+    first = rng.integers(0, 256, (20, 16), dtype=np.uint8)
+    second = first.copy()
+    second[[2, 7]] = rng.integers(0, 256, (2, 16), dtype=np.uint8)
+    return [first, first.copy(), second], tiles
+
+
+def test_exact_threshold_matches_every_frame_in_full():
+    frames, tiles = frames_and_tiles()
+    matcher = temporal.TemporalMatcher(cmp=comparisons.blas_distance)
+    for frame, best in zip(frames, matcher.match(frames, tiles)):
+        np.testing.assert_array_equal(best, comparisons.blas_distance(frame, tiles))
+    assert [stats.rematched for stats in matcher.stats] == [20, 0, 2]
+
+
+def test_frames_can_be_matched_in_batches():
+    frames, tiles = frames_and_tiles()
+    whole = temporal.TemporalMatcher(cmp=comparisons.blas_distance)
+    batched = temporal.TemporalMatcher(cmp=comparisons.blas_distance)
+    expected = whole.match(frames, tiles)
+    result = batched.match(frames[:1], tiles) + batched.match(frames[1:], tiles)
+    for best, want in zip(result, expected):
+        np.testing.assert_array_equal(best, want)
+    assert batched.stats == whole.stats
+
+
+def test_slow_drift_is_rematched_against_the_last_matched_pixels():
+    tiles = np.array([[0] * 4, [40] * 4], dtype=np.uint8)
+    frames = [np.full((1, 4), value, dtype=np.uint8) for value in (0, 5, 10, 15, 30)]
+    matcher = temporal.TemporalMatcher(threshold=100, cmp=comparisons.blas_distance)
+    best = matcher.match(frames, tiles)
+    # each step differs by 25 from the previous frame, but 15 differs by 225 from 0
+    assert [stats.rematched for stats in matcher.stats] == [1, 0, 0, 1, 1]
+    assert [int(frame_best[0]) for frame_best in best] == [0, 0, 0, 0, 1]
+
+
+def test_new_tiles_reset_the_matcher():
+    frames, tiles = frames_and_tiles()
+    matcher = temporal.TemporalMatcher(cmp=comparisons.blas_distance)
+    matcher.match(frames, tiles)
+    other = tiles[::-1].copy()
+    (best,) = matcher.match(frames[-1:], other)
+    np.testing.assert_array_equal(best, comparisons.blas_distance(frames[-1], other))
+    assert [stats.rematched for stats in matcher.stats] == [20]
+
+
+def test_large_rgb_tiles_do_not_overflow_the_error():
+    # 128 x 128 RGB blocks sum to 49152 * 255**2 squared differences, past int32
+    values = 128 * 128 * 3
+    tiles = np.array([[0] * values, [255] * values], dtype=np.uint8)
+    frames = [np.full((1, values), value, dtype=np.uint8) for value in (0, 255)]
+    matcher = temporal.TemporalMatcher(threshold=100, cmp=comparisons.blas_distance)
+    best = matcher.match(frames, tiles)
+    assert [int(frame_best[0]) for frame_best in best] == [0, 1]
+    assert [stats.rematched for stats in matcher.stats] == [1, 1]
@@ -0,0 +1,217 @@
+import io
+import re
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rusty_mosaic import terminal
+from rusty_mosaic import tile_library
+from rusty_mosaic.mosaic import text_mosaic
+
+ESCAPE = re.compile(r"\x1b\[(\?25[lh]|2J|H|(\d+);(\d+)H)")
+
+
+class Screen:
+    """Just enough of an ANSI terminal to replay what the player writes"""
+
+    def __init__(self, rows, cols):
+        self.cells = np.full((rows, cols), "?")
+        self.row = self.col = 0
+
+    def feed(self, output):
+        position = 0
+        for match in ESCAPE.finditer(output):
+            self._print(output[position : match.start()])
+            position = match.end()
+            if match.group(1) == "2J":
+                self.cells[...] = " "
+            elif match.group(1) == "H":
+                self.row = self.col = 0
+            elif match.group(2):
+                self.row, self.col = int(match.group(2)) - 1, int(match.group(3)) - 1
+        self._print(output[position:])
+
+    def _print(self, text):
+        for character in text:
+            if character == "\n":
+                self.row, self.col = self.row + 1, 0
+                continue
+            self.cells[self.row, self.col] = character
+            self.col += 1
+
+
+def random_grid(shape, seed=0, characters="abc .#"):
+    rng = np.random.default_rng(seed)
+    return np.asarray(list(characters))[rng.integers(0, len(characters), shape)]
+
+
+def old_text(mosaic):
+    return "\n".join(
+        "".join(row) for row in mosaic.tile_data.reshape(mosaic.image_mosaic.rows, -1)
+    )
+
+
+def tiles_of(n_tiles):
+    return tile_library.TileLibrary(
+        tile_size=8, tile_data=np.zeros((n_tiles, 64), dtype=np.uint8)
+    )
+
+
+@pytest.fixture
+def matched():
+    pixels = np.random.default_rng(0).integers(0, 256, (24, 40), dtype=np.uint8)
+    mosaic = text_mosaic.TextMosaic.from_image(Image.fromarray(pixels), 8)
+    best = np.random.default_rng(1).integers(0, 4, mosaic.tile_data.size)
+    return mosaic, best
+
+
+@pytest.mark.parametrize(
+    "text_map",
+    [text_mosaic.ASCII_TILE_TEXT_MAP, np.asarray(list("░▒▓█")), np.asarray(list("ab"))],
+    ids=["ascii", "unicode", "short"],
+)
+def test_text_matches_joined_rows(matched, text_map):
+    mosaic, best = matched
+    mosaic = text_mosaic.TextMosaic(mosaic.tile_data, text_map, mosaic.image_mosaic)
+    n_tiles = min(text_map.size, 4)
+
+    result = mosaic.apply_tiles(tiles_of(n_tiles), best % n_tiles)
+
+    assert result.text == old_text(result)
+    assert result.text.count("\n") == 2
+
+
+def test_text_without_indices_matches_joined_rows(matched):
+    mosaic, _ = matched
+    mosaic.tile_data = random_grid(mosaic.tile_data.shape)
+
+    assert mosaic.tile_indices is None
+    assert mosaic.text == old_text(mosaic)
+
+
+def test_text_with_multi_character_entries(matched):
+    mosaic, best = matched
+    mosaic = text_mosaic.TextMosaic(
+        mosaic.tile_data, np.asarray(["..", "::", "##", "  "]), mosaic.image_mosaic
+    )
+
+    result = mosaic.apply_tiles(tiles_of(4), best)
+
+    assert result.text == old_text(result)
+
+
+@pytest.mark.parametrize("changes", [1, 5, 40, 150])
+def test_diff_reproduces_the_target_frame(changes):
+    previous = random_grid((10, 30), seed=0)
+    current = previous.copy()
+    rng = np.random.default_rng(changes)
+    cells = rng.choice(previous.size, changes, replace=False)
+    current.flat[cells] = random_grid(changes, seed=changes, characters="xyz")
+    screen = Screen(*previous.shape)
+    screen.feed(terminal.draw(previous))
+
+    screen.feed(terminal.diff(previous, current))
+
+    np.testing.assert_array_equal(screen.cells, current)
+
+
+def test_diff_of_identical_frames_is_empty():
+    grid = random_grid((4, 6))
+
+    assert terminal.diff(grid, grid.copy()) == ""
+
+
+def test_diff_redraws_frames_of_another_shape():
+    previous = random_grid((6, 10), seed=0)
+    current = random_grid((4, 8), seed=1)
+    screen = Screen(6, 10)
+    screen.feed(terminal.draw(previous))
+
+    screen.feed(terminal.diff(previous, current))
+
+    np.testing.assert_array_equal(screen.cells[:4, :8], current)
+    assert (screen.cells[4:] == " ").all()
+    assert (screen.cells[:, 8:] == " ").all()
+
+
+class FakeClock:
+    def __init__(self, step=0.0):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        # each reading costs step seconds, as if drawing took that long
+        self.now += self.step
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def frames(n_frames=5, shape=(6, 12)):
+    first = random_grid(shape, seed=0)
+    result = [first]
+    for seed in range(1, n_frames):
+        frame = result[-1].copy()
+        frame[seed % shape[0], seed:] = "x"
+        result.append(frame)
+    return result
+
+
+def test_player_shows_every_frame_in_order():
+    clock = FakeClock()
+    out = io.StringIO()
+    player = terminal.TerminalPlayer(
+        frames(), fps=10, out=out, loop=False, clock=clock, sleep=clock.sleep
+    )
+    seen = []
+    screen = Screen(6, 12)
+
+    def should_continue():
+        screen.feed(out.getvalue())
+        out.seek(0)
+        out.truncate()
+        seen.append(screen.cells.copy())
+        return True
+
+    player.play(should_continue)
+
+    # should_continue runs before each frame, so the last check sees the last frame
+    for expected, actual in zip(player.frames, seen):
+        np.testing.assert_array_equal(actual, expected)
+    assert (player.shown, player.dropped) == (5, 0)
+    # the last frame stays up for one interval before playback ends
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_player_drops_late_frames_and_still_ends_on_the_right_frame():
+    clock = FakeClock(step=0.25)
+    out = io.StringIO()
+    player = terminal.TerminalPlayer(
+        frames(8), fps=10, out=out, loop=False, clock=clock, sleep=clock.sleep
+    )
+    screen = Screen(6, 12)
+    on_screen = []
+
+    def should_continue():
+        screen.feed(out.getvalue())
+        out.seek(0)
+        out.truncate()
+        on_screen.append(screen.cells.copy())
+        return True
+
+    player.play(should_continue)
+
+    assert player.dropped > 0
+    assert player.shown + player.dropped == len(player.frames)
+    # whichever frames were skipped, each one drawn is complete
+    assert all(
+        any((cells == frame).all() for frame in player.frames) for cells in on_screen
+    )
+    np.testing.assert_array_equal(on_screen[-1], player.frames[-1])
+
+
+def test_player_rejects_empty_animations():
+    with pytest.raises(ValueError):
+        terminal.TerminalPlayer([], fps=10)
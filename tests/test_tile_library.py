@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rusty_mosaic import tile_library
+
+
+def write_tile(path, seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (20, 20), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+@pytest.fixture
+def tile_dir(tmp_path):
+    directory = tmp_path / "tiles"
+    directory.mkdir()
+    for number in range(6):
+        write_tile(directory / f"tile{number}.png", number)
+    return directory
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    """The names of the tiles every call to _process_tiles decodes"""
+    names = []
+    process_tiles = tile_library.TileLibrary._process_tiles.__func__
+
+    def counting(cls, image_paths, *args, **kwargs):
+        names.extend(path.name for path in image_paths)
+        return process_tiles(cls, image_paths, *args, **kwargs)
+
+    monkeypatch.setattr(
+        tile_library.TileLibrary, "_process_tiles", classmethod(counting)
+    )
+    return names
+
+
+def build(tile_dir, cache_dir, tile_size=8):
+    return tile_library.TileLibrary.from_directory(
+        tile_dir, tile_size=tile_size, cache_dir=cache_dir, workers=1
+    )
+
+
+def test_cached_library_matches_an_uncached_one(tile_dir, tmp_path, processed):
+    uncached = build(tile_dir, None)
+    cold = build(tile_dir, tmp_path / "cache")
+    warm = build(tile_dir, tmp_path / "cache")
+    np.testing.assert_array_equal(cold.tile_data, uncached.tile_data)
+    np.testing.assert_array_equal(warm.tile_data, uncached.tile_data)
+    assert warm.tile_names == uncached.tile_names
+    # the uncached and the cold build decode every tile, the warm build none
+    assert len(processed) == 12
+    assert isinstance(warm.tile_data, np.memmap)
+
+
+def test_only_stale_files_are_processed_again(tile_dir, tmp_path, processed):
+    cache_dir = tmp_path / "cache"
+    build(tile_dir, cache_dir)
+    processed.clear()
+
+    changed = tile_dir / "tile2.png"
+    write_tile(changed, 100)
+    stat = changed.stat()
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    write_tile(tile_dir / "tile9.png", 9)
+    (tile_dir / "tile4.png").unlink()
+
+    updated = build(tile_dir, cache_dir)
+    assert sorted(processed) == ["tile2.png", "tile9.png"]
+    processed.clear()
+    np.testing.assert_array_equal(updated.tile_data, build(tile_dir, None).tile_data)
+    # the replaced data file is removed, one manifest and one data file remain
+    assert sorted(path.suffix for path in cache_dir.iterdir()) == [".json", ".npy"]
+
+
+def test_each_tile_size_has_its_own_cache(tile_dir, tmp_path, processed):
+    cache_dir = tmp_path / "cache"
+    build(tile_dir, cache_dir, tile_size=8)
+    processed.clear()
+    assert build(tile_dir, cache_dir, tile_size=4).tile_data.shape == (6, 16)
+    assert len(processed) == 6
+    processed.clear()
+    build(tile_dir, cache_dir, tile_size=8)
+    assert not processed
+
+
+def test_processing_version_is_part_of_the_key(
+    tile_dir, tmp_path, processed, monkeypatch
+):
+    cache_dir = tmp_path / "cache"
+    build(tile_dir, cache_dir)
+    processed.clear()
+    monkeypatch.setattr(
+        tile_library, "PROCESSING_VERSION", tile_library.PROCESSING_VERSION + 1
+    )
+    build(tile_dir, cache_dir)
+    assert len(processed) == 6
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from PIL import Image
+from PIL import ImageSequence
+
+from rusty_mosaic import writers
+from rusty_mosaic import tile_library
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB"])
+def test_png_writer_matches_pil(tmp_path, mode):
+    shape = (37, 23) if mode == "L" else (37, 23, 3)
+    pixmap = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    outfile = tmp_path / "out.png"
+    with writers.PngWriter(outfile, 23, 37, mode) as writer:
+        for start, stop in [(0, 5), (5, 5), (5, 21), (21, 37)]:
+            writer.write(pixmap[start:stop])
+    with Image.open(outfile) as image:
+        assert image.mode == mode
+        np.testing.assert_array_equal(np.asarray(image), pixmap)
+
+
+def test_png_writer_removes_partial_file_and_keeps_the_error(tmp_path):
+    outfile = tmp_path / "out.png"
+    with pytest.raises(RuntimeError, match="comparator failed"):
+        with writers.PngWriter(outfile, 4, 4) as writer:
+            writer.write(np.zeros((2, 4), dtype=np.uint8))
+            raise RuntimeError("comparator failed")
+    assert not outfile.exists()
+
+
+def test_png_writer_rejects_missing_rows(tmp_path):
+    outfile = tmp_path / "out.png"
+    with pytest.raises(ValueError, match="Only 2 of 4 rows"):
+        with writers.PngWriter(outfile, 4, 4) as writer:
+            writer.write(np.zeros((2, 4), dtype=np.uint8))
+    assert not outfile.exists()
+
+
+@pytest.mark.parametrize("mode, suffix", [("L", ".pgm"), ("RGB", ".ppm")])
+def test_pnm_writer_matches_pil(tmp_path, mode, suffix):
+    shape = (37, 23) if mode == "L" else (37, 23, 3)
+    pixmap = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    outfile = tmp_path / f"out{suffix}"
+    with writers.open_strip_writer(outfile, 23, 37, mode) as writer:
+        for start, stop in [(0, 5), (5, 5), (5, 21), (21, 37)]:
+            writer.write(pixmap[start:stop])
+    with Image.open(outfile) as image:
+        assert image.mode == mode
+        np.testing.assert_array_equal(np.asarray(image), pixmap)
+
+
+@pytest.mark.parametrize(
+    "bands, error",
+    [
+        ([np.zeros((2, 4))], "Only 2 of 4 rows"),
+        ([np.zeros((3, 4)), np.zeros((2, 4))], "More rows"),
+        ([np.zeros((4, 5))], "do not match the image width"),
+        ([np.zeros((4, 4, 3))], "do not match the image width"),
+    ],
+)
+def test_pnm_writer_removes_the_file_when_rows_do_not_fit(tmp_path, bands, error):
+    outfile = tmp_path / "out.pgm"
+    with pytest.raises(ValueError, match=error):
+        with writers.PnmWriter(outfile, 4, 4) as writer:
+            for band in bands:
+                writer.write(band)
+    assert not outfile.exists()
+
+
+def compose(tile_data, tile_size, grid):
+    rows, cols = grid.shape
+    tiles = tile_data[grid].reshape(rows, cols, tile_size, tile_size)
+    return tiles.transpose(0, 2, 1, 3).reshape(rows * tile_size, cols * tile_size)
+
+
+def test_tile_gif_writer_decodes_to_the_tiles(tmp_path):
+    tiles = tile_library.TileLibrary.from_directory(tile_size=8)
+    palette = tiles.gif_palette
+    assert palette.exact
+
+    rng = np.random.default_rng(0)
+    grid = rng.integers(0, len(tiles.tile_data), (4, 6))
+    grids = [grid]
+    for changes in (3, 0, 1, 24, 0):
+        grid = grid.copy()
+        rows = rng.integers(0, 4, changes)
+        cols = rng.integers(0, 6, changes)
+        grid[rows, cols] = rng.integers(0, len(tiles.tile_data), changes)
+        grids.append(grid)
+
+    outfile = tmp_path / "out.gif"
+    with writers.TileGifWriter(outfile, palette, fps=10) as writer:
+        for grid in grids:
+            writer.write(grid)
+
+    # frames without changes extend the previous frame instead of being written
+    expected = [grids[0]] + [
+        grid for previous, grid in zip(grids, grids[1:]) if (grid != previous).any()
+    ]
+    assert writer.frames == len(grids)
+    assert writer.written == len(expected)
+    with Image.open(outfile) as image:
+        assert image.n_frames == len(expected)
+        durations = []
+        for frame, grid in zip(ImageSequence.Iterator(image), expected):
+            np.testing.assert_array_equal(
+                np.asarray(frame.convert("L")),
+                compose(tiles.tile_data, 8, grid),
+            )
+            durations.append(frame.info["duration"])
+    assert sum(durations) == 100 * len(grids)